@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of torrent_dl import each other by name, as when run as scripts
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "torrent_dl"))
@@ -0,0 +1,35 @@
+import pytest
+
+from torrent_dl.bdecode import DecodeError, Decoder, decode
+
+
+def test_decode() -> None:
+    assert decode(b"i42e") == 42
+    assert decode(b"i-7e") == -7
+    assert decode(b"4:spam") == b"spam"
+    assert decode(b"0:") == b""
+    assert decode(b"l4:spami1ee") == [b"spam", 1]
+    assert decode(b"d3:bar4:spam3:fooi42ee") == {b"bar": b"spam", b"foo": 42}
+    assert decode(bytearray(b"le")) == []
+
+
+@pytest.mark.parametrize(
+    "data", [b"", b"i03e", b"i-0e", b"ie", b"5:spam", b"l4:spam", b"i1ei2e", b"x"]
+)
+def test_decode_invalid(data: bytes) -> None:
+    with pytest.raises(DecodeError):
+        decode(data)
+
+
+def test_decode_too_deep() -> None:
+    with pytest.raises(DecodeError):
+        decode(b"l" * 100 + b"e" * 100)
+
+
+def test_spans() -> None:
+    data: bytes = b"d8:announce3:url4:infod4:name1:xee"
+    decoder = Decoder(data)
+    decoder.decode()
+
+    start, end = decoder.spans[b"info"]
+    assert data[start:end] == b"d4:name1:xe"
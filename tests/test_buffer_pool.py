@@ -0,0 +1,23 @@
+from torrent_dl.buffer_pool import BufferPool
+
+
+def test_buffer_pool() -> None:
+    pool = BufferPool(100)
+    first = pool.get(40)
+    second = pool.get(40)
+    assert first is not None and second is not None
+    assert not pool.available(40)
+    assert pool.get(40) is None
+
+    # free buffers are reused for the same size
+    pool.put(first)
+    assert pool.get(40) is first
+
+    # and dropped when another size needs their room
+    pool.put(first)
+    pool.put(second)
+    third = pool.get(60)
+    assert third is not None and len(third) == 60
+    assert pool.allocated == 100
+    assert pool.get(40) is not None
+    assert pool.get(40) is None
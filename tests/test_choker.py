@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+from typing import List
+
+from torrent_dl.choker import Choker
+
+
+class FakePeer:
+    def __init__(self, download_rate: float, upload_rate: float = 0.0) -> None:
+        self.download_bucket = SimpleNamespace(rate=download_rate)
+        self.upload_bucket = SimpleNamespace(rate=upload_rate)
+        self.peer_interseted: bool = True
+        self.healthy: bool = True
+        self.am_choking: bool = True
+        self.sent: List[str] = []
+
+    def choke(self) -> None:
+        if not self.am_choking:
+            self.am_choking = True
+            self.sent.append("choke")
+
+    def unchoke(self) -> None:
+        if self.am_choking:
+            self.am_choking = False
+            self.sent.append("unchoke")
+
+
+def test_choker() -> None:
+    peers = [FakePeer(rate, upload_rate=-rate) for rate in range(6)]
+    seeding = False
+    choker = Choker(peers, lambda: seeding, slots=2)
+
+    choker.rechoke()
+    # the two fastest peers and one of the others
+    assert not peers[5].am_choking and not peers[4].am_choking
+    assert choker.optimistic in peers[:4]
+    assert choker.unchoked == 3
+
+    # nothing is sent when nothing changes
+    optimistic = choker.optimistic
+    choker.rechoke()
+    assert peers[5].sent == ["unchoke"]
+    assert choker.optimistic is optimistic
+
+    # seeding ranks by upload rate
+    seeding = True
+    choker.rechoke()
+    assert not peers[0].am_choking and not peers[1].am_choking
+    assert peers[5].am_choking or choker.optimistic is peers[5]
+
+    # peers that are not interested are choked
+    for peer in peers:
+        peer.peer_interseted = False
+    choker.rechoke()
+    assert choker.unchoked == 0
+    assert choker.optimistic is None
+
+
+def test_choker_free_slot() -> None:
+    peers = [FakePeer(0) for _ in range(3)]
+    choker = Choker(peers, lambda: False, slots=1)
+    for peer in peers:
+        choker.on_interested(peer)
+    # a regular and an optimistic slot
+    assert choker.unchoked == 2
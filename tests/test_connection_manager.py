@@ -0,0 +1,157 @@
+import asyncio
+from typing import Dict, List
+
+import pytest
+
+from torrent_dl import peer_pool
+from torrent_dl.connection_manager import ConnectionLimit, ConnectionManager
+from torrent_dl.peer_pool import Candidate, PeerPool
+
+
+class FakePeer:
+    def __init__(self, candidate: Candidate) -> None:
+        self.ip: str = candidate.ip
+        self.handshaked: bool = False
+        self.latency: float = 0.1
+        loop = asyncio.get_running_loop()
+        self.connected: asyncio.Future = loop.create_future()
+        self.dropped: asyncio.Future = loop.create_future()
+
+    async def connect(self) -> bool:
+        return await self.connected
+
+
+class Swarm:
+    """the peers a connection manager creates, by ip"""
+
+    def __init__(self, *ips: str) -> None:
+        self.pool: PeerPool = PeerPool()
+        for ip in ips:
+            self.pool.add(ip, 6881)
+        self.peers: Dict[str, FakePeer] = {}
+        self.created: List[str] = []
+
+    def create_peer(self, candidate: Candidate) -> FakePeer:
+        peer = FakePeer(candidate)
+        self.peers[candidate.ip] = peer
+        self.created.append(candidate.ip)
+        return peer
+
+    async def serve_peer(self, peer: FakePeer) -> None:
+        peer.handshaked = True
+        await peer.dropped
+
+    def manager(self, **kwargs) -> ConnectionManager:
+        return ConnectionManager(self.pool, self.create_peer, self.serve_peer, **kwargs)
+
+
+async def settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_connection_manager_slots() -> None:
+    async def run() -> None:
+        swarm = Swarm(*(f"10.0.0.{i}" for i in range(1, 11)))
+        manager = swarm.manager(max_connections=4, max_half_open=2)
+
+        def check(half_open: int, connected: int) -> None:
+            assert (manager.half_open, manager.connected) == (half_open, connected)
+            assert manager.limit.used == len(manager.tasks) == half_open + connected
+
+        manager.fill()
+        await settle()
+        check(2, 0)
+        first, second = swarm.created
+
+        # a failed connection is replaced right away, its candidate backs off
+        swarm.peers[first].connected.set_result(False)
+        await settle()
+        check(2, 0)
+        assert swarm.pool.candidates[(first, 6881)].failures == 1
+
+        # connected peers leave room for more half open connections, up to the
+        # connection limit
+        for ip in list(swarm.peers):
+            if not swarm.peers[ip].connected.done():
+                swarm.peers[ip].connected.set_result(True)
+        await settle()
+        check(2, 2)
+        for ip in list(swarm.peers):
+            if not swarm.peers[ip].connected.done():
+                swarm.peers[ip].connected.set_result(True)
+        await settle()
+        check(0, 4)
+        assert len(swarm.created) == 5
+
+        # a dropped peer frees its slot for the next candidate
+        swarm.peers[second].dropped.set_result(None)
+        await settle()
+        check(1, 3)
+        assert swarm.pool.candidates[(second, 6881)].latency == 0.1
+        assert len(swarm.created) == 6 and not manager.can_accept
+
+        await manager.close()
+        check(0, 0)
+        assert manager.limit.managers == []
+
+    asyncio.run(run())
+
+
+def test_connection_manager_retry(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(peer_pool, "RETRY_DELAY", 0.05)
+
+    async def run() -> None:
+        swarm = Swarm("10.0.0.1")
+        manager = swarm.manager()
+        manager.fill()
+        await settle()
+        swarm.peers["10.0.0.1"].connected.set_result(False)
+        await settle()
+
+        # the pool is empty until the candidate is out of its backoff, a single
+        # wake up is scheduled for it
+        handle = manager.retry_handle
+        assert handle is not None
+        manager.fill()
+        assert manager.retry_handle is handle
+        assert swarm.created == ["10.0.0.1"]
+
+        await asyncio.sleep(0.1)
+        assert swarm.created == ["10.0.0.1"] * 2
+        assert manager.retry_handle is None and manager.half_open == 1
+        await manager.close()
+
+    asyncio.run(run())
+
+
+def test_connection_limit_shared() -> None:
+    async def run() -> None:
+        limit = ConnectionLimit(2)
+        first, second = Swarm("10.0.0.1", "10.0.0.2"), Swarm("10.0.1.1")
+        first_manager = first.manager(limit=limit)
+        second_manager = second.manager(limit=limit)
+
+        # the first torrent takes every slot of the session
+        first_manager.fill()
+        second_manager.fill()
+        await settle()
+        for peer in first.peers.values():
+            peer.connected.set_result(True)
+        await settle()
+        assert limit.used == 2 and first_manager.connected == 2
+        assert second.created == [] and not second_manager.can_accept
+
+        # a slot freed by the first torrent goes to the second one
+        first.peers["10.0.0.1"].dropped.set_result(None)
+        await settle()
+        assert second.created == ["10.0.1.1"] and second_manager.half_open == 1
+        assert limit.used == 2
+
+        # and one of a closed torrent is never offered to it again
+        await first_manager.close()
+        assert limit.managers == [second_manager] and limit.used == 1
+        await second_manager.close()
+        assert limit.used == 0
+
+    asyncio.run(run())
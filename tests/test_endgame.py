@@ -0,0 +1,203 @@
+import asyncio
+from hashlib import sha1
+from typing import Dict, List, Tuple
+
+import bencodepy
+import pytest
+from bitstring import BitArray
+
+from torrent_dl.block import BLOCK_LENGTH
+from torrent_dl.main import DownloadManager
+from torrent_dl.message import Piece
+from torrent_dl.torrent import Torrent
+
+# a single piece of two blocks
+DATA: bytes = bytes(range(256)) * (2 * BLOCK_LENGTH // 256)
+
+
+class FakePeer:
+    def __init__(self, ip: str) -> None:
+        self.ip: str = ip
+        self.bitfield: BitArray = BitArray("0b1")
+        self.is_ready: bool = True
+        self.outstanding: Dict[Tuple[int, int], float] = {}
+        self.requests: List[Tuple[int, int, int]] = []
+        self.cancels: List[Tuple[int, int, int]] = []
+        self.am_interested: bool = False
+        self.interested: int = 0
+        self.max_outstanding: int = 8
+        self.timeout: float = 10
+        self.timed_out: int = 0
+
+    @property
+    def is_eligible(self) -> bool:
+        return len(self.outstanding) < self.max_outstanding
+
+    def has_piece(self, piece_index: int) -> bool:
+        return self.bitfield[piece_index]
+
+    def send_request(self, piece_index: int, block_begin: int, block_length: int):
+        self.outstanding[(piece_index, block_begin)] = (
+            asyncio.get_running_loop().time() + self.timeout
+        )
+        self.requests.append((piece_index, block_begin, block_length))
+
+    def send_cancel(self, piece_index: int, block_begin: int, block_length: int):
+        self.outstanding.pop((piece_index, block_begin), None)
+        self.cancels.append((piece_index, block_begin, block_length))
+
+    def send_have(self, piece_index: int) -> None:
+        pass
+
+    def send_interested(self) -> None:
+        self.am_interested = True
+        self.interested += 1
+
+    def request_timed_out(self) -> None:
+        self.max_outstanding = max(1, self.max_outstanding // 2)
+        self.timed_out += 1
+
+    def deliver(
+        self, manager: DownloadManager, block_begin: int, data: bytes = DATA
+    ) -> None:
+        self.outstanding.pop((0, block_begin), None)
+        block = data[block_begin : block_begin + BLOCK_LENGTH]
+        manager.on_block(self, Piece(0, block_begin, block))
+
+
+def make_torrent(data: bytes = DATA) -> Torrent:
+    info = {
+        b"name": b"data",
+        b"length": len(data),
+        b"piece length": len(data),
+        b"pieces": sha1(data).digest(),
+    }
+    torrent = Torrent()
+    torrent.open_from_bytes(
+        bencodepy.encode({b"announce": b"http://tracker/announce", b"info": info})
+    )
+    return torrent
+
+
+def test_endgame_cancels_duplicates(tmp_path) -> None:
+    async def run() -> DownloadManager:
+        manager = DownloadManager(make_torrent(), str(tmp_path), resume=False)
+        manager.done = asyncio.get_running_loop().create_future()
+        first, second = FakePeer("first"), FakePeer("second")
+        manager.peer_manager.peers.extend([first, second])
+
+        # the first peer gets every block, which starts the endgame
+        manager.request_peer_blocks(first)
+        assert first.requests == [(0, 0, BLOCK_LENGTH), (0, BLOCK_LENGTH, BLOCK_LENGTH)]
+        assert manager.piece_manager.in_endgame
+
+        # the second one is asked for the same blocks
+        manager.request_peer_blocks(second)
+        assert second.requests == first.requests
+
+        # whoever delivers a block first, the other one is sent a Cancel
+        first.deliver(manager, 0)
+        assert second.cancels == [(0, 0, BLOCK_LENGTH)]
+        assert first.cancels == []
+        second.deliver(manager, BLOCK_LENGTH)
+        assert first.cancels == [(0, BLOCK_LENGTH, BLOCK_LENGTH)]
+        assert not first.outstanding and not second.outstanding
+
+        # a copy that crossed the Cancel is counted and dropped
+        second.deliver(manager, 0)
+        assert manager.piece_manager.duplicate_bytes == BLOCK_LENGTH
+
+        await asyncio.wait_for(manager.done, 5)
+        manager.timeouts.close()
+        manager.piece_manager.close()
+        return manager
+
+    manager = asyncio.run(run())
+    assert manager.piece_manager.all_pieces_completed
+    assert (tmp_path / "data").read_bytes() == DATA
+
+
+@pytest.mark.parametrize("seed", [False, True])
+def test_complete_download_seeds(tmp_path, seed: bool) -> None:
+    (tmp_path / "data").write_bytes(DATA)
+
+    async def run() -> None:
+        manager = DownloadManager(make_torrent(), str(tmp_path), seed=seed)
+        assert manager.seeding
+
+        # no listening socket and no tracker
+        manager.peer_manager.incoming.start = lambda: asyncio.sleep(0)  # type: ignore
+        manager.peer_manager.announcer.run = lambda: asyncio.sleep(0)  # type: ignore
+        task = asyncio.ensure_future(manager.run())
+        await asyncio.sleep(0.05)
+        assert task.done() is not seed
+        assert manager.peer_manager.get_params()["left"] == 0
+
+        manager.stop()
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(run())
+
+
+def test_interested_in_missing_pieces(tmp_path) -> None:
+    async def run() -> None:
+        manager = DownloadManager(make_torrent(), str(tmp_path), resume=False)
+        with_bitfield, with_have, empty = (FakePeer(n) for n in ("a", "b", "c"))
+        empty.bitfield = BitArray("0b0")
+
+        # interest is shown once, on a bitfield or on the first have
+        manager.on_bitfield(with_bitfield)
+        manager.on_bitfield(empty)
+        manager.on_have(with_have, 0)
+        manager.on_have(with_have, 0)
+        assert (with_bitfield.interested, with_have.interested) == (1, 1)
+        assert empty.interested == 0 and not empty.am_interested
+
+        # nothing is wanted from anybody once every piece is there
+        for block_begin in (0, BLOCK_LENGTH):
+            with_bitfield.deliver(manager, block_begin)
+        await asyncio.sleep(0.1)
+        assert manager.seeding
+        seeder = FakePeer("d")
+        manager.on_bitfield(seeder)
+        manager.on_have(empty, 0)
+        assert seeder.interested == empty.interested == 0
+
+        manager.timeouts.close()
+        manager.piece_manager.close()
+
+    asyncio.run(run())
+
+
+def test_request_timeout_moves_block(tmp_path) -> None:
+    data: bytes = DATA * 2
+
+    async def run() -> None:
+        manager = DownloadManager(make_torrent(data), str(tmp_path), resume=False)
+        slow, other = FakePeer("slow"), FakePeer("other")
+        manager.peer_manager.peers.append(slow)
+
+        # only the first two requests of the slow peer are left unanswered
+        slow.max_outstanding, slow.timeout = 2, 0.05
+        manager.request_peer_blocks(slow)
+        slow.timeout = 10
+        slow.deliver(manager, BLOCK_LENGTH, data)
+        assert [r[1] for r in slow.requests] == [0, BLOCK_LENGTH, 2 * BLOCK_LENGTH]
+        manager.peer_manager.peers.insert(0, other)
+
+        # the expired request is cancelled and the block requested from the
+        # other peer, the slow one queues less and is left alone
+        await asyncio.sleep(0.2)
+        assert slow.cancels == [(0, 0, BLOCK_LENGTH)] and slow.timed_out == 1
+        assert len(slow.requests) == 3 and list(slow.outstanding) == [
+            (0, 2 * BLOCK_LENGTH)
+        ]
+        assert other.requests == [
+            (0, 0, BLOCK_LENGTH),
+            (0, 3 * BLOCK_LENGTH, BLOCK_LENGTH),
+        ]
+
+        manager.timeouts.close()
+        manager.piece_manager.close()
+
+    asyncio.run(run())
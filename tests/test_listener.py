@@ -0,0 +1,42 @@
+import asyncio
+from typing import List
+
+from torrent_dl import message
+from torrent_dl.listener import Listener
+
+
+def test_listener() -> None:
+    routed: List[bytes] = []
+
+    def route(info_hash: bytes, transport: asyncio.Transport, handshake: bytes):
+        routed.append(info_hash)
+        return False
+
+    async def closed(port: int, payload: bytes) -> bool:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(payload)
+        data: bytes = await asyncio.wait_for(reader.read(), 1)
+        writer.close()
+        return data == b""
+
+    async def run() -> None:
+        listener = Listener(0, route, max_pending=1)
+        await listener.start()
+
+        handshake = message.Handshake(b"i" * 20, b"p" * 20).to_bytes()
+        assert await closed(listener.port, handshake)
+        # not the bittorrent protocol
+        assert await closed(listener.port, b"\x13" + b"x" * 67)
+        assert routed == [b"i" * 20]
+
+        # a connection still sending its handshake takes the only pending slot
+        _, slow = await asyncio.open_connection("127.0.0.1", listener.port)
+        await asyncio.sleep(0.05)
+        assert len(listener.pending) == 1
+        assert await closed(listener.port, handshake)
+        assert routed == [b"i" * 20]
+
+        slow.close()
+        await listener.close()
+
+    asyncio.run(run())
@@ -0,0 +1,46 @@
+import pytest
+from bitstring import BitArray
+
+from torrent_dl import message
+
+
+def test_round_trip() -> None:
+    messages = [
+        message.KeepAlive(),
+        message.Choke(),
+        message.UnChoke(),
+        message.Interested(),
+        message.NotInterested(),
+        message.Have(7),
+        message.Bitfield(BitArray("0b1010000011")),
+        message.Request(1, 2 ** 14, 2 ** 14),
+        message.Piece(3, 0, b"block"),
+        message.Cancel(1, 2 ** 14, 2 ** 14),
+        message.Port(6881),
+    ]
+    buffer = bytearray(sum(msg.total_length for msg in messages) + 1)
+    offset = 1
+    for msg in messages:
+        msg.pack_into(buffer, offset)
+        frame = memoryview(buffer)[offset : offset + msg.total_length]
+        assert bytes(frame) == msg.to_bytes()
+        decoded = message.decode(frame)
+        assert type(decoded) is type(msg)
+        assert vars(decoded).keys() == vars(msg).keys()
+        offset += msg.total_length
+
+    assert message.decode(message.Have(7).to_bytes()).piece_index == 7
+    assert bytes(message.decode(message.Piece(3, 0, b"block").to_bytes()).block) == (
+        b"block"
+    )
+    bitfield = message.decode(message.Bitfield(BitArray("0b101")).to_bytes())
+    assert bitfield.bitfield.bin == "10100000"
+
+
+def test_invalid_messages() -> None:
+    with pytest.raises(ValueError):
+        message.decode(b"\x00\x00\x00\x01\x14")
+    with pytest.raises(ValueError):
+        message.decode(b"\x00\x00\x00\x02\x00\x00")
+    with pytest.raises(ValueError):
+        message.Handshake.from_bytes(b"\x13" + b"x" * 67)
@@ -0,0 +1,87 @@
+import asyncio
+from typing import List
+
+from torrent_dl import message
+from torrent_dl.block import BLOCK_LENGTH
+from torrent_dl.peer import (
+    MAX_REQUEST_QUEUE,
+    MIN_REQUEST_QUEUE,
+    REQUEST_QUEUE_TIME,
+    Peer,
+)
+
+
+class FakeTransport:
+    def __init__(self) -> None:
+        self.writes: List[bytes] = []
+        self.closed: bool = False
+
+    def writelines(self, buffers) -> None:
+        self.writes.append(b"".join(buffers))
+
+    def get_write_buffer_limits(self):
+        return (16384, 65536)
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_bad_handshake_closes() -> None:
+    async def run() -> None:
+        peer = Peer(None, "127.0.0.1", 6881, b"i" * 20, 8)
+        peer.transport = transport = FakeTransport()
+        peer.handshake_received = asyncio.get_running_loop().create_future()
+        peer.healthy = True
+        peer.process_message = lambda msg, peer: None
+
+        handshake = message.Handshake(b"x" * 20, b"p" * 20).to_bytes()
+        peer.read_buffer.get_buffer()[: len(handshake)] = handshake
+        peer.read_buffer.advance(len(handshake))
+        peer.process_messages()
+
+        assert transport.closed
+        assert not peer.healthy and not peer.handshaked
+        assert not peer.handshake_received.done()
+
+    asyncio.run(run())
+
+
+def test_request_queue_follows_rate(monkeypatch) -> None:
+    clock: List[float] = [0.0]
+    monkeypatch.setattr("torrent_dl.peer.time", lambda: clock[0])
+    peer = Peer(None, "127.0.0.1", 6881, b"i" * 20, 8)
+    assert peer.max_outstanding == MIN_REQUEST_QUEUE
+
+    def receive(blocks: int, seconds: float) -> None:
+        for i in range(blocks):
+            clock[0] += seconds / blocks
+            peer.outstanding[(0, i * BLOCK_LENGTH)] = 0.0
+            peer.handle_piece(message.Piece(0, i * BLOCK_LENGTH, bytes(BLOCK_LENGTH)))
+
+    # 1 MiB/s, averaged with the 0 of the start, makes 3 s worth of blocks
+    receive(64, 1.0)
+    assert peer.download_rate == 2 ** 19
+    assert peer.max_outstanding == 2 ** 19 * REQUEST_QUEUE_TIME // BLOCK_LENGTH
+    assert not peer.outstanding
+    receive(64, 1.0)
+    assert peer.max_outstanding == 3 * 2 ** 18 * REQUEST_QUEUE_TIME // BLOCK_LENGTH
+
+    # a timeout halves the queue and the rate
+    peer.request_timed_out()
+    assert peer.max_outstanding == 3 * 2 ** 17 * REQUEST_QUEUE_TIME // BLOCK_LENGTH
+    assert peer.download_rate == 3 * 2 ** 17
+
+    # a fast peer is capped, a slow one keeps the minimum
+    receive(2048, 1.0)
+    receive(2048, 1.0)
+    assert peer.max_outstanding == MAX_REQUEST_QUEUE
+    for _ in range(12):
+        peer.request_timed_out()
+    receive(1, 10.0)
+    assert peer.max_outstanding == MIN_REQUEST_QUEUE
+    for _ in range(3):
+        peer.request_timed_out()
+    assert peer.max_outstanding == MIN_REQUEST_QUEUE
@@ -0,0 +1,61 @@
+import socket
+import struct
+
+import pytest
+
+from torrent_dl import peer_pool
+from torrent_dl.peer_pool import PeerPool, decode_compact_peers, decode_compact_peers6
+
+
+def test_decode_compact_peers() -> None:
+    peers: bytes = socket.inet_aton("10.0.0.1") + struct.pack(">H", 6881)
+    peers += socket.inet_aton("192.168.1.20") + struct.pack(">H", 51413)
+
+    assert list(decode_compact_peers(peers)) == [
+        ("10.0.0.1", 6881),
+        ("192.168.1.20", 51413),
+    ]
+
+
+def test_decode_compact_peers6() -> None:
+    peers6: bytes = socket.inet_pton(socket.AF_INET6, "2001:db8::1")
+    peers6 += struct.pack(">H", 6881)
+
+    assert list(decode_compact_peers6(peers6)) == [("2001:db8::1", 6881)]
+
+
+def test_peer_pool(monkeypatch: pytest.MonkeyPatch) -> None:
+    now: float = 1000.0
+    monkeypatch.setattr(peer_pool, "monotonic", lambda: now)
+
+    pool = PeerPool()
+    compact: bytes = socket.inet_aton("10.0.0.1") + struct.pack(">H", 6881)
+    dictionary = [
+        {b"peer id": b"a" * 20, b"ip": b"10.0.0.1", b"port": 6881},
+        {b"peer id": b"b" * 20, b"ip": b"10.0.0.2", b"port": 6881},
+    ]
+
+    #### checklist ####
+    # 1. peers are deduplicated by (ip, port)
+    assert pool.add_peers(compact) == 1
+    assert pool.add_peers(dictionary) == 1
+    assert len(pool) == 2
+
+    # 2. peers are retried only after their backoff
+    first = pool.pop()
+    second = pool.pop()
+    assert pool.pop() is None
+    pool.connected(second, 0.01)
+    pool.disconnected(second)
+    pool.connect_failed(first)
+    assert pool.pop() is None
+    assert pool.next_retry() == peer_pool.RETRY_DELAY
+
+    # 3. peers that connected quickly are ranked first
+    now += peer_pool.RECONNECT_DELAY
+    assert pool.pop() is second
+    assert pool.pop() is first
+
+    # 4. the backoff grows with the failures
+    pool.connect_failed(first)
+    assert pool.next_retry() == 2 * peer_pool.RETRY_DELAY
@@ -0,0 +1,66 @@
+from typing import List
+
+from torrent_dl import message
+from torrent_dl.peer import Peer
+
+
+class FakeTransport:
+    def __init__(self, buffered: int = 0) -> None:
+        self.writes: List[bytes] = []
+        self.buffered: int = buffered
+
+    def writelines(self, buffers) -> None:
+        self.writes.append(b"".join(buffers))
+
+    def get_write_buffer_limits(self):
+        return (16384, 65536)
+
+    def get_write_buffer_size(self) -> int:
+        return self.buffered
+
+
+def test_send_coalesces_messages_and_blocks() -> None:
+    piece = bytes(range(256)) * 256
+    peer = Peer(None, "127.0.0.1", 6881, b"i" * 20, 8)
+    peer.transport = transport = FakeTransport()
+    peer.read_block = lambda index, begin, length: memoryview(piece)[
+        begin : begin + length
+    ]
+    peer.am_choking = False
+
+    for begin in range(0, 4 * 2 ** 14, 2 ** 14):
+        peer.write(message.Request(0, begin, 2 ** 14))
+        peer.handle_request(message.Request(1, begin, 2 ** 14))
+    peer.handle_cancel(message.Cancel(1, 2 ** 14, 2 ** 14))
+    peer.send()
+
+    # the requests and the blocks up to the high-water mark in one write
+    expected = b"".join(
+        message.Request(0, begin, 2 ** 14).to_bytes()
+        for begin in range(0, 4 * 2 ** 14, 2 ** 14)
+    ) + b"".join(
+        message.Piece(1, begin, piece[begin : begin + 2 ** 14]).to_bytes()
+        for begin in (0, 2 * 2 ** 14, 3 * 2 ** 14)
+    )
+    assert transport.writes == [expected]
+    assert peer.uploaded == 3 * 2 ** 14
+    assert not peer.uploads and not peer.outgoing
+
+
+def test_send_at_high_water_mark() -> None:
+    piece = bytes(2 ** 16)
+    peer = Peer(None, "127.0.0.1", 6881, b"i" * 20, 8)
+    # exactly at the mark asyncio does not pause writing
+    peer.transport = transport = FakeTransport(buffered=65536)
+    peer.read_block = lambda index, begin, length: memoryview(piece)[
+        begin : begin + length
+    ]
+    peer.am_choking = False
+    for begin in range(0, 4 * 2 ** 14, 2 ** 14):
+        peer.handle_request(message.Request(0, begin, 2 ** 14))
+
+    # one block goes, which takes the transport over the mark, and send returns
+    peer.send()
+    assert len(transport.writes) == 1
+    assert peer.uploaded == 2 ** 14
+    assert len(peer.uploads) == 3 and peer.writing
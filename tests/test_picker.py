@@ -0,0 +1,95 @@
+from bitstring import BitArray
+
+from torrent_dl.picker import RANDOM_FIRST_PIECES, SPARSE_PIECES, PiecePicker
+
+
+def bits(total: int, *pieces: int) -> BitArray:
+    bitfield = BitArray(total)
+    bitfield.set(1, pieces)
+    return bitfield
+
+
+def test_picker_availability() -> None:
+    picker = PiecePicker(4)
+    picker.add_bitfield(bits(8, 0, 1, 2, 7))
+    picker.add_bitfield(bits(8, 1, 2))
+    picker.add_have(2)
+    assert picker.availability == [1, 2, 3, 0]
+    assert picker.buckets[:4] == [{3}, {0}, {1}, {2}]
+
+    picker.remove_bitfield(bits(8, 1, 2))
+    assert picker.availability == [1, 1, 2, 0]
+    assert picker.buckets[:3] == [{3}, {0, 1}, {2}]
+
+
+def test_picker_rarest_first() -> None:
+    picker = PiecePicker(100)
+    picker.completed = RANDOM_FIRST_PIECES
+    everything = bits(100, *range(100))
+    picker.add_bitfield(everything)
+    picker.add_bitfield(everything)
+    picker.add_bitfield(bits(100, *range(10, 100)))
+    picker.add_bitfield(bits(100, *range(20, 100)))
+
+    # a sparse peer is looked at through its pieces, a dense one through the
+    # buckets
+    assert picker.pick(bits(100, 5, 15, 25)) == 5
+    assert picker.pick(bits(100, 15, 25, 95)) == 15
+    assert everything.count(1) > SPARSE_PIECES
+    assert picker.pick(everything) in set(range(10)) - {5}
+    assert picker.pick(bits(100)) is None
+
+
+def test_picker_partial_and_complete() -> None:
+    picker = PiecePicker(3)
+    picker.add_bitfield(bits(3, 0, 1, 2))
+    picker.mark_partial(2)
+    picker.mark_partial(0)
+    assert picker.partial_pieces() == [2, 0]
+
+    # started pieces are out of the buckets and never picked as new ones
+    assert picker.pick(bits(3, 0, 1, 2)) == 1
+    assert picker.pick(bits(3, 0, 1, 2)) is None
+
+    # announced by more peers after it was started
+    picker.add_have(2)
+    picker.add_have(2)
+    picker.mark_complete(2)
+    picker.mark_complete(2)
+    assert picker.completed == 1
+    assert picker.partial_pieces() == [0, 1]
+
+    # a completed piece stays out of the buckets whatever peers announce
+    picker.add_have(2)
+    picker.remove_bitfield(bits(3, 2))
+    picker.add_have(2)
+    assert all(2 not in bucket for bucket in picker.buckets)
+    picker.mark_partial(2)
+    assert 2 not in picker.partial_pieces()
+
+
+def test_picker_random_first() -> None:
+    picker = PiecePicker(50)
+    picker.add_bitfield(bits(50, 7, 8))
+    picked = {picker.pick(bits(50, 7, 8)), picker.pick(bits(50, 7, 8))}
+    assert picked == {7, 8}
+    assert picker.pick(bits(50, 7, 8)) is None
+
+
+def test_picker_requestable() -> None:
+    picker = PiecePicker(3)
+    picker.mark_partial(0)
+    picker.mark_partial(1)
+    assert picker.requestable_pieces() == [0, 1]
+
+    # a fully requested piece is left out until one of its blocks is freed
+    picker.mark_requested(0)
+    assert picker.requestable_pieces() == [1]
+    picker.mark_free(0)
+    assert picker.requestable_pieces() == [1, 0]
+
+    # a piece never started or already completed is never requestable
+    picker.mark_free(2)
+    picker.mark_complete(1)
+    picker.mark_free(1)
+    assert picker.requestable_pieces() == [0]
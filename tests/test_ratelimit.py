@@ -0,0 +1,76 @@
+import asyncio
+from typing import Dict, List
+
+from torrent_dl.ratelimit import MIN_BURST, Throttle, TokenBucket
+
+
+def test_token_bucket() -> None:
+    session = TokenBucket(limit=MIN_BURST * 10)
+    torrent = TokenBucket(parent=session)
+    peer = TokenBucket(parent=torrent)
+
+    # a byte of the peer counts against the torrent and the session
+    peer.consume(MIN_BURST * 10)
+    assert torrent.transferred == session.transferred == MIN_BURST * 10
+    assert peer.wait_time() == 0
+
+    # only the session is limited, it is in debt for about a second
+    peer.consume(MIN_BURST * 10)
+    assert 0.9 < peer.wait_time() <= 1.0
+    assert torrent.wait_time() > 0
+    assert peer.available() < 0
+
+    # an unlimited bucket never waits
+    assert TokenBucket().wait_time() == 0
+    assert TokenBucket().available() is None
+
+
+def test_throttle() -> None:
+    resumed: List[str] = []
+
+    async def run() -> None:
+        bucket = TokenBucket(limit=MIN_BURST * 20)
+        bucket.consume(MIN_BURST * 21)
+        throttle = Throttle(tick=0.01)
+        throttle.wait(bucket, lambda: resumed.append("peer"))
+        throttle.wait(TokenBucket(parent=bucket), lambda: resumed.append("child"))
+        cancelled = lambda: resumed.append("cancelled")  # noqa: E731
+        throttle.wait(bucket, cancelled)
+        throttle.cancel(cancelled)
+
+        await asyncio.sleep(0.02)
+        assert resumed == []
+        await asyncio.sleep(0.1)
+        assert throttle.timer is None
+        throttle.close()
+
+    asyncio.run(run())
+    assert resumed == ["peer", "child"]
+
+
+def test_throttle_earliest_first() -> None:
+    resumed: Dict[str, float] = {}
+
+    async def run() -> None:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        throttle = Throttle(tick=0.01)
+
+        def waiter(name: str, wait: float) -> None:
+            bucket = TokenBucket(limit=MIN_BURST * 20)
+            bucket.consume(int(MIN_BURST * 20 * (1 + wait)))
+            throttle.wait(bucket, lambda: resumed.setdefault(name, loop.time()))
+
+        # the second waiter needs an earlier wake-up than the armed timer
+        waiter("upload", 0.5)
+        waiter("download", 0.02)
+        waiter("other", 0.1)
+        await asyncio.sleep(0.6)
+        throttle.close()
+        for name in resumed:
+            resumed[name] -= started
+
+    asyncio.run(run())
+    assert resumed["download"] < 0.1
+    assert 0.1 <= resumed["other"] < 0.3
+    assert resumed["upload"] >= 0.5
@@ -0,0 +1,37 @@
+import os
+from types import SimpleNamespace
+
+from torrent_dl.read_cache import ReadCache
+from torrent_dl.storage import Storage
+
+
+def test_read_cache(tmp_path) -> None:
+    data = os.urandom(100)
+    torrent = SimpleNamespace(
+        piece_length=40,
+        total_length=len(data),
+        name="cache",
+        is_multi_file=True,
+        files=[{"path": "a", "length": 30}, {"path": "b/c", "length": 70}],
+    )
+    storage = Storage(torrent, str(tmp_path))
+    for piece_index in range(3):
+        storage.write_piece(piece_index, data[piece_index * 40 : piece_index * 40 + 40])
+
+    cache = ReadCache(storage, max_bytes=80)
+    # the first piece spans both files, the last one is short
+    assert cache.get(0, 40) == data[:40]
+    assert cache.get(2, 20) == data[80:]
+    assert cache.get(0, 40) == data[:40]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # the least recently used piece makes room
+    assert cache.get(1, 40) == data[40:80]
+    assert list(cache.pieces) == [0, 1]
+
+    storage.close()
+
+    # nothing written there yet
+    empty = Storage(torrent, str(tmp_path / "empty"))
+    assert ReadCache(empty).get(0, 40) is None
+    empty.close()
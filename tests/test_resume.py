@@ -0,0 +1,85 @@
+import os
+from hashlib import sha1
+from types import SimpleNamespace
+
+from bitstring import BitArray
+
+from torrent_dl.resume import ResumeFile, verify_pieces
+from torrent_dl.storage import Storage
+from torrent_dl.torrent import PieceHashes
+
+# pieces of 4 bytes, the second one spans both files
+DATA: bytes = b"abcdefghijk"
+FILES = [{"path": "a", "length": 6}, {"path": "b", "length": 5}]
+
+
+def make_storage(tmp_path) -> Storage:
+    torrent = SimpleNamespace(
+        name="name",
+        files=FILES,
+        is_multi_file=True,
+        piece_length=4,
+        total_length=len(DATA),
+    )
+    return Storage(torrent, str(tmp_path))
+
+
+def write_files(storage: Storage, data: bytes = DATA) -> None:
+    os.makedirs(os.path.dirname(storage.paths[0]), exist_ok=True)
+    with open(storage.paths[0], "wb") as _file:
+        _file.write(data[:6])
+    with open(storage.paths[1], "wb") as _file:
+        _file.write(data[6:])
+
+
+def piece_hashes() -> PieceHashes:
+    return PieceHashes(
+        b"".join(sha1(DATA[i : i + 4]).digest() for i in range(0, len(DATA), 4))
+    )
+
+
+def test_verify_pieces(tmp_path) -> None:
+    storage = make_storage(tmp_path)
+    assert verify_pieces(storage, piece_hashes(), workers=2) == [False] * 3
+
+    write_files(storage)
+    assert verify_pieces(storage, piece_hashes(), workers=2) == [True] * 3
+
+    # a byte of the second file breaks the piece spanning both files
+    write_files(storage, DATA[:6] + b"G" + DATA[7:])
+    assert verify_pieces(storage, piece_hashes()) == [True, False, True]
+
+    # a truncated file holds the first pieces only
+    write_files(storage, DATA[:9])
+    assert verify_pieces(storage, piece_hashes()) == [True, True, False]
+    os.remove(storage.paths[1])
+    assert verify_pieces(storage, piece_hashes()) == [True, False, False]
+    storage.close()
+
+
+def test_resume_file(tmp_path) -> None:
+    storage = make_storage(tmp_path)
+    write_files(storage)
+    path = str(tmp_path / "resume")
+    bitfield = BitArray("0b101")
+
+    resume = ResumeFile(path, b"x" * 20, storage)
+    assert resume.load(3) is None
+    resume.save(bitfield)
+    assert resume.load(3) == bitfield
+    assert ResumeFile(path, b"y" * 20, storage).load(3) is None
+
+    # a file touched since the save is not trusted
+    stat = os.stat(storage.paths[0])
+    os.utime(storage.paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert resume.load(3) is None
+
+    # nor one of another size, even with the same mtime
+    resume.save(bitfield)
+    assert resume.load(3) == bitfield
+    stat = os.stat(storage.paths[1])
+    with open(storage.paths[1], "ab") as _file:
+        _file.write(b"!")
+    os.utime(storage.paths[1], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert resume.load(3) is None
+    storage.close()
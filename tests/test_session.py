@@ -0,0 +1,88 @@
+import asyncio
+import os
+from hashlib import sha1
+from typing import List
+
+import bencodepy
+import pytest
+
+from torrent_dl.block import BLOCK_LENGTH
+from torrent_dl.session import Session
+from torrent_dl.torrent import Torrent
+
+# three pieces of two blocks, the last one short
+PIECE_LENGTH: int = 2 * BLOCK_LENGTH
+
+
+def make_torrent(data: bytes) -> Torrent:
+    pieces = b"".join(
+        sha1(data[i : i + PIECE_LENGTH]).digest()
+        for i in range(0, len(data), PIECE_LENGTH)
+    )
+    info = {
+        b"name": b"data",
+        b"length": len(data),
+        b"piece length": PIECE_LENGTH,
+        b"pieces": pieces,
+    }
+    torrent = Torrent()
+    torrent.open_from_bytes(
+        bencodepy.encode({b"announce": b"http://tracker/announce", b"info": info})
+    )
+    # the peers are given to the torrents, there is no tracker to announce to
+    torrent.trackers = set()
+    return torrent
+
+
+def test_session_seed_to_leech(tmp_path) -> None:
+    datas: List[bytes] = [os.urandom(2 * PIECE_LENGTH + 100) for _ in range(2)]
+    torrents: List[Torrent] = [make_torrent(data) for data in datas]
+
+    seeder = Session(str(tmp_path / "seed"), port=0, seed=True)
+    # a single connection at a time, the torrents take turns
+    leecher = Session(
+        str(tmp_path / "leech"), port=0, max_connections=1, memory_budget=PIECE_LENGTH
+    )
+    for i, (torrent, data) in enumerate(zip(torrents, datas)):
+        os.makedirs(tmp_path / "seed" / str(i))
+        (tmp_path / "seed" / str(i) / "data").write_bytes(data)
+        seeder.add_torrent(torrent, str(tmp_path / "seed" / str(i)))
+        leecher.add_torrent(torrent, str(tmp_path / "leech" / str(i)), resume=False)
+
+    # everything the torrents of a session use is the one of the session
+    for session in (seeder, leecher):
+        for download in session.torrents.values():
+            connections = download.peer_manager.connections
+            assert connections.limit is session.connection_limit
+            assert download.piece_manager.buffer_pool is session.buffer_pool
+            assert download.piece_manager.verifier.executor is session.hash_executor
+    assert seeder.route(b"x" * 20, None, b"") is False  # type: ignore
+
+    async def run() -> None:
+        serving = asyncio.ensure_future(seeder.run())
+        while not seeder.port:
+            await asyncio.sleep(0.01)
+        assert all(download.seeding for download in seeder.torrents.values())
+
+        # the seeder routes both connections to their torrent by info hash
+        for download in leecher.torrents.values():
+            download.peer_manager.peer_pool.add("127.0.0.1", seeder.port)
+        await asyncio.wait_for(leecher.run(), 10)
+        assert not serving.done()
+        assert leecher.connection_limit.used == 0
+        assert leecher.buffer_pool.allocated <= PIECE_LENGTH
+        assert leecher.http_session is not None and leecher.http_session.closed
+
+        # a seeding session serves until it is stopped
+        seeder.stop()
+        await asyncio.wait_for(serving, 5)
+        assert seeder.connection_limit.used == 0
+
+    asyncio.run(run())
+
+    for i, (download, data) in enumerate(zip(leecher.torrents.values(), datas)):
+        assert download.seeding
+        assert (tmp_path / "leech" / str(i) / "data").read_bytes() == data
+    for session in (seeder, leecher):
+        with pytest.raises(RuntimeError):
+            session.hash_executor.submit(int)
@@ -0,0 +1,51 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from torrent_dl.storage import Storage
+
+
+def make_torrent(name: str, files, multi_file: bool = True) -> SimpleNamespace:
+    return SimpleNamespace(
+        name=name,
+        files=files,
+        is_multi_file=multi_file,
+        piece_length=4,
+        total_length=sum(f["length"] for f in files),
+    )
+
+
+@pytest.mark.parametrize(
+    "name, path, multi_file",
+    [
+        ("../../escaped", "../../escaped", False),
+        ("/etc", "a", True),
+        ("a/b", "c", True),
+        ("..", "a", True),
+        ("ok", "a/../../b", True),
+        ("ok", "/a", True),
+    ],
+)
+def test_storage_rejects_paths(tmp_path, name: str, path: str, multi_file: bool):
+    torrent = make_torrent(name, [{"path": path, "length": 4}], multi_file)
+    with pytest.raises(ValueError):
+        Storage(torrent, str(tmp_path))
+    assert os.listdir(tmp_path) == []
+
+
+def test_storage_empty_files(tmp_path) -> None:
+    files = [
+        {"path": "empty", "length": 0},
+        {"path": "dir/data", "length": 6},
+        {"path": "dir/empty", "length": 0},
+    ]
+    storage = Storage(make_torrent("name", files), str(tmp_path))
+    assert os.path.getsize(tmp_path / "name" / "empty") == 0
+    assert os.path.getsize(tmp_path / "name" / "dir" / "empty") == 0
+
+    # the spans skip the empty files
+    storage.write_piece(0, b"abcd")
+    storage.write_piece(1, b"ef")
+    storage.close()
+    assert (tmp_path / "name" / "dir" / "data").read_bytes() == b"abcdef"
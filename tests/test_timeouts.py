@@ -0,0 +1,34 @@
+import asyncio
+from typing import Dict, List, Tuple
+
+from torrent_dl.timeouts import RequestTimeouts
+
+
+class FakePeer:
+    def __init__(self) -> None:
+        self.outstanding: Dict[Tuple[int, int], float] = {}
+
+
+def test_request_timeouts() -> None:
+    expired: List[Tuple[FakePeer, int, int]] = []
+
+    async def run() -> None:
+        loop = asyncio.get_running_loop()
+        timeouts = RequestTimeouts(lambda *request: expired.append(request))
+        slow, fast = FakePeer(), FakePeer()
+
+        slow.outstanding[(0, 0)] = loop.time() + 0.02
+        timeouts.add(slow, 0, 0)
+        slow.outstanding[(0, 16384)] = loop.time() + 0.5
+        timeouts.add(slow, 0, 16384)
+        fast.outstanding[(1, 0)] = loop.time() + 0.01
+        timeouts.add(fast, 1, 0)
+        # answered before its deadline
+        del fast.outstanding[(1, 0)]
+
+        await asyncio.sleep(0.05)
+        timeouts.close()
+
+    asyncio.run(run())
+    assert len(expired) == 1
+    assert expired[0][1:] == (0, 0)
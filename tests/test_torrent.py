@@ -1,9 +1,11 @@
 import json
 import os
+from typing import Any, Dict
 
+import bencodepy
 import pytest
 
-from torrent_dl.torrent import Torrent
+from torrent_dl.torrent import PieceHashes, Torrent, TorrentError
 
 BASE_DIR: str = os.path.dirname(__file__)
 
@@ -47,8 +49,56 @@ def test_open_from_file(file_name: str, res_file: str) -> None:
     assert t.info_hash.hex() == res_data["infoHash"]
 
 
+def test_piece_hashes() -> None:
+    digests = [bytes([i]) * 20 for i in range(3)]
+    hashes = PieceHashes(b"".join(digests))
+
+    assert len(hashes) == 3
+    assert hashes[1] == digests[1]
+    assert hashes[-1] == digests[2]
+    with pytest.raises(IndexError):
+        hashes[3]
+    with pytest.raises(ValueError):
+        PieceHashes(bytes(21))
+
+    assert hashes.compare(digests) == [True, True, True]
+    assert hashes.compare([digests[1], None], start=1) == [True, False]
+    assert hashes.compare([digests[0], digests[0]]) == [True, False]
+
+
 if __name__ == "__main__":
     test_open_from_file(
         "./data/ubuntu-20.04.1-desktop-amd64.iso.torrent",
         "./data/ubuntu-20.04.1-desktop-amd64.iso.torrent.json",
     )
+
+
+@pytest.mark.parametrize(
+    "info",
+    [
+        {b"name": 5},
+        {b"piece length": b"16384"},
+        {b"piece length": 0},
+        {b"pieces": [b"x" * 20]},
+        {b"pieces": bytes(40)},
+        {b"length": 16385},
+        {b"files": [{b"path": [b"a"], b"length": 0}]},
+        {b"length": -1},
+        {b"length": b"5"},
+        {b"files": [{b"path": [b"a", 1], b"length": 5}]},
+        {b"files": [{b"path": b"a", b"length": 5}]},
+        {b"files": [b"a"]},
+    ],
+)
+def test_open_from_bytes_invalid(info: Dict[bytes, Any]) -> None:
+    valid = {b"name": b"a", b"piece length": 16384, b"pieces": bytes(20), b"length": 5}
+    if b"files" in info:
+        del valid[b"length"]
+    data = bencodepy.encode({b"announce": b"http://t", b"info": {**valid, **info}})
+    with pytest.raises(TorrentError):
+        Torrent().open_from_bytes(data)
+
+
+def test_open_from_bytes_not_a_dict() -> None:
+    with pytest.raises(TorrentError):
+        Torrent().open_from_bytes(bencodepy.encode([b"info"]))
@@ -0,0 +1,58 @@
+import os
+from hashlib import sha1
+from typing import Any
+
+import bencodepy
+import pytest
+
+from torrent_dl.torrent_index import TorrentIndex
+
+
+def write_torrent(path: str, name: Any) -> bytes:
+    info = {b"name": name, b"piece length": 16384, b"pieces": bytes(20), b"length": 5}
+    with open(path, mode="wb") as _file:
+        _file.write(
+            bencodepy.encode({b"announce": b"http://tracker/announce", b"info": info})
+        )
+    return sha1(bencodepy.encode(info)).digest()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_torrent_index(tmp_path, monkeypatch, workers: int) -> None:
+    # exercise the process pool with a handful of files
+    monkeypatch.setattr("torrent_dl.torrent_index.PARALLEL_THRESHOLD", 2)
+    hashes = [
+        write_torrent(str(tmp_path / f"{i}.torrent"), f"file{i}".encode())
+        for i in range(3)
+    ]
+    (tmp_path / "broken.torrent").write_bytes(b"d4:info")
+    # well formed bencode, but the name is an integer
+    write_torrent(str(tmp_path / "typed.torrent"), 5)
+
+    index = TorrentIndex(str(tmp_path), workers=workers)
+    index.load()
+    assert len(index) == 3
+    assert index.parsed == 5
+    assert set(index.errors) == {
+        str(tmp_path / "broken.torrent"),
+        str(tmp_path / "typed.torrent"),
+    }
+    entry = index[hashes[1]]
+    assert (entry.name, entry.total_length, entry.file_count) == ("file1", 5, 1)
+    assert entry.trackers == ("http://tracker/announce",)
+    assert index.open(hashes[1]).info_hash == hashes[1]
+
+    # unchanged files come from the cache, changed ones are parsed again
+    index = TorrentIndex(str(tmp_path), workers=workers)
+    index.load()
+    assert index.parsed == 2
+    assert index[hashes[2]] == entry._replace(
+        info_hash=hashes[2], path=str(tmp_path / "2.torrent"), name="file2"
+    )
+
+    new_hash = write_torrent(str(tmp_path / "0.torrent"), b"renamed")
+    os.remove(tmp_path / "2.torrent")
+    index = TorrentIndex(str(tmp_path), workers=workers)
+    index.load()
+    assert index.parsed == 3
+    assert set(index.entries) == {new_hash, hashes[1]}
@@ -0,0 +1,116 @@
+import asyncio
+import struct
+from typing import List
+
+import bencodepy
+import pytest
+from aiohttp import web
+
+from torrent_dl import tracker
+from torrent_dl.tracker import (
+    DEFAULT_INTERVAL,
+    RETRY_INTERVAL,
+    Announcer,
+    Tracker,
+    TrackerError,
+    TrackerResponse,
+)
+
+PEERS: bytes = bytes([10, 0, 0, 1]) + struct.pack(">H", 6881)
+PEERS6: bytes = bytes(15) + b"\x01" + struct.pack(">H", 6881)
+
+
+def test_tracker_response() -> None:
+    response = TrackerResponse(
+        bencodepy.encode(
+            {b"interval": 900, b"min interval": 120, b"peers": PEERS, b"peers6": PEERS6}
+        )
+    )
+    assert response.peers == PEERS and response.peers6 == PEERS6
+    assert (response.interval, response.min_interval) == (900, 120)
+
+    # peers given as a list of dictionaries are kept as they are
+    peers = [{b"ip": b"10.0.0.1", b"port": 6881}]
+    response = TrackerResponse(bencodepy.encode({b"peers": peers}))
+    assert response.peers == peers and response.peers6 == b""
+    assert (response.interval, response.min_interval) == (DEFAULT_INTERVAL, 0)
+
+
+def test_tracker_response_failure() -> None:
+    with pytest.raises(TrackerError, match="not registered"):
+        TrackerResponse(bencodepy.encode({b"failure reason": b"not registered"}))
+
+
+@pytest.mark.parametrize("interval", [0, -5, b"900", [900]])
+def test_tracker_interval_floor(interval) -> None:
+    response = TrackerResponse(
+        bencodepy.encode({b"interval": interval, b"min interval": interval})
+    )
+    assert (response.interval, response.min_interval) == (DEFAULT_INTERVAL, 0)
+
+    # a tracker asking for a short interval is announced to once a retry interval
+    _tracker = Tracker("http://tracker/announce")
+    _tracker.interval, _tracker.min_interval = 1, 0
+    assert _tracker.next_announce == RETRY_INTERVAL
+    _tracker.interval, _tracker.min_interval = 1, RETRY_INTERVAL * 2
+    assert _tracker.next_announce == RETRY_INTERVAL * 2
+
+
+def test_announcer(monkeypatch) -> None:
+    # the retry after a failure is not waited for
+    monkeypatch.setattr(tracker, "RETRY_INTERVAL", 0)
+    queries: List[bytes] = []
+
+    async def announce(request: web.Request) -> web.Response:
+        queries.append(request.rel_url.raw_query_string.encode())
+        if len(queries) == 1:
+            return web.Response(body=bencodepy.encode({b"failure reason": b"busy"}))
+        return web.Response(body=bencodepy.encode({b"interval": 0, b"peers": PEERS}))
+
+    async def run() -> None:
+        app = web.Application()
+        app.router.add_get("/announce", announce)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port: int = runner.addresses[0][1]
+
+        async def announce_until_peers(session=None) -> Announcer:
+            received: asyncio.Future = asyncio.get_running_loop().create_future()
+            announcer = Announcer(
+                [f"http://127.0.0.1:{port}/announce?key=1", "udp://tracker:80"],
+                lambda: {"info_hash": b"\x00\xff" * 10, "port": 6881},
+                received.set_result,
+                session,
+            )
+            assert len(announcer.trackers) == 1
+            task = asyncio.ensure_future(announcer.run())
+            response: TrackerResponse = await asyncio.wait_for(received, 5)
+            assert response.peers == PEERS
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            return announcer
+
+        # the tracker is retried after a failure, its session is closed with it
+        announcer = await announce_until_peers()
+        assert len(queries) == 2 and announcer.trackers[0].announces == 1
+        assert announcer.trackers[0].next_announce == DEFAULT_INTERVAL
+        assert announcer.session is None
+        assert queries[0] == b"key=1&info_hash=%00%FF" + b"%00%FF" * 9 + b"&port=6881"
+
+        # a session given by the caller is left open
+        session = tracker.create_session()
+        announcer = await announce_until_peers(session)
+        assert len(queries) == 3 and not session.closed
+        await session.close()
+        await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_announcer_no_tracker() -> None:
+    announcer = Announcer(["udp://tracker:80"], dict, print)
+    asyncio.run(announcer.run())
+    assert announcer.trackers == [] and announcer.session is None
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+import time
+from typing import List
+
+from torrent_dl.verifier import PieceVerifier
+
+
+class SlowPiece:
+    def __init__(self, release: threading.Event) -> None:
+        self.release: threading.Event = release
+        self.verifying: bool = False
+        self.hashed: bool = False
+
+    def validate_piece(self) -> bool:
+        self.release.wait(5)
+        self.hashed = True
+        return True
+
+
+def test_verifier_close_does_not_block() -> None:
+    verified: List[SlowPiece] = []
+    release = threading.Event()
+    pieces = [SlowPiece(release) for _ in range(3)]
+
+    async def run() -> float:
+        verifier = PieceVerifier(lambda piece, valid: verified.append(piece), 1)
+        for piece in pieces:
+            verifier.submit(piece)
+        await asyncio.sleep(0.05)
+
+        started = time.monotonic()
+        verifier.close()
+        elapsed = time.monotonic() - started
+        release.set()
+        await asyncio.sleep(0.05)
+        return elapsed
+
+    assert asyncio.run(run()) < 1
+    # the piece being hashed finished, the queued ones were dropped
+    assert pieces[0].hashed and not pieces[1].hashed and not pieces[2].hashed
+    assert verified == []
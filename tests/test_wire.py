@@ -0,0 +1,61 @@
+import struct
+
+import pytest
+
+from torrent_dl.wire import MAX_FRAME_SIZE, MIN_FREE_SPACE, FrameBuffer
+
+
+def receive(buffer: FrameBuffer, data: bytes) -> None:
+    buffer.get_buffer()[: len(data)] = data
+    buffer.advance(len(data))
+
+
+def frame(payload: bytes) -> bytes:
+    return struct.pack(">I", len(payload)) + payload
+
+
+def test_frame_buffer_partial() -> None:
+    buffer = FrameBuffer()
+    data = frame(b"a" * 10) + frame(b"")
+
+    # nothing is handed out before the frame is complete
+    receive(buffer, data[:2])
+    assert buffer.missing() == 2
+    assert list(buffer.frames()) == []
+    receive(buffer, data[2:9])
+    assert buffer.missing() == 5
+    assert list(buffer.frames()) == []
+
+    receive(buffer, data[9:])
+    assert [bytes(f) for f in buffer.frames()] == [frame(b"a" * 10), frame(b"")]
+    assert len(buffer) == 0 and buffer.missing() == 0
+
+
+def test_frame_buffer_compact() -> None:
+    buffer = FrameBuffer(size=MIN_FREE_SPACE + 50)
+    first, second = frame(b"x" * 40), frame(b"y" * 40)
+
+    receive(buffer, first + second[:10])
+    assert [bytes(f) for f in buffer.frames()] == [first]
+
+    # the tail is short of free space, the partial frame moves to the front
+    assert len(buffer.get_buffer()) == MIN_FREE_SPACE + 40
+    assert buffer.start == 0 and len(buffer) == 10
+    receive(buffer, second[10:])
+    assert [bytes(f) for f in buffer.frames()] == [second]
+
+
+def test_frame_buffer_too_long() -> None:
+    buffer = FrameBuffer(size=64)
+    receive(buffer, struct.pack(">I", 0x7FFFFFFF))
+    with pytest.raises(ValueError):
+        list(buffer.frames())
+    with pytest.raises(ValueError):
+        buffer.missing()
+    assert len(buffer.buffer) == 64
+
+    # the largest frame allowed is received whole
+    buffer = FrameBuffer(size=64)
+    receive(buffer, frame(bytes(MAX_FRAME_SIZE - 4))[:64])
+    assert list(buffer.frames()) == []
+    assert buffer.missing() == MAX_FRAME_SIZE - 64
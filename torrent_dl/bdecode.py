@@ -0,0 +1,94 @@
+import mmap
+import re
+from typing import Any, Dict, Final, List, Pattern, Tuple, Union
+
+# a buffer with find and slicing to bytes, the whole file or a memory map of it
+Buffer = Union[bytes, mmap.mmap]
+Span = Tuple[int, int]
+
+INTEGER: Final[Pattern[bytes]] = re.compile(rb"i(0|-?[1-9][0-9]*)e")
+STRING_LENGTH: Final[Pattern[bytes]] = re.compile(rb"(0|[1-9][0-9]*):")
+MAX_DEPTH: Final[int] = 64
+
+
+class DecodeError(ValueError):
+    pass
+
+
+class Decoder:
+    """bencode decoder working in place on a buffer
+
+    Strings are returned as bytes and never decoded to text here, callers
+    decode the few they need. The byte span of every value of the top level
+    dictionary is recorded, so the info hash can be computed on the exact bytes
+    of the info dictionary instead of encoding it again.
+    """
+
+    def __init__(self, data: Union[Buffer, bytearray, memoryview]):
+        if isinstance(data, (bytearray, memoryview)):
+            data = bytes(data)
+        self.data: Buffer = data
+        self.spans: Dict[bytes, Span] = {}
+
+    def decode(self) -> Any:
+        try:
+            value, end = self._decode(0, 0)
+        except IndexError:
+            raise DecodeError("Unexpected end of data") from None
+        if end != len(self.data):
+            raise DecodeError(f"Trailing data at {end}")
+        return value
+
+    def _decode(self, start: int, depth: int) -> Tuple[Any, int]:
+        token: int = self.data[start]
+
+        if token == 0x64:  # d
+            return self._decode_dict(start, depth)
+        if token == 0x6C:  # l
+            return self._decode_list(start, depth)
+        if token == 0x69:  # i
+            match = INTEGER.match(self.data, start)
+            if match is None:
+                raise DecodeError(f"Invalid integer at {start}")
+            return int(match.group(1)), match.end()
+
+        return self._decode_string(start)
+
+    def _decode_string(self, start: int) -> Tuple[bytes, int]:
+        match = STRING_LENGTH.match(self.data, start)
+        if match is None:
+            raise DecodeError(f"Invalid token at {start}")
+
+        end: int = match.end() + int(match.group(1))
+        if end > len(self.data):
+            raise DecodeError(f"String at {start} is truncated")
+        return self.data[match.end() : end], end
+
+    def _decode_list(self, start: int, depth: int) -> Tuple[List[Any], int]:
+        if depth >= MAX_DEPTH:
+            raise DecodeError(f"Nested too deep at {start}")
+
+        values: List[Any] = []
+        position: int = start + 1
+        while self.data[position] != 0x65:  # e
+            value, position = self._decode(position, depth + 1)
+            values.append(value)
+        return values, position + 1
+
+    def _decode_dict(self, start: int, depth: int) -> Tuple[Dict[bytes, Any], int]:
+        if depth >= MAX_DEPTH:
+            raise DecodeError(f"Nested too deep at {start}")
+
+        values: Dict[bytes, Any] = {}
+        position: int = start + 1
+        while self.data[position] != 0x65:  # e
+            key, position = self._decode_string(position)
+            value_start: int = position
+            values[key], position = self._decode(position, depth + 1)
+            if depth == 0:
+                self.spans[key] = (value_start, position)
+        return values, position + 1
+
+
+def decode(data: Union[Buffer, bytearray, memoryview]) -> Any:
+    return Decoder(data).decode()
@@ -0,0 +1,50 @@
+from typing import Dict, List, Optional
+
+
+class BufferPool:
+    """reusable piece buffers within a memory budget
+
+    Buffers are kept by size so torrents with different piece lengths can share
+    the pool. At most max_bytes are ever allocated, so the memory held by pieces
+    being downloaded is bounded whatever the number and size of the torrents,
+    free buffers of another size are dropped when a new size needs room.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes: int = max_bytes
+        self.allocated: int = 0
+        self.free: Dict[int, List[bytearray]] = {}
+        self.free_bytes: int = 0
+
+    def available(self, size: int) -> bool:
+        """a buffer of size can be handed out"""
+        return bool(self.free.get(size)) or (
+            self.allocated - self.free_bytes + size <= self.max_bytes
+        )
+
+    def get(self, size: int) -> Optional[bytearray]:
+        """a buffer, or None when the budget is exhausted"""
+        free: Optional[List[bytearray]] = self.free.get(size)
+        if free:
+            self.free_bytes -= size
+            return free.pop()
+
+        if not self.available(size):
+            return None
+
+        while self.allocated + size > self.max_bytes:
+            self._drop_free_buffer()
+        self.allocated += size
+        return bytearray(size)
+
+    def put(self, buffer: bytearray) -> None:
+        self.free.setdefault(len(buffer), []).append(buffer)
+        self.free_bytes += len(buffer)
+
+    def _drop_free_buffer(self) -> None:
+        size, free = next((s, f) for s, f in self.free.items() if f)
+        free.pop()
+        if not free:
+            del self.free[size]
+        self.free_bytes -= size
+        self.allocated -= size
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import random
+from typing import Callable, Final, List, Optional, Set
+
+from peer import Peer
+
+CHOKE_INTERVAL: Final[float] = 10.0
+UNCHOKE_SLOTS: Final[int] = 4
+# the optimistic unchoke moves to another peer every this many rounds
+OPTIMISTIC_ROUNDS: Final[int] = 3
+
+
+class Choker:
+    """decide which interested peers we upload to
+
+    Every round the regular slots go to the peers we download the most from, or
+    to the peers taking the most from us once we are seeding, so the peers that
+    give us bandwidth get ours in return. One more peer is unchoked at random and
+    kept for a few rounds, which gives new peers a chance to show their rate.
+    Choke and UnChoke are only sent to the peers whose state changes.
+    """
+
+    def __init__(
+        self,
+        peers: List[Peer],
+        seeding: Callable[[], bool],
+        slots: int = UNCHOKE_SLOTS,
+        interval: float = CHOKE_INTERVAL,
+    ):
+        self.peers: List[Peer] = peers
+        self.seeding: Callable[[], bool] = seeding
+        self.slots: int = slots
+        self.interval: float = interval
+        self.optimistic: Optional[Peer] = None
+        self.round: int = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def unchoked(self) -> int:
+        return sum(not peer.am_choking for peer in self.peers)
+
+    def start(self) -> None:
+        self.timer = asyncio.get_running_loop().call_later(self.interval, self._run)
+
+    def _run(self) -> None:
+        self.rechoke()
+        self.start()
+
+    def on_interested(self, peer: Peer) -> None:
+        """a free slot is given right away instead of at the next round"""
+        if peer.am_choking and self.unchoked < self.slots + 1:
+            peer.unchoke()
+
+    def on_peer_dropped(self, peer: Peer) -> None:
+        if peer is self.optimistic:
+            self.optimistic = None
+
+    def rechoke(self) -> None:
+        seeding: bool = self.seeding()
+        interested: List[Peer] = [
+            peer for peer in self.peers if peer.peer_interseted and peer.healthy
+        ]
+        interested.sort(
+            key=lambda peer: (
+                peer.upload_bucket.rate if seeding else peer.download_bucket.rate
+            ),
+            reverse=True,
+        )
+
+        unchoke: Set[Peer] = set(interested[: self.slots])
+        others: List[Peer] = interested[self.slots :]
+        if self.round % OPTIMISTIC_ROUNDS == 0 or self.optimistic not in others:
+            candidates: List[Peer] = [
+                peer for peer in others if peer is not self.optimistic
+            ]
+            self.optimistic = random.choice(candidates or others) if others else None
+        if self.optimistic is not None:
+            unchoke.add(self.optimistic)
+        self.round += 1
+
+        for peer in self.peers:
+            if peer in unchoke:
+                peer.unchoke()
+            else:
+                peer.choke()
+        logging.debug(f"{len(unchoke)} peers unchoked of {len(interested)} interested")
+
+    def close(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
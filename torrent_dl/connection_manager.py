@@ -0,0 +1,175 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Final, List, Optional, Set
+
+from peer import Peer
+from peer_pool import Candidate, PeerPool
+
+MAX_CONNECTIONS: Final[int] = 200
+# connections being opened at the same time
+MAX_HALF_OPEN: Final[int] = 32
+
+
+class ConnectionLimit:
+    """connections open at the same time across all the torrents of a session
+
+    A slot freed by one torrent is offered to the others in turn, so a torrent
+    waiting for a slot doesn't have to poll.
+    """
+
+    def __init__(self, max_connections: int):
+        self.max_connections: int = max_connections
+        self.used: int = 0
+        self.managers: List["ConnectionManager"] = []
+
+    @property
+    def available(self) -> bool:
+        return self.used < self.max_connections
+
+    def acquire(self) -> None:
+        self.used += 1
+
+    def release(self) -> None:
+        self.used -= 1
+        for _ in range(len(self.managers)):
+            if not self.available:
+                break
+            manager: ConnectionManager = self.managers.pop(0)
+            self.managers.append(manager)
+            manager.fill()
+
+
+class ConnectionManager:
+    """keep the number of connected peers at target
+
+    Candidates are connected in parallel, at most max_half_open at a time, each
+    in its own task so an unreachable peer never blocks anything else. Slots are
+    refilled as soon as a connection is made or fails and as soon as a peer
+    drops, and candidates that failed are retried later with an exponential
+    backoff by the peer pool.
+    """
+
+    def __init__(
+        self,
+        peer_pool: PeerPool,
+        create_peer: Callable[[Candidate], Peer],
+        serve_peer: Callable[[Peer], Awaitable[None]],
+        max_connections: int = MAX_CONNECTIONS,
+        max_half_open: int = MAX_HALF_OPEN,
+        limit: Optional[ConnectionLimit] = None,
+    ):
+        self.peer_pool: PeerPool = peer_pool
+        self.create_peer: Callable[[Candidate], Peer] = create_peer
+        self.serve_peer: Callable[[Peer], Awaitable[None]] = serve_peer
+        self.max_connections: int = max_connections
+        self.max_half_open: int = max_half_open
+        self.half_open: int = 0
+        self.connected: int = 0
+        self.tasks: Set[asyncio.Future] = set()
+        self.retry_handle: Optional[asyncio.TimerHandle] = None
+        self.closed: bool = False
+        self.limit: ConnectionLimit = limit or ConnectionLimit(max_connections)
+        self.limit.managers.append(self)
+
+    def fill(self) -> None:
+        """start connecting to candidates until every slot is taken"""
+        if self.closed:
+            return
+
+        while (
+            self.half_open < self.max_half_open
+            and self.half_open + self.connected < self.max_connections
+            and self.limit.available
+        ):
+            candidate: Optional[Candidate] = self.peer_pool.pop()
+            if candidate is None:
+                self._schedule_retry()
+                break
+
+            # counted right away, the task only starts on the next loop iteration
+            self.half_open += 1
+            self._start(self._connect(candidate))
+
+    @property
+    def can_accept(self) -> bool:
+        return (
+            not self.closed
+            and self.half_open + self.connected < self.max_connections
+            and self.limit.available
+        )
+
+    def accept(self, peer: Peer) -> bool:
+        """serve a peer that connected to us, False if there is no slot for it"""
+        if not self.can_accept:
+            return False
+
+        self._start(self._serve(peer))
+        return True
+
+    def _start(self, coroutine: Awaitable[None]) -> None:
+        self.limit.acquire()
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Future) -> None:
+        self.tasks.discard(task)
+        self.limit.release()
+
+    def _schedule_retry(self) -> None:
+        """wake up when the next candidate in backoff can be retried"""
+        delay: Optional[float] = self.peer_pool.next_retry()
+        if delay is None or self.retry_handle is not None:
+            return
+
+        def retry() -> None:
+            self.retry_handle = None
+            self.fill()
+
+        self.retry_handle = asyncio.get_running_loop().call_later(delay, retry)
+
+    async def _connect(self, candidate: Candidate) -> None:
+        peer: Peer = self.create_peer(candidate)
+
+        try:
+            connected: bool = await peer.connect()
+        finally:
+            self.half_open -= 1
+
+        if not connected:
+            self.peer_pool.connect_failed(candidate)
+            self.fill()
+            return
+
+        # counted as connected before its half open slot goes to the next one
+        self.connected += 1
+        self.fill()
+        try:
+            await self.serve_peer(peer)
+        finally:
+            self.connected -= 1
+            if peer.handshaked:
+                self.peer_pool.connected(candidate, peer.latency)
+                self.peer_pool.disconnected(candidate)
+            else:
+                self.peer_pool.connect_failed(candidate)
+            self.fill()
+
+    async def _serve(self, peer: Peer) -> None:
+        self.connected += 1
+        try:
+            await self.serve_peer(peer)
+        finally:
+            self.connected -= 1
+
+    async def close(self) -> None:
+        self.closed = True
+        if self in self.limit.managers:
+            self.limit.managers.remove(self)
+        if self.retry_handle is not None:
+            self.retry_handle.cancel()
+
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        logging.debug("closed all connections")
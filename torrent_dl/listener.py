@@ -0,0 +1,141 @@
+import asyncio
+import errno
+import logging
+import socket
+from typing import Callable, Final, Optional, Set
+
+import message
+
+# connections still sending their handshake, and how long they may take
+MAX_PENDING_HANDSHAKES: Final[int] = 64
+HANDSHAKE_TIMEOUT: Final[float] = 10.0
+
+# (info hash, transport, handshake), True if a torrent took the connection
+RouteType = Callable[[bytes, asyncio.Transport, bytes], bool]
+
+
+class IncomingProtocol(asyncio.BufferedProtocol):
+    """a connection opened by a peer, until its handshake has arrived
+
+    Only the handshake is read, into a buffer of exactly its size, the rest of
+    the connection is handed over to the torrent the handshake is for. Nothing
+    else is allocated for a connection before a torrent takes it.
+    """
+
+    def __init__(self, listener: "Listener"):
+        self.listener: Listener = listener
+        self.transport: Optional[asyncio.Transport] = None
+        self.buffer: bytearray = bytearray(message.Handshake.total_length)
+        self.received: int = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        if not self.listener.accepting():
+            transport.abort()
+            return
+
+        # asyncio only sets it when the listening socket was made with IPPROTO_TCP
+        sock: Optional[socket.socket] = transport.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.listener.pending.add(self)
+        self.timer = asyncio.get_running_loop().call_later(
+            HANDSHAKE_TIMEOUT, transport.abort
+        )
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return memoryview(self.buffer)[self.received :]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.received += nbytes
+        if self.received < len(self.buffer):
+            return
+
+        self._done()
+        try:
+            handshake: message.Handshake = message.Handshake.from_bytes(self.buffer)
+        except Exception as e:
+            logging.debug(f"invalid incoming handshake: {e!r}")
+            self.transport.abort()
+            return
+
+        if not self.listener.route(
+            handshake.info_hash, self.transport, bytes(self.buffer)
+        ):
+            logging.debug(f"no room for incoming {handshake.info_hash.hex()}")
+            self.transport.close()
+
+    def _done(self) -> None:
+        self.listener.pending.discard(self)
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def eof_received(self) -> bool:
+        return False
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._done()
+
+
+def bind(port: int) -> socket.socket:
+    """a single socket for IPv4 and IPv6 peers when the system allows it, so both
+    always get the same port, even one chosen by the system"""
+    if socket.has_dualstack_ipv6():
+        return socket.create_server(
+            ("", port), family=socket.AF_INET6, dualstack_ipv6=True
+        )
+    return socket.create_server(("", port))
+
+
+class Listener:
+    """the listening socket of a session or of a single torrent
+
+    Every incoming connection is routed to the torrent named by the info hash of
+    its handshake, so all the torrents share a single port. Connections are
+    refused as soon as they are made while can_accept says there is no room, and
+    while too many others are still sending their handshake.
+    """
+
+    def __init__(
+        self,
+        port: int,
+        route: RouteType,
+        can_accept: Optional[Callable[[], bool]] = None,
+        max_pending: int = MAX_PENDING_HANDSHAKES,
+    ):
+        self.port: int = port
+        self.route: RouteType = route
+        self.can_accept: Optional[Callable[[], bool]] = can_accept
+        self.max_pending: int = max_pending
+        self.pending: Set[IncomingProtocol] = set()
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    def accepting(self) -> bool:
+        if len(self.pending) >= self.max_pending:
+            return False
+        return self.can_accept is None or self.can_accept()
+
+    async def start(self) -> None:
+        try:
+            sock: socket.socket = bind(self.port)
+        except OSError as e:
+            if e.errno != errno.EADDRINUSE or not self.port:
+                raise
+            logging.warning(f"port {self.port} is in use, letting the system choose")
+            sock = bind(0)
+
+        self.server = await asyncio.get_running_loop().create_server(
+            lambda: IncomingProtocol(self), sock=sock
+        )
+        # the port the system chose when asked for port 0
+        self.port = self.server.sockets[0].getsockname()[1]
+        logging.info(f"listening on port {self.port}")
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for incoming in list(self.pending):
+            incoming.transport.abort()
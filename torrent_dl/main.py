@@ -1,47 +1,242 @@
+import asyncio
 import logging
 import os
+from typing import TYPE_CHECKING, Optional
 
 from peer_manager import PeerManager
 from torrent import Torrent
 from piece_manager import PieceManager
 from peer import Peer
 from piece import Piece
+from timeouts import RequestTimeouts
 import message
-import time
+
+if TYPE_CHECKING:
+    from session import Session
 
 BASE_DIR: str = os.path.dirname(__file__)
 
 
 class DownloadManager:
-    def __init__(self, torrent: Torrent):
+    """download a torrent, blocks are requested when something happens
+
+    Nothing polls: a peer is sent new requests when it unchokes us, announces a
+    piece or delivers a block, and every peer is looked at again when requests
+    are given back by a choke, a disconnection or a timeout or a piece finished
+    verifying. An idle download does no work at all.
+
+    Once every piece is verified the download ends, unless seed is set, then the
+    pieces are served to the peers until stop is called.
+    """
+
+    def __init__(
+        self,
+        torrent: Torrent,
+        download_dir: str = ".",
+        resume: bool = True,
+        session: Optional["Session"] = None,
+        seed: bool = False,
+    ):
         self.torrent: Torrent = torrent
-        self.peer_manager: PeerManager = PeerManager(torrent)
-        self.piece_manager: PieceManager = PieceManager(torrent)
+        self.seed: bool = seed
+        self.peer_manager: PeerManager = PeerManager(torrent, self, session)
+        self.piece_manager: PieceManager = PieceManager(
+            torrent,
+            download_dir,
+            resume,
+            self.on_piece_verified,
+            buffer_pool=session.buffer_pool if session else None,
+            hash_executor=session.hash_executor if session else None,
+        )
+        self.done: Optional[asyncio.Future] = None
+        self.request_handle: Optional[asyncio.Handle] = None
+        self.timeouts: RequestTimeouts = RequestTimeouts(self.on_request_timeout)
 
     def start(self):
-        self.peer_manager.get_peers()
-        self.peer_manager.start()
+        asyncio.run(self.run())
+
+    async def run(self) -> None:
+        self.done = asyncio.get_running_loop().create_future()
+        if self.piece_manager.all_pieces_completed and not self.seed:
+            self.done.set_result(None)
+
+        peers = asyncio.ensure_future(self.peer_manager.serve())
+        try:
+            await self.done
+        finally:
+            self.peer_manager.stop()
+            await peers
+            if self.request_handle is not None:
+                self.request_handle.cancel()
+            self.timeouts.close()
+            self.piece_manager.close()
+
+        logging.info(f"Downloaded {self.piece_manager.duplicate_bytes} bytes twice")
+
+    def stop(self) -> None:
+        if self.done is not None and not self.done.done():
+            self.done.set_result(None)
+
+    @property
+    def seeding(self) -> bool:
+        return self.piece_manager.all_pieces_completed
+
+    def on_peer_connected(self, peer: Peer) -> None:
+        if self.piece_manager.picker.completed:
+            peer.send_bitfield(self.piece_manager.bitfield)
+
+    def read_block(
+        self, piece_index: int, block_begin: int, block_length: int
+    ) -> Optional[memoryview]:
+        return self.piece_manager.read_block(piece_index, block_begin, block_length)
+
+    def on_bitfield(self, peer: Peer) -> None:
+        self.piece_manager.picker.add_bitfield(peer.bitfield)
+        if not peer.am_interested and self.piece_manager.has_missing_pieces(
+            peer.bitfield
+        ):
+            peer.send_interested()
+        self.request_peer_blocks(peer)
+
+    def on_have(self, peer: Peer, piece_index: int) -> None:
+        self.piece_manager.picker.add_have(piece_index)
+        # a peer with no piece at first may skip the bitfield
+        if not (peer.am_interested or self.piece_manager.bitfield[piece_index]):
+            peer.send_interested()
+        self.request_peer_blocks(peer)
+
+    def on_unchoke(self, peer: Peer) -> None:
+        self.request_peer_blocks(peer)
+
+    def on_choke(self, peer: Peer) -> None:
+        if peer.outstanding:
+            self.release_requests(peer)
+            self.schedule_requests()
+
+    def on_block(self, peer: Peer, piece: message.Piece) -> None:
+        # the block is still a view on the read buffer of the peer
+        self.piece_manager.process_new_block(
+            piece.piece_index, piece.block_begin, piece.block
+        )
+        if self.piece_manager.in_endgame:
+            self.cancel_requests(peer, piece.piece_index, piece.block_begin)
+        self.request_peer_blocks(peer)
+
+    def on_peer_dropped(self, peer: Peer) -> None:
+        self.release_requests(peer)
+        self.piece_manager.picker.remove_bitfield(peer.bitfield)
+        self.schedule_requests()
+
+    def on_request_timeout(self, peer: Peer, piece_index: int, block_begin: int):
+        """give the block to another peer and make the slow one queue less"""
+        logging.debug(f"Peer - {peer.ip} request timed out")
+        peer.send_cancel(
+            piece_index,
+            block_begin,
+            self.piece_manager.block_length(piece_index, block_begin),
+        )
+        peer.request_timed_out()
+        self.piece_manager.free_blocks([(piece_index, block_begin)])
+        self.schedule_requests()
+
+    def on_piece_verified(self, piece: Piece, valid: bool) -> None:
+        if valid:
+            for peer in self.peer_manager.peers:
+                peer.send_have(piece.index)
+
+        if self.piece_manager.all_pieces_completed:
+            if self.seed:
+                logging.info("Download complete, seeding")
+            elif not self.done.done():
+                self.done.set_result(None)
+            return
+
+        # an invalid piece has free blocks again, a valid one released a buffer
+        self.schedule_requests()
+
+    def cancel_requests(self, peer: Peer, piece_index: int, block_begin: int):
+        """the block arrived from peer, cancel the duplicate endgame requests"""
+        block_length: int = self.piece_manager.block_length(piece_index, block_begin)
+        for other in self.peer_manager.peers:
+            if other is not peer and (piece_index, block_begin) in other.outstanding:
+                other.send_cancel(piece_index, block_begin, block_length)
+
+    def release_requests(self, peer: Peer) -> None:
+        """requests that the peer will not answer go back to the free blocks"""
+        outstanding = list(peer.outstanding)
+        peer.outstanding.clear()
+        self.piece_manager.free_blocks(outstanding)
+
+    def schedule_requests(self) -> None:
+        """request blocks from every peer once the current events are handled"""
+        if self.request_handle is None:
+            self.request_handle = asyncio.get_running_loop().call_soon(
+                self.request_blocks
+            )
+
+    def request_blocks(self) -> None:
+        self.request_handle = None
+        for peer in self.peer_manager.peers:
+            self.request_peer_blocks(peer)
+
+    def request_peer_blocks(self, peer: Peer) -> None:
+        """fill the request queue of the peer, started pieces first and then the
+        rarest pieces the peer has"""
+        if not (peer.is_ready and peer.is_eligible):
+            return
+
+        picker = self.piece_manager.picker
+        if self.piece_manager.in_endgame:
+            self.request_endgame_blocks(peer)
+            return
+
+        # only the started pieces with free blocks are walked, and the bits are
+        # tested on the bytes, indexing the BitArray is much slower
+        have: bytes = peer.bitfield.tobytes()
+        for piece_index in picker.requestable_pieces():
+            if have[piece_index >> 3] & (0x80 >> (piece_index & 7)):
+                self.request_piece(peer, self.piece_manager.get_piece(piece_index))
+                if not peer.is_eligible:
+                    return
+
+        while peer.is_eligible and self.piece_manager.has_free_buffer:
+            piece_index = picker.pick(peer.bitfield)
+            if piece_index is None:
+                break
+            self.request_piece(peer, self.piece_manager.get_piece(piece_index))
 
-        while not self.piece_manager.all_pieces_completed:
-            if not self.peer_manager.has_unchoked_peers:
-                time.sleep(1)
-                logging.info("No unchoked peers")
+    def request_endgame_blocks(self, peer: Peer) -> None:
+        """request every missing block the peer has, whichever peer answers
+        first wins and the others are cancelled"""
+        for piece_index in self.piece_manager.picker.partial_pieces():
+            if not peer.has_piece(piece_index):
                 continue
 
-            for piece in self.piece_manager.get_required_pieces():
-                peer: Peer = self.peer_manager.get_peer_having_piece(piece.index)
-                if not peer:
-                    continue
+            for block_begin, block_length in self.piece_manager.get_piece(
+                piece_index
+            ).get_pending_blocks():
+                if not peer.is_eligible:
+                    return
+                if (piece_index, block_begin) not in peer.outstanding:
+                    self.send_request(peer, piece_index, block_begin, block_length)
 
-                block = piece.get_required_block()
-                if not block:
-                    continue
+    def request_piece(self, peer: Peer, piece: Piece) -> None:
+        while peer.is_eligible:
+            block = piece.get_required_block()
+            if not block:
+                # the buffer pool may be empty while free blocks are left
+                if not piece.has_free_blocks:
+                    self.piece_manager.picker.mark_requested(piece.index)
+                break
 
-                block_begin, block_length = block
-                peer.send_request(piece.index, block_begin, block_length)
+            block_begin, block_length = block
+            self.send_request(peer, piece.index, block_begin, block_length)
 
-                while not peer.pieces.empty():
-                    self.piece_manager.process_new_block(peer.pieces.get())
+    def send_request(
+        self, peer: Peer, piece_index: int, block_begin: int, block_length: int
+    ) -> None:
+        peer.send_request(piece_index, block_begin, block_length)
+        self.timeouts.add(peer, piece_index, block_begin)
 
 
 if __name__ == "__main__":
@@ -1,56 +1,39 @@
-#  TODO:
-#      1. bitfield message
-#      2. port message (used for dht tracekers)
-import logging
-from struct import pack, unpack
-from typing import ClassVar
+from struct import Struct
+from typing import ClassVar, Final, Tuple, Type, Union
 
 import bitstring
 
+Buffer = Union[bytes, bytearray, memoryview]
 
-class MessageDispatcher:
-    def __init__(self, payload):
-        self.payload = payload
+# precompiled once, shared by every message with the same layout
+LENGTH_PREFIX: Final[Struct] = Struct(">I")
+HEADER: Final[Struct] = Struct(">IB")
+BLOCK_HEADER: Final[Struct] = Struct(">IBII")
+BLOCK_REQUEST: Final[Struct] = Struct(">IBIII")
 
-    def dispatch(self):
-        length_prefix: int
-        message_id: int
-
-        map_id_to_message = {
-            0: Choke,
-            1: UnChoke,
-            2: Interested,
-            3: NotInterested,
-            4: Have,
-            5: Bitfield,
-            6: Request,
-            7: Piece,
-            8: Cancel,
-            9: Port,
-        }
-
-        try:
-            (length_prefix,) = unpack(">I", self.payload[:4])
-
-            if length_prefix == 0:
-                # keep alive message
-                return KeepAlive.from_bytes(self.payload)
 
-            (message_id,) = unpack(">B", self.payload[4:5])
-        except Exception as e:
-            logging.exception(e)
-
-        if message_id not in map_id_to_message.keys():
-            raise Exception(f"Wrong message id {message_id}")
+class Message:
+    """a message of the peer wire protocol
 
-        return map_id_to_message[message_id].from_bytes(self.payload)
+    codec is the precompiled struct of the fixed part of the message, the
+    messages are encoded with pack_into straight into the buffer of the caller
+    and decoded with unpack_from straight from the received frame.
+    """
 
+    codec: ClassVar[Struct]
+    total_length: int
 
-class Message:
     def to_bytes(self) -> bytes:
+        buffer: bytearray = bytearray(self.total_length)
+        self.pack_into(buffer, 0)
+        return bytes(buffer)
+
+    def pack_into(self, buffer: bytearray, offset: int) -> None:
+        """encode the message in buffer[offset : offset + total_length]"""
         raise NotImplementedError
 
-    def from_bytes(self, payload: bytes):
+    @classmethod
+    def from_bytes(cls, payload: Buffer) -> "Message":
         raise NotImplementedError
 
 
@@ -68,7 +51,7 @@ class Handshake(Message):
 
     pstr: ClassVar[bytes] = b"BitTorrent protocol"
     pstrlen: ClassVar[int] = len(pstr)
-    encoding_format: ClassVar[str] = f">B{pstrlen}s8s20s20s"
+    codec: ClassVar[Struct] = Struct(f">B{pstrlen}s8s20s20s")
     total_length: ClassVar[int] = 68
 
     def __init__(self, info_hash: bytes, peer_id: bytes):
@@ -76,31 +59,28 @@ class Handshake(Message):
         self.info_hash: bytes = info_hash
         self.peer_id: bytes = peer_id
 
-    def to_bytes(self):
-        reserved: bytes = b"\x00" * 8
-
-        return pack(
-            Handshake.encoding_format,
+    def pack_into(self, buffer: bytearray, offset: int) -> None:
+        Handshake.codec.pack_into(
+            buffer,
+            offset,
             Handshake.pstrlen,
             Handshake.pstr,
-            reserved,
+            bytes(8),
             self.info_hash,
             self.peer_id,
         )
 
     @classmethod
-    def from_bytes(cls, payload: bytes):
+    def from_bytes(cls, payload: Buffer):
         pstrlen: int
-        pstr: str
+        pstr: bytes
         reserved: bytes
         info_hash: bytes
         peer_id: bytes
 
-        pstrlen, pstr, reserved, info_hash, peer_id = unpack(
-            cls.encoding_format, payload[: cls.total_length]
-        )
+        pstrlen, pstr, reserved, info_hash, peer_id = cls.codec.unpack_from(payload)
 
-        if pstr != cls.pstr:
+        if pstrlen != cls.pstrlen or pstr != cls.pstr:
             raise ValueError("Invalid pstr")
 
         return cls(info_hash, peer_id)
@@ -114,21 +94,16 @@ class KeepAlive(Message):
     payload: NO
     """
 
-    encoding_format: ClassVar[str] = ">I"
+    codec: ClassVar[Struct] = LENGTH_PREFIX
     length_prefix: ClassVar[int] = 0
     total_length: ClassVar[int] = 4
 
-    def __init__(self):
-        super().__init__()
-
-    def to_bytes(self):
-        return pack(KeepAlive.encoding_format, KeepAlive.length_prefix)
+    def pack_into(self, buffer: bytearray, offset: int) -> None:
+        KeepAlive.codec.pack_into(buffer, offset, KeepAlive.length_prefix)
 
     @classmethod
-    def from_bytes(cls, payload: bytes):
-        length_prefix: int
-
-        (length_prefix,) = unpack(cls.encoding_format, payload[: cls.total_length])
+    def from_bytes(cls, payload: Buffer):
+        (length_prefix,) = cls.codec.unpack_from(payload)
 
         if length_prefix != cls.length_prefix:
             raise ValueError("Invalid KeepAlive message")
@@ -136,81 +111,53 @@ class KeepAlive(Message):
         return cls()
 
 
-class Choke(Message):
-    """choke: <len=0001><id=0>
-
-    length prefix: 1 (4 bytes)
-    message id: 0 (1 byte)
-    payload: NO
-    """
+class State(Message):
+    """a message made of its id only, which changes the state of the connection"""
 
+    codec: ClassVar[Struct] = HEADER
     length_prefix: ClassVar[int] = 1
-    encoding_format: ClassVar[str] = ">IB"
-    message_id: ClassVar[int] = 0
+    message_id: ClassVar[int]
     total_length: ClassVar[int] = 5
 
-    def __init__(self):
-        super().__init__()
-
-    def to_bytes(self):
-        return pack(Choke.encoding_format, Choke.length_prefix, Choke.message_id)
+    def pack_into(self, buffer: bytearray, offset: int) -> None:
+        self.codec.pack_into(buffer, offset, self.length_prefix, self.message_id)
 
     @classmethod
-    def from_bytes(cls, payload: bytes):
-        length_prefix: int
-        message_id: int
-
-        length_prefix, message_id = unpack(
-            cls.encoding_format, payload[: cls.total_length]
-        )
+    def from_bytes(cls, payload: Buffer):
+        length_prefix, message_id = cls.codec.unpack_from(payload)
 
         if length_prefix != cls.length_prefix:
-            raise Exception("Invalid prefix length for Choke message")
+            raise ValueError(f"Invalid prefix length for {cls.__name__} message")
 
         if message_id != cls.message_id:
-            raise Exception("Invalid message id for Choke message")
+            raise ValueError(f"Invalid message id for {cls.__name__} message")
 
         return cls()
 
 
-class UnChoke(Message):
-    """unchoke: <len=0001><id=1>
+class Choke(State):
+    """choke: <len=0001><id=0>
 
     length prefix: 1 (4 bytes)
-    message id: 1 (1 byte)
+    message id: 0 (1 byte)
     payload: NO
     """
 
-    length_prefix: ClassVar[int] = 1
-    encoding_format: ClassVar[str] = ">IB"
-    message_id: ClassVar[int] = 1
-    total_length: ClassVar[int] = 5
-
-    def __init__(self):
-        super().__init__()
-
-    def to_bytes(self):
-        return pack(UnChoke.encoding_format, UnChoke.length_prefix, UnChoke.message_id)
-
-    @classmethod
-    def from_bytes(cls, payload: bytes):
-        length_prefix: int
-        message_id: int
+    message_id: ClassVar[int] = 0
 
-        length_prefix, message_id = unpack(
-            cls.encoding_format, payload[: cls.total_length]
-        )
 
-        if length_prefix != cls.length_prefix:
-            raise Exception("Invalid prefix length for Unchoke message")
+class UnChoke(State):
+    """unchoke: <len=0001><id=1>
 
-        if message_id != cls.message_id:
-            raise Exception("Invalid message id for Unchoke message")
+    length prefix: 1 (4 bytes)
+    message id: 1 (1 byte)
+    payload: NO
+    """
 
-        return cls()
+    message_id: ClassVar[int] = 1
 
 
-class Interested(Message):
+class Interested(State):
     """interested: <len=0001><id=2>
 
     length prefix: 1 (4 bytes)
@@ -218,38 +165,10 @@ class Interested(Message):
     payload: NO
     """
 
-    length_prefix: ClassVar[int] = 1
-    encoding_format: ClassVar[str] = ">IB"
     message_id: ClassVar[int] = 2
-    total_length: ClassVar[int] = 5
 
-    def __init__(self):
-        super().__init__()
-
-    def to_bytes(self):
-        return pack(
-            Interested.encoding_format, Interested.length_prefix, Interested.message_id
-        )
-
-    @classmethod
-    def from_bytes(cls, payload: bytes):
-        length_prefix: int
-        message_id: int
 
-        length_prefix, message_id = unpack(
-            cls.encoding_format, payload[: cls.total_length]
-        )
-
-        if length_prefix != cls.length_prefix:
-            raise Exception("Invalid prefix length for Interested message")
-
-        if message_id != cls.message_id:
-            raise Exception("Invalid message id for Interested message")
-
-        return cls()
-
-
-class NotInterested(Message):
+class NotInterested(State):
     """not interested: <len=0001><id=3>
 
     length prefix: 1 (4 bytes)
@@ -257,37 +176,7 @@ class NotInterested(Message):
     payload: NO
     """
 
-    length_prefix: ClassVar[int] = 1
-    encoding_format: ClassVar[str] = ">IB"
     message_id: ClassVar[int] = 3
-    total_length: ClassVar[int] = 5
-
-    def __init__(self):
-        super().__init__()
-
-    def to_bytes(self):
-        return pack(
-            NotInterested.encoding_format,
-            NotInterested.length_prefix,
-            NotInterested.message_id,
-        )
-
-    @classmethod
-    def from_bytes(cls, payload: bytes):
-        length_prefix: int
-        message_id: int
-
-        length_prefix, message_id = unpack(
-            cls.encoding_format, payload[: cls.total_length]
-        )
-
-        if length_prefix != cls.length_prefix:
-            raise Exception("Invalid prefix length for NotInterested message")
-
-        if message_id != cls.message_id:
-            raise Exception("Invalid message id for NotInterested message")
-
-        return cls()
 
 
 class Have(Message):
@@ -300,34 +189,32 @@ class Have(Message):
     """
 
     length_prefix: ClassVar[int] = 5
-    encoding_format: ClassVar[str] = ">IBI"
+    codec: ClassVar[Struct] = Struct(">IBI")
     message_id: ClassVar[int] = 4
     total_length: ClassVar[int] = 9
 
-    def __init__(self, piece_index):
+    def __init__(self, piece_index: int):
         super().__init__()
         self.piece_index: int = piece_index
 
-    def to_bytes(self):
-        return pack(
-            Have.encoding_format, Have.length_prefix, Have.message_id, self.piece_index
+    def pack_into(self, buffer: bytearray, offset: int) -> None:
+        Have.codec.pack_into(
+            buffer, offset, Have.length_prefix, Have.message_id, self.piece_index
         )
 
     @classmethod
-    def from_bytes(cls, payload: bytes):
+    def from_bytes(cls, payload: Buffer):
         length_prefix: int
         message_id: int
         piece_index: int
 
-        length_prefix, message_id, piece_index = unpack(
-            cls.encoding_format, payload[: cls.total_length]
-        )
+        length_prefix, message_id, piece_index = cls.codec.unpack_from(payload)
 
         if length_prefix != cls.length_prefix:
-            raise Exception("Invalid prefix length for Have message")
+            raise ValueError("Invalid prefix length for Have message")
 
         if message_id != cls.message_id:
-            raise Exception("Invalid message id for Have message")
+            raise ValueError("Invalid message id for Have message")
 
         return cls(piece_index)
 
@@ -341,42 +228,36 @@ class Bitfield(Message):
         bitfield: bitfield representing the pieces that have been successfully downloaded (X bytes)
     """
 
+    codec: ClassVar[Struct] = HEADER
     message_id: ClassVar[int] = 5
 
     def __init__(self, bitfield: bitstring.BitArray):
         super().__init__()
         self.bitfield: bitstring.BitArray = bitfield
-        self.bitfield_length: int = len(self.bitfield)
+        # in bytes, the spare bits of the last byte are zero
+        self.bitfield_length: int = -(-len(self.bitfield) // 8)
         self.length_prefix: int = 1 + self.bitfield_length
-        self.encoding_format: str = f">IB{self.bitfield_length}s"
         self.total_length: int = self.length_prefix + 4
 
-    def to_bytes(self) -> bytes:
-        return pack(
-            self.encoding_format, self.length_prefix, Bitfield.message_id, self.bitfield
+    def pack_into(self, buffer: bytearray, offset: int) -> None:
+        Bitfield.codec.pack_into(
+            buffer, offset, self.length_prefix, Bitfield.message_id
         )
+        start: int = offset + Bitfield.codec.size
+        buffer[start : start + self.bitfield_length] = self.bitfield.tobytes()
 
     @classmethod
-    def from_bytes(cls, payload: bytes):
+    def from_bytes(cls, payload: Buffer):
         length_prefix: int
         message_id: int
-        raw_bitfield: bytes
-        bitfield: bitstring.BitArray
 
-        length_prefix, message_id = unpack(
-            ">IB", payload[:5]
-        )  # length_prefix + message_id = 5 bytes
+        length_prefix, message_id = cls.codec.unpack_from(payload)
 
         if message_id != cls.message_id:
-            raise Exception("Invalid message id for Bitfield message")
+            raise ValueError("Invalid message id for Bitfield message")
 
-        bitfield_length: int = length_prefix - 1
         total_length: int = length_prefix + 4
-        (raw_bitfield,) = unpack(f">{bitfield_length}s", payload[5:total_length])
-
-        bitfield = bitstring.BitArray(raw_bitfield)
-
-        return cls(bitfield)
+        return cls(bitstring.BitArray(bytes(payload[cls.codec.size : total_length])))
 
 
 class Request(Message):
@@ -392,7 +273,7 @@ class Request(Message):
 
     length_prefix: ClassVar[int] = 13
     message_id: ClassVar[int] = 6
-    encoding_format: ClassVar[str] = ">IBIII"
+    codec: ClassVar[Struct] = BLOCK_REQUEST
     total_length: ClassVar[int] = 17  # length prefix + 4
 
     def __init__(self, piece_index: int, block_begin: int, block_length: int) -> None:
@@ -401,33 +282,38 @@ class Request(Message):
         self.block_begin: int = block_begin
         self.block_length: int = block_length
 
-    def to_bytes(self):
-        return pack(
-            Request.encoding_format,
-            Request.length_prefix,
-            Request.message_id,
+    def pack_into(self, buffer: bytearray, offset: int) -> None:
+        self.codec.pack_into(
+            buffer,
+            offset,
+            self.length_prefix,
+            self.message_id,
             self.piece_index,
             self.block_begin,
             self.block_length,
         )
 
     @classmethod
-    def from_bytes(cls, payload: bytes):
+    def from_bytes(cls, payload: Buffer):
         length_prefix: int
         message_id: int
         piece_index: int
         block_begin: int
         block_length: int
 
-        length_prefix, message_id, piece_index, block_begin, block_length = unpack(
-            cls.encoding_format, payload[: cls.total_length]
-        )
+        (
+            length_prefix,
+            message_id,
+            piece_index,
+            block_begin,
+            block_length,
+        ) = cls.codec.unpack_from(payload)
 
         if length_prefix != cls.length_prefix:
-            raise Exception("Invalid prefix length for Request message")
+            raise ValueError(f"Invalid prefix length for {cls.__name__} message")
 
         if message_id != cls.message_id:
-            raise Exception("Invalid message id for Request message")
+            raise ValueError(f"Invalid message id for {cls.__name__} message")
 
         return cls(piece_index, block_begin, block_length)
 
@@ -443,53 +329,65 @@ class Piece(Message):
         block: block of data, which is a subset of the piece specified by index (block length bytes)
     """
 
+    codec: ClassVar[Struct] = BLOCK_HEADER
     message_id: ClassVar[int] = 7
 
-    def __init__(self, piece_index: int, block_begin: int, block: bytes):
+    def __init__(self, piece_index: int, block_begin: int, block: Buffer):
         super().__init__()
         self.piece_index: int = piece_index
         self.block_begin: int = block_begin
-        self.block: bytes = block
+        self.block: Buffer = block
         self.block_length: int = len(block)
         self.length_prefix: int = 9 + self.block_length
-        self.encoding_format: str = f">IBII{self.block_length}s"
         self.total_length: int = self.length_prefix + 4
 
-    def to_bytes(self):
-        return pack(
-            self.encoding_format,
+    @staticmethod
+    def pack_header_into(
+        buffer: bytearray,
+        offset: int,
+        piece_index: int,
+        block_begin: int,
+        block_length: int,
+    ) -> None:
+        """everything before the block, so the block can be sent from where it is"""
+        Piece.codec.pack_into(
+            buffer, offset, 9 + block_length, Piece.message_id, piece_index, block_begin
+        )
+
+    def pack_into(self, buffer: bytearray, offset: int) -> None:
+        Piece.codec.pack_into(
+            buffer,
+            offset,
             self.length_prefix,
             Piece.message_id,
             self.piece_index,
             self.block_begin,
-            self.block,
         )
+        start: int = offset + Piece.codec.size
+        buffer[start : start + self.block_length] = self.block
 
     @classmethod
-    def from_bytes(cls, payload: bytes):
+    def from_bytes(cls, payload: Buffer):
         length_prefix: int
         message_id: int
         piece_index: int
         block_begin: int
-        block: bytes
-        block_start: int = 13
 
-        length_prefix, message_id, piece_index, block_begin = unpack(
-            ">IBII", payload[:block_start]
+        length_prefix, message_id, piece_index, block_begin = cls.codec.unpack_from(
+            payload
         )
 
-        total_length: int = length_prefix + 4
-        block_length: int = length_prefix - 9
-
-        (block,) = unpack(f">{block_length}s", payload[block_start:total_length])
-
         if message_id != cls.message_id:
-            raise Exception("Invalid message id for Piece message")
+            raise ValueError("Invalid message id for Piece message")
 
-        return cls(piece_index, block_begin, block)
+        # keep the block as a view on the received frame instead of copying it
+        total_length: int = length_prefix + 4
+        return cls(
+            piece_index, block_begin, memoryview(payload)[cls.codec.size : total_length]
+        )
 
 
-class Cancel(Message):
+class Cancel(Request):
     """cancel: <len=0013><id=8><index><begin><length>
 
     length prefix: 13 (4 bytes)
@@ -500,47 +398,67 @@ class Cancel(Message):
         length: integer specifying the requested length (4 bytes)
     """
 
-    length_prefix: ClassVar[int] = 13
     message_id: ClassVar[int] = 8
-    encoding_format: ClassVar[str] = ">IBIII"
-    total_length: ClassVar[int] = 17  # length_prefix + 4
 
-    def __init__(self, piece_index: int, block_begin: int, block_length: int):
+
+class Port(Message):
+    """port: <len=0003><id=9><listen-port>
+
+    length prefix: 3 (4 bytes)
+    message id: 9 (1 byte)
+    payload: (2 bytes)
+        listen-port: the port the DHT node of the peer listens on (2 bytes)
+    """
+
+    length_prefix: ClassVar[int] = 3
+    message_id: ClassVar[int] = 9
+    codec: ClassVar[Struct] = Struct(">IBH")
+    total_length: ClassVar[int] = 7
+
+    def __init__(self, listen_port: int):
         super().__init__()
-        self.piece_index: int = piece_index
-        self.block_begin: int = block_begin
-        self.block_length: int = block_length
+        self.listen_port: int = listen_port
 
-    def to_bytes(self):
-        return pack(
-            Cancel.encoding_format,
-            Cancel.length_prefix,
-            Cancel.message_id,
-            self.piece_index,
-            self.block_begin,
-            self.block_length,
+    def pack_into(self, buffer: bytearray, offset: int) -> None:
+        Port.codec.pack_into(
+            buffer, offset, Port.length_prefix, Port.message_id, self.listen_port
         )
 
     @classmethod
-    def from_bytes(cls, payload: bytes):
-        length_prefix: int
-        message_id: int
-        piece_index: int
-        block_begin: int
-        block_length: int
-
-        length_prefix, message_id, piece_index, block_begin, block_length = unpack(
-            cls.encoding_format, payload[: cls.total_length]
-        )
+    def from_bytes(cls, payload: Buffer):
+        length_prefix, message_id, listen_port = cls.codec.unpack_from(payload)
 
         if length_prefix != cls.length_prefix:
-            raise Exception("Invalid prefix length for Cancel message")
+            raise ValueError("Invalid prefix length for Port message")
 
         if message_id != cls.message_id:
-            raise Exception("Invalid message id for Cancel message")
+            raise ValueError("Invalid message id for Port message")
 
-        return cls(piece_index, block_begin, block_begin)
+        return cls(listen_port)
 
 
-class Port(Message):
-    pass
+# indexed by message id
+MESSAGE_TYPES: Final[Tuple[Type[Message], ...]] = (
+    Choke,
+    UnChoke,
+    Interested,
+    NotInterested,
+    Have,
+    Bitfield,
+    Request,
+    Piece,
+    Cancel,
+    Port,
+)
+
+
+def decode(frame: Buffer) -> Message:
+    """the message in a complete <length prefix><message> frame"""
+    if len(frame) == LENGTH_PREFIX.size:
+        return KeepAlive.from_bytes(frame)
+
+    message_id: int = frame[LENGTH_PREFIX.size]
+    if message_id >= len(MESSAGE_TYPES):
+        raise ValueError(f"Wrong message id {message_id}")
+
+    return MESSAGE_TYPES[message_id].from_bytes(frame)
@@ -1,37 +1,86 @@
+import asyncio
 import logging
-import socket
-import struct
+from collections import OrderedDict
 from time import time
-from typing import Final, List, Tuple
-from queue import Queue
+from typing import Callable, Dict, Final, Iterator, List, Optional, Tuple
 
 import message
 from bitstring import BitArray
-
-MAX_BUFFER: Final[int] = 4096
-PEER_REQUEST_TIME: Final[float] = 0.2
+from block import BLOCK_LENGTH
+from ratelimit import Throttle, TokenBucket
+from timeouts import REQUEST_TIMEOUT
+from wire import MAX_FRAME_SIZE, FrameBuffer
+
+CONNECT_TIMEOUT: Final[float] = 2.0
+HANDSHAKE_TIMEOUT: Final[float] = 10.0
+# bounds of the number of outstanding block requests per peer
+MIN_REQUEST_QUEUE: Final[int] = 4
+MAX_REQUEST_QUEUE: Final[int] = 256
+# keep enough requests queued for this many seconds of download
+REQUEST_QUEUE_TIME: Final[float] = 3.0
+RATE_INTERVAL: Final[float] = 1.0
+# requests of a peer are dropped beyond this length or this number of blocks
+MAX_REQUEST_LENGTH: Final[int] = 2 ** 17
+MAX_UPLOAD_QUEUE: Final[int] = 256
+# messages are encoded into a buffer of this size, grown when needed
+WRITE_BUFFER_SIZE: Final[int] = 2 ** 12
+# a read under a rate limit still fits a whole block message
+MIN_READ: Final[int] = BLOCK_LENGTH + 13
+
+# (piece index, begin, length) to a block of a piece we have
+ReadBlockType = Callable[[int, int, int], Optional[memoryview]]
 
 
 class Peer:
     def __init__(self, peer_id, ip, port, info_hash, bitfield_length):
-        self.peer_id: bytes = peer_id
+        self.peer_id: Optional[bytes] = peer_id
         self.info_hash: bytes = info_hash
-        self.ip: bytes = ip
+        self.ip: str = ip
         self.port: int = port
         self.bitfield: BitArray = BitArray(bitfield_length)
-        # self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.pieces: Queue[Tuple[int, int, bytes]] = Queue()
-        self.socket = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.transport: Optional[asyncio.Transport] = None
+        self.closed: Optional[asyncio.Future] = None
+        self.handshake_received: Optional[asyncio.Future] = None
+        self.process_message: Optional[Callable[[message.Message, Peer], None]] = None
+        self.read_block: Optional[ReadBlockType] = None
         self.am_choking: bool = True
         self.am_interested: bool = False
         self.peer_choking: bool = True
         self.peer_interseted: bool = False
         self.handshaked: bool = False
-        self.read_buffer: bytes = b""
-        self.write_buffer: bytes = b""
+        # the bitfield is the only message that can be longer than a block
+        self.read_buffer: FrameBuffer = FrameBuffer(
+            max_frame=max(MAX_FRAME_SIZE, 5 + -(-bitfield_length // 8))
+        )
+        # messages are encoded at write_end, the bytes before flushed are queued
+        self.write_buffer: bytearray = bytearray(WRITE_BUFFER_SIZE)
+        self.write_end: int = 0
+        self.flushed: int = 0
+        # buffers for the next vectored write, views on the write buffer and on
+        # the blocks being uploaded
+        self.outgoing: List[memoryview] = []
+        self.send_scheduled: bool = False
+        # bandwidth of the peer, drawn from the buckets of its torrent and session
+        self.download_bucket: TokenBucket = TokenBucket()
+        self.upload_bucket: TokenBucket = TokenBucket()
+        self.throttle: Optional[Throttle] = None
+        self.reading: bool = True
+        self.upload_waiting: bool = False
+        # blocks requested by the peer, in the order they were requested
+        self.uploads: "OrderedDict[Tuple[int, int, int], None]" = OrderedDict()
+        self.writing: bool = True
+        self.uploaded: int = 0
         self.healthy: bool = False
-        self.last_ping: float = 0.0
-        self.requested: bool = False
+        self.latency: float = 0.0
+        # deadline of the blocks requested from the peer by (piece index, begin)
+        self.outstanding: Dict[Tuple[int, int], float] = {}
+        self.max_outstanding: int = MIN_REQUEST_QUEUE
+        self.timed_out: int = 0
+        self.downloaded: int = 0
+        self.download_rate: float = 0.0
+        self.rate_downloaded: int = 0
+        self.rate_time: float = time()
 
     @property
     def is_ready(self) -> bool:
@@ -39,87 +88,324 @@ class Peer:
 
     @property
     def is_eligible(self) -> bool:
-        return (time() - self.last_ping) > PEER_REQUEST_TIME
+        return len(self.outstanding) < self.max_outstanding
+
+    def update_download_rate(self, nbytes: int) -> None:
+        """size the request queue after the bandwidth delay product of the peer"""
+        self.downloaded += nbytes
+        now: float = time()
+        elapsed: float = now - self.rate_time
+        if elapsed < RATE_INTERVAL:
+            return
+
+        rate: float = (self.downloaded - self.rate_downloaded) / elapsed
+        self.download_rate = (self.download_rate + rate) / 2
+        self.rate_downloaded, self.rate_time = self.downloaded, now
+
+        queue: int = int(self.download_rate * REQUEST_QUEUE_TIME / BLOCK_LENGTH)
+        self.max_outstanding = max(MIN_REQUEST_QUEUE, min(queue, MAX_REQUEST_QUEUE))
+
+    def request_timed_out(self) -> None:
+        """the peer is slower than its request queue assumes, shrink it"""
+        self.timed_out += 1
+        self.download_rate /= 2
+        self.max_outstanding = max(MIN_REQUEST_QUEUE, self.max_outstanding // 2)
+
+    def set_rate_limits(
+        self, download: TokenBucket, upload: TokenBucket, throttle: Throttle
+    ) -> None:
+        """draw the bandwidth of the peer from download and upload"""
+        self.download_bucket = TokenBucket(parent=download)
+        self.upload_bucket = TokenBucket(parent=upload)
+        self.throttle = throttle
 
     def has_piece(self, piece_index: int):
         return self.bitfield[piece_index]
 
-    def fileno(self):
-        return self.socket.fileno()
-
-    def connect(self):
+    async def connect(self) -> bool:
         try:
-            self.socket = socket.create_connection((self.ip, self.port), timeout=2)
-            self.socket.setblocking(False)
+            self.loop = asyncio.get_running_loop()
+            self.closed = self.loop.create_future()
+            self.handshake_received = self.loop.create_future()
+            started: float = time()
+            await asyncio.wait_for(
+                self.loop.create_connection(
+                    lambda: PeerProtocol(self), self.ip, self.port
+                ),
+                CONNECT_TIMEOUT,
+            )
+            self.latency = time() - started
             self.healthy = True
             logging.debug(f"connected to peer - {self.ip}:{self.port}")
         except Exception as e:
-            logging.error(e)
+            logging.debug(f"connection failed with peer - {self.ip}: {e!r}")
+            self.loop = None
             return False
         return True
 
-    def send(self):
-        try:
-            msg: bytes = self.write_buffer
-            totalsent: int = 0
-            while totalsent < len(msg):
-                sent: int = self.socket.send(msg[totalsent:])
-                if sent == 0:
-                    raise RuntimeError("socket connection broken while sending")
-                totalsent = totalsent + sent
-                self.write_buffer = b""
-        except Exception as e:
-            logging.error(e)
+    def accept(self, transport: asyncio.BaseTransport, handshake: bytes) -> None:
+        """take over a connection the peer opened, its handshake already read"""
+        self.loop = asyncio.get_running_loop()
+        self.closed = self.loop.create_future()
+        self.handshake_received = self.loop.create_future()
+        protocol: PeerProtocol = PeerProtocol(self)
+        transport.set_protocol(protocol)
+        protocol.connection_made(transport)
+
+        self.read_buffer.get_buffer()[: len(handshake)] = handshake
+        self.read_buffer.advance(len(handshake))
+        self.healthy = True
+        logging.debug(f"accepted peer - {self.ip}:{self.port}")
+
+    def close(self) -> None:
+        self.healthy = False
+        self.uploads.clear()
+        if self.throttle is not None:
+            self.throttle.cancel(self.resume_reading)
+            self.throttle.cancel(self.resume_sending)
+        if self.transport is not None:
+            self.transport.close()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.healthy = False
+        if exc is not None:
+            logging.debug(f"connection lost with peer - {self.ip}: {exc}")
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result(None)
+
+    def write(self, msg: message.Message) -> None:
+        """encode the message for the peer, everything written during one pass of
+        the event loop is sent at once"""
+        offset: int = self._reserve(msg.total_length)
+        msg.pack_into(self.write_buffer, offset)
+        self.write_end += msg.total_length
+        if self.loop is not None and not self.send_scheduled:
+            self.send_scheduled = True
+            self.loop.call_soon(self.send)
+
+    def _reserve(self, nbytes: int) -> int:
+        """offset in the write buffer where nbytes can be encoded"""
+        if self.write_end + nbytes > len(self.write_buffer):
+            # the part already queued stays in the old buffer, the queue refers to it
+            pending: int = self.write_end - self.flushed
+            buffer: bytearray = bytearray(
+                max(pending + nbytes, 2 * len(self.write_buffer))
+            )
+            buffer[:pending] = self.write_buffer[self.flushed : self.write_end]
+            self.write_buffer = buffer
+            self.flushed, self.write_end = 0, pending
+        return self.write_end
+
+    def _queue_encoded(self) -> None:
+        """queue what was encoded in the write buffer since the last call"""
+        if self.write_end > self.flushed:
+            self.outgoing.append(
+                memoryview(self.write_buffer)[self.flushed : self.write_end]
+            )
+            self.flushed = self.write_end
 
-    def receive(self):
-        data = b""
+    @property
+    def can_send_blocks(self) -> bool:
+        return bool(self.uploads) and self.writing and not self.upload_waiting
+
+    def send(self) -> None:
+        """send everything encoded and as many requested blocks as the transport
+        and the limits take, each batch in a single vectored write"""
+        self.send_scheduled = False
+        if self.transport is None:
+            return
+
+        # another batch only while the transport takes the previous one at once
+        more: bool = True
+        while more:
+            more = self.queue_blocks()
+            self.flush()
+            if not self.can_send_blocks:
+                return
+
+    def queue_blocks(self) -> bool:
+        """queue requested blocks up to the high-water mark of the transport and
+        the tokens available, the requests left can still be cancelled
+
+        Returns False when the transport or the limits are full, another batch
+        would not be taken before they drain."""
+        if not self.can_send_blocks:
+            return False
+        if self.throttle is not None and self.upload_bucket.wait_time():
+            self.upload_waiting = True
+            self.throttle.wait(self.upload_bucket, self.resume_sending)
+            return False
 
-        while True:
-            try:
-                chunk: bytes = self.socket.recv(MAX_BUFFER)
-                if len(chunk) <= 0:
-                    break
+        room: float = (
+            self.transport.get_write_buffer_limits()[1]
+            - self.transport.get_write_buffer_size()
+        )
+        tokens: Optional[float] = self.upload_bucket.available()
+        if tokens is not None:
+            room = min(room, tokens)
+        full: bool = room <= 0
+        # still a whole block when full: the debt makes the next batch wait, and
+        # a transport at its high-water mark is only paused, and later resumed,
+        # once it goes over it
+        room = max(room, 1)
+
+        while self.uploads and room > 0:
+            (piece_index, block_begin, block_length), _ = self.uploads.popitem(
+                last=False
+            )
+            block: Optional[memoryview] = self.read_block(
+                piece_index, block_begin, block_length
+            )
+            if block is None:
+                logging.debug(f"Peer - {self.ip} requested a piece we don't have")
+                continue
 
-                data += chunk
-            except Exception as e:
-                logging.exception(e)
-                break
+            offset: int = self._reserve(message.Piece.codec.size)
+            message.Piece.pack_header_into(
+                self.write_buffer, offset, piece_index, block_begin, block_length
+            )
+            self.write_end += message.Piece.codec.size
+            self._queue_encoded()
+            # the block goes from the read cache to the transport without a copy
+            self.outgoing.append(block)
+            self.uploaded += block_length
+            room -= message.Piece.codec.size + block_length
+
+        return not full
+
+    def flush(self) -> None:
+        self._queue_encoded()
+        if not self.outgoing:
+            return
+
+        self.upload_bucket.consume(sum(map(len, self.outgoing)))
+        self.transport.writelines(self.outgoing)
+        self.outgoing = []
+        self.flushed = self.write_end = 0
+        # what the transport could not send yet may still refer to the buffer
+        if self.transport.get_write_buffer_size():
+            self.write_buffer = bytearray(len(self.write_buffer))
+
+    def resume_sending(self) -> None:
+        self.upload_waiting = False
+        if self.healthy:
+            self.send()
+
+    def received(self, nbytes: int) -> None:
+        """stop reading while a bucket is in debt, but never in the middle of a
+        message so that blocks are always received whole"""
+        self.download_bucket.consume(nbytes)
+        if (
+            self.throttle is None
+            or not (self.reading and self.healthy)
+            or len(self.read_buffer)
+            or not self.download_bucket.wait_time()
+        ):
+            return
+
+        self.reading = False
+        self.transport.pause_reading()
+        self.throttle.wait(self.download_bucket, self.resume_reading)
+
+    def resume_reading(self) -> None:
+        self.reading = True
+        if self.healthy and self.transport is not None:
+            self.transport.resume_reading()
+
+    async def run(self, process_message: Callable[[message.Message, "Peer"], None]):
+        """dispatch messages until the connection breaks"""
+        self.process_message = process_message
+        self.process_messages()
+
+        await asyncio.wait(
+            (self.handshake_received, self.closed),
+            timeout=HANDSHAKE_TIMEOUT,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if not self.handshaked:
+            self.close()
+            raise ConnectionError(f"no handshake from peer - {self.ip}")
+
+        await self.closed
+
+    def process_messages(self) -> None:
+        """dispatch every complete message in the read buffer"""
+        if self.process_message is None:
+            return
+
+        try:
+            for msg in self.get_messages():
+                self.process_message(msg, self)
+        except Exception as e:
+            logging.exception(e)
+            self.close()
 
-        self.read_buffer += data
+        self.send()
 
     def send_handshake(self, peer_id):
-        handshake: message.Handshake = message.Handshake(self.info_hash, peer_id)
-        self.write_buffer += handshake.to_bytes()
+        self.write(message.Handshake(self.info_hash, peer_id))
         logging.info("new peer added : %s" % self.ip)
 
     def send_request(self, piece_index: int, block_begin: int, block_length: int):
-        request: message.Request = message.Request(
-            piece_index, block_begin, block_length
+        self.outstanding[(piece_index, block_begin)] = (
+            self.loop.time() + REQUEST_TIMEOUT
         )
-        self.write_buffer += request.to_bytes()
+        self.write(message.Request(piece_index, block_begin, block_length))
+
+    def send_cancel(self, piece_index: int, block_begin: int, block_length: int):
+        self.outstanding.pop((piece_index, block_begin), None)
+        self.write(message.Cancel(piece_index, block_begin, block_length))
+
+    def send_bitfield(self, bitfield: BitArray) -> None:
+        self.write(message.Bitfield(bitfield))
+
+    def send_have(self, piece_index: int) -> None:
+        self.write(message.Have(piece_index))
+
+    def choke(self) -> None:
+        """stop uploading to the peer, its pending requests are dropped"""
+        if self.am_choking:
+            return
+        self.am_choking = True
+        self.uploads.clear()
+        self.write(message.Choke())
+
+    def unchoke(self) -> None:
+        if not self.am_choking:
+            return
+        self.am_choking = False
+        self.write(message.UnChoke())
 
     def send_interested(self):
-        interested: message.Interested = message.Interested()
-        self.write_buffer += interested.to_bytes()
+        self.am_interested = True
+        self.write(message.Interested())
 
     def handle_handshake(self):
+        payload = self.read_buffer.read(message.Handshake.total_length)
+        if payload is None:
+            return False
+
         try:
-            hs_recd: message.Handshake = message.Handshake.from_bytes(self.read_buffer)
-            self.read_buffer = self.read_buffer[hs_recd.total_length :]
+            hs_recd: message.Handshake = message.Handshake.from_bytes(payload)
 
             if hs_recd.info_hash != self.info_hash:
                 raise ValueError("Infohash of handshake doesn't match")
-            if hs_recd.peer_id != self.peer_id:
+            if self.peer_id is None:
+                # compact peer lists don't carry the peer id
+                self.peer_id = hs_recd.peer_id
+            elif hs_recd.peer_id != self.peer_id:
                 raise ValueError("Peer ID of handshake doesn't match")
 
             logging.debug(
                 f"Handshake successful with peer - {self.peer_id}:{self.port}"
             )
             self.handshaked = True
+            self.handshake_received.set_result(None)
 
         except Exception as e:
             logging.exception(e)
-            self.healthy = False
+            # drop the connection now instead of at the handshake timeout
+            self.close()
             return False
 
         return True
@@ -127,71 +413,116 @@ class Peer:
     def handle_bitfield(self, bitfield: message.Bitfield):
         self.bitfield = bitfield.bitfield
         logging.debug(f"Bitfield - {self.bitfield}")
-        self.send_interested()
 
     def handle_unchoke(self):
-        self.am_interested = True
         self.peer_choking = False
         logging.debug(f"Peer - {self.ip} has unchocked")
 
     def handle_choke(self):
+        # the peer drops all pending requests when it chokes
         self.peer_choking = True
         logging.debug(f"Peer - {self.ip} is choking")
 
     def handle_interested(self):
         self.peer_interseted = True
-        if self.am_choking:
-            self.write_buffer += message.UnChoke().to_bytes()
         logging.debug(f"Peer - {self.ip} is interested")
 
     def handle_not_interested(self):
         self.peer_interseted = False
         logging.debug(f"Peer - {self.ip} is not interested")
 
-    def handle_have(self, have: message.Have):
-        self.bitfield[have.piece_index] = True
+    def handle_have(self, have: message.Have) -> bool:
+        """True if the piece is new for the peer"""
         logging.debug(f"Peer - {str(self.ip)} sent have message")
+        if self.bitfield[have.piece_index]:
+            return False
+
+        self.bitfield[have.piece_index] = True
+        return True
 
     def handle_request(self, request: message.Request):
-        # if self.peer_interseted and not self.am_choking:
-        pass
+        """queue the block, it is sent once the connection has room for it"""
+        if (
+            self.am_choking
+            or self.read_block is None
+            or request.block_length > MAX_REQUEST_LENGTH
+            or len(self.uploads) >= MAX_UPLOAD_QUEUE
+        ):
+            logging.debug(f"Peer - {self.ip} request dropped")
+            return
+
+        self.uploads[
+            (request.piece_index, request.block_begin, request.block_length)
+        ] = None
 
     def handle_piece(self, piece: message.Piece):
-        self.pieces.put((piece.piece_index, piece.block_begin, piece.block))
+        self.outstanding.pop((piece.piece_index, piece.block_begin), None)
+        self.update_download_rate(len(piece.block))
 
-    def handle_cancel(self):
-        pass
+    def handle_cancel(self, cancel: message.Cancel):
+        self.uploads.pop(
+            (cancel.piece_index, cancel.block_begin, cancel.block_length), None
+        )
 
     def handle_port_request(self):
         pass
 
     def handle_keep_alive(self):
-        try:
-            keep_alive = message.KeepAlive.from_bytes(self.read_buffer)
-            logging.debug(f"handle_keep_alive - {self.ip}")
-        except Exception as e:
-            logging.exception(e)
-            return False
-        self.read_buffer = self.read_buffer[keep_alive.total_length :]
-        return True
-
-    def get_messages(self):
-        while len(self.read_buffer) > 4 and self.healthy:
-            if not self.handshaked and self.handle_handshake():
-                continue
+        logging.debug(f"handle_keep_alive - {self.ip}")
 
-            (payload_length,) = struct.unpack(">I", self.read_buffer[:4])
-            total_length = payload_length + 4
+    def get_messages(self) -> Iterator[message.Message]:
+        if not self.handshaked and not self.handle_handshake():
+            return
 
-            if len(self.read_buffer) < total_length:
+        for payload in self.read_buffer.frames():
+            if not self.healthy:
                 break
-            else:
-                payload = self.read_buffer[:total_length]
-                self.read_buffer = self.read_buffer[total_length:]
 
             try:
-                received_message = message.MessageDispatcher(payload).dispatch()
-                if received_message:
-                    yield received_message
+                received_message: message.Message = message.decode(payload)
             except Exception as e:
                 logging.exception(e)
+                continue
+            yield received_message
+
+
+class PeerProtocol(asyncio.BufferedProtocol):
+    """receiving side of a peer connection
+
+    The transport receives straight into the peer's read buffer and the complete
+    messages are dispatched as soon as they arrive.
+    """
+
+    def __init__(self, peer: Peer):
+        self.peer: Peer = peer
+
+    def connection_made(self, transport) -> None:
+        self.peer.transport = transport
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        buffer: memoryview = self.peer.read_buffer.get_buffer()
+        # receive no more than the limits allow, but always enough to complete
+        # the message being received or a whole block message
+        tokens: Optional[float] = self.peer.download_bucket.available()
+        if tokens is not None:
+            missing: int = self.peer.read_buffer.missing()
+            return buffer[: max(int(tokens), missing or MIN_READ)]
+        return buffer
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.peer.read_buffer.advance(nbytes)
+        self.peer.process_messages()
+        self.peer.received(nbytes)
+
+    def pause_writing(self) -> None:
+        self.peer.writing = False
+
+    def resume_writing(self) -> None:
+        self.peer.writing = True
+        self.peer.send()
+
+    def eof_received(self) -> bool:
+        return False
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.peer.connection_lost(exc)
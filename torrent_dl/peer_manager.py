@@ -1,144 +1,185 @@
+import asyncio
 import logging
-import math
 import os
-import select
-from random import randint, choice
-from threading import Thread
-from typing import Dict, List, Set, Union
+from random import randint
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Type
 
-import bencodepy
 import message
-import requests
+from choker import Choker
+from connection_manager import ConnectionManager
+from listener import Listener
 from peer import Peer
-from math import ceil
+from peer_pool import Candidate, PeerPool
+from ratelimit import Throttle, TokenBucket
 from torrent import Torrent
+from tracker import Announcer, ParamsType, TrackerResponse
+
+if TYPE_CHECKING:
+    from session import Session
 
 BASE_DIR: str = os.path.dirname(__file__)
 CLIENT_ID: str = "BT"
 VERSION: tuple = (0, 0, 10)
-MAX_PEERS: int = 50
-MAX_CONNECTED_PEERS: int = 5
-PeersType = List[Dict[bytes, Union[int, bytes]]]
-
-# TODO
-#  1. Limit number of peers to fetch
-#  2. Add timeout for requests
-
-
-class PeerManager(Thread):
-    """Manage all peers"""
-
-    def __init__(self, torrent: Torrent):
-        super().__init__()
-        self.peer_id: bytes = self.generate_peer_id()
+MAX_PEERS: int = 5000
+MAX_CONNECTED_PEERS: int = 200
+PORT: int = 6881
+
+
+class PeerManager:
+    """Manage all peers
+
+    What happens on a peer is reported to the listener as it happens, through
+    on_peer_connected(peer), on_bitfield(peer), on_have(peer, piece_index),
+    on_unchoke(peer), on_choke(peer), on_block(peer, piece) and
+    on_peer_dropped(peer). The listener also reads the blocks requested by the
+    peers, through read_block(piece_index, block_begin, block_length), and tells
+    whether the torrent is complete through seeding.
+
+    Without a session the torrent listens on its own port for the peers that
+    connect to us. In a session the peer id, the port and the connection limit
+    are the ones of the session, and the bandwidth of the torrent is drawn from the one of the
+    session. The buckets also measure the rates of the torrent and of each peer.
+    """
+
+    def __init__(
+        self, torrent: Torrent, listener: Any, session: Optional["Session"] = None
+    ):
+        self.listener: Any = listener
+        self.session: Optional["Session"] = session
+        self.peer_id: bytes = session.peer_id if session else self.generate_peer_id()
         self.trackers: Set[str] = torrent.trackers
-        self.raw_peers: PeersType = []
+        self.peer_pool: PeerPool = PeerPool(MAX_PEERS)
         self.info_hash: bytes = torrent.info_hash
         self.total_length: int = torrent.total_length
-        self.bitfield_length = ceil(len(torrent.pieces) / 8)
-        self.port: int = 6881
-        self.is_active = True
+        self.bitfield_length: int = len(torrent.pieces)
         self.peers: List[Peer] = []
+        self.download_bucket: TokenBucket = TokenBucket(
+            parent=session.download_bucket if session else None
+        )
+        self.upload_bucket: TokenBucket = TokenBucket(
+            parent=session.upload_bucket if session else None
+        )
+        self.throttle: Throttle = session.throttle if session else Throttle()
+        self.choker: Choker = Choker(self.peers, lambda: self.listener.seeding)
+        self.connections: ConnectionManager = ConnectionManager(
+            self.peer_pool,
+            self.create_peer,
+            self._serve_peer,
+            MAX_CONNECTED_PEERS,
+            limit=session.connection_limit if session else None,
+        )
+        self.announcer: Announcer = Announcer(
+            self.trackers, self.get_params, self.add_tracker_peers
+        )
+        self.incoming: Optional[Listener] = (
+            None
+            if session
+            else Listener(PORT, self.route, lambda: self.connections.can_accept)
+        )
+        self.stopped: Optional[asyncio.Future] = None
 
-    def get_peers(self) -> None:
-        """Get list of all peers from the given trackers"""
+    @property
+    def port(self) -> int:
+        return self.session.port if self.session else self.incoming.port
 
-        params: Dict[str, Union[bytes, int]] = {
+    def get_params(self) -> ParamsType:
+        return {
             "info_hash": self.info_hash,
             "peer_id": self.peer_id,
             "port": self.port,
-            "uploaded": 0,
-            "downloaded": 0,
-            "left": self.total_length,
+            "uploaded": self.upload_bucket.transferred,
+            "downloaded": self.download_bucket.transferred,
+            "left": 0 if self.listener.seeding else self.total_length,
+            "compact": 1,
         }
 
-        for tracker in self.trackers:
-            if len(self.raw_peers) > MAX_PEERS:
-                break
+    def add_tracker_peers(self, response: TrackerResponse) -> None:
+        """peers received from a tracker, connect to them right away"""
+        added: int = self.peer_pool.add_peers(response.peers, response.peers6)
+        logging.debug(f"{added} new peers, {len(self.peer_pool)} known")
+        self.connections.fill()
 
-            try:
-                data: requests.Response = requests.get(tracker, params=params)
-                self.scrape_response(data.content)
-                logging.debug(f"successfully connected to tracker: {tracker}")
-            except Exception as e:
-                logging.exception(f"Error in tracker: {tracker}")
-                logging.exception(e)
-
-        self.add_peers()
-
-    def add_peers(self):
-        for p in self.raw_peers:
-            if len(self.peers) > MAX_CONNECTED_PEERS:
-                break
-
-            peer: Peer = Peer(
-                p[b"peer id"],
-                p[b"ip"],
-                p[b"port"],
-                self.info_hash,
-                self.bitfield_length,
-            )
+    def create_peer(self, candidate: Candidate) -> Peer:
+        return self._new_peer(candidate.peer_id, candidate.ip, candidate.port)
 
-            try:
-                # if peer.connect() and self._do_handshake(peer):
-                if peer.connect():
-                    peer.send_handshake(self.peer_id)
-                    # self.peers.add(peer)
-                    self.peers.append(peer)
-            except Exception as e:
-                # self.raw_peers.remove(p)
-                logging.error(e)
+    def _new_peer(self, peer_id: Optional[bytes], ip: str, port: int) -> Peer:
+        peer: Peer = Peer(peer_id, ip, port, self.info_hash, self.bitfield_length)
+        peer.set_rate_limits(self.download_bucket, self.upload_bucket, self.throttle)
+        peer.read_block = self.listener.read_block
+        return peer
 
-        logging.debug("added peers")
+    def accept(self, transport: asyncio.Transport, handshake: bytes) -> bool:
+        """serve a peer that connected to us, False if there is no room for it"""
+        if not self.connections.can_accept:
+            return False
+
+        ip, port = transport.get_extra_info("peername")[:2]
+        peer: Peer = self._new_peer(None, ip, port)
+        peer.accept(transport, handshake)
+        return self.connections.accept(peer)
+
+    def route(
+        self, info_hash: bytes, transport: asyncio.Transport, handshake: bytes
+    ) -> bool:
+        return info_hash == self.info_hash and self.accept(transport, handshake)
 
     def remove_peer(self, peer):
         try:
-            peer.socket.close()
+            peer.close()
         except Exception as e:
             logging.exception(e)
 
-        self.peers.remove(peer)
+        if peer in self.peers:
+            self.peers.remove(peer)
+            self.choker.on_peer_dropped(peer)
+            self.listener.on_peer_dropped(peer)
         logging.debug(f"Peer - {peer.ip} removed")
 
-    def scrape_response(self, res):
-        self.raw_peers += bencodepy.decode(res)[b"peers"]
-
-    def run(self):
-        while self.is_active:
-            if len(self.peers) == 0:
-                print("No peer")
-                break
-
-            read = [peer for peer in self.peers]
-            write = [peer for peer in self.peers if peer.write_buffer != b""]
-            read_list, write_list, err = select.select(read, write, [])
-
-            for peer in write_list:
-                if not peer.healthy:
-                    self.remove_peer(peer)
-                    continue
-
-                try:
-                    peer.send()
-                except Exception as e:
-                    self.remove_peer(peer)
-                    logging.exception(e)
-                    continue
-
-            for peer in read_list:
-                if not peer.healthy:
-                    self.remove_peer(peer)
-                    continue
-
-                try:
-                    peer.receive()
-                except Exception as e:
-                    self.remove_peer(peer)
-                    logging.exception(e)
-                    continue
-
-                for msg in peer.get_messages():
-                    self._process_new_message(msg, peer)
+    def stop(self) -> None:
+        # may come before serve has started, which then returns right away
+        if self.stopped is None:
+            self.stopped = asyncio.get_running_loop().create_future()
+        if not self.stopped.done():
+            self.stopped.set_result(None)
+
+    async def serve(self) -> None:
+        """announce to the trackers and serve peers until stopped"""
+        if self.stopped is not None:
+            return
+        self.stopped = asyncio.get_running_loop().create_future()
+        if self.session is not None:
+            self.announcer.session = self.session.http_session
+        else:
+            try:
+                await self.incoming.start()
+            except OSError as e:
+                logging.warning(f"not listening for peers: {e}")
+        announcer = asyncio.ensure_future(self.announcer.run())
+        self.connections.fill()
+        self.choker.start()
+
+        await self.stopped
+
+        self.choker.close()
+        announcer.cancel()
+        await self.connections.close()
+        await asyncio.gather(announcer, return_exceptions=True)
+        if self.session is None:
+            await self.incoming.close()
+            self.throttle.close()
+
+    async def _serve_peer(self, peer: Peer) -> None:
+        peer.send_handshake(self.peer_id)
+        self.peers.append(peer)
+        self.listener.on_peer_connected(peer)
+        try:
+            await peer.run(self._process_new_message)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logging.error(e)
+        finally:
+            self.remove_peer(peer)
 
     @staticmethod
     def generate_peer_id() -> bytes:
@@ -156,52 +197,52 @@ class PeerManager(Thread):
         return peer_id.encode()
 
     def _process_new_message(self, new_message: message.Message, peer: Peer):
-        if isinstance(new_message, message.Handshake) or isinstance(
-            new_message, message.KeepAlive
-        ):
-            logging.error("Handshake or KeepALive should have already been handled")
-
-        elif isinstance(new_message, message.Choke):
-            peer.handle_choke()
-
-        elif isinstance(new_message, message.UnChoke):
-            peer.handle_unchoke()
-
-        elif isinstance(new_message, message.Interested):
-            peer.handle_interested()
+        handler: Optional[MessageHandler] = MESSAGE_HANDLERS.get(type(new_message))
+        if handler is None:
+            logging.error(f"Unknown message - {new_message}")
+            return
+        handler(self, new_message, peer)
 
-        elif isinstance(new_message, message.NotInterested):
-            peer.handle_not_interested()
+    def _on_keep_alive(self, new_message: message.KeepAlive, peer: Peer) -> None:
+        peer.handle_keep_alive()
 
-        elif isinstance(new_message, message.Have):
-            peer.handle_have(new_message)
+    def _on_choke(self, new_message: message.Choke, peer: Peer) -> None:
+        peer.handle_choke()
+        self.listener.on_choke(peer)
 
-        elif isinstance(new_message, message.Bitfield):
-            peer.handle_bitfield(new_message)
+    def _on_unchoke(self, new_message: message.UnChoke, peer: Peer) -> None:
+        peer.handle_unchoke()
+        self.listener.on_unchoke(peer)
 
-        elif isinstance(new_message, message.Request):
-            peer.handle_request(new_message)
+    def _on_interested(self, new_message: message.Interested, peer: Peer) -> None:
+        peer.handle_interested()
+        self.choker.on_interested(peer)
 
-        elif isinstance(new_message, message.Piece):
-            peer.handle_piece(new_message)
+    def _on_not_interested(
+        self, new_message: message.NotInterested, peer: Peer
+    ) -> None:
+        peer.handle_not_interested()
 
-        elif isinstance(new_message, message.Cancel):
-            peer.handle_cancel()
+    def _on_have(self, new_message: message.Have, peer: Peer) -> None:
+        if peer.handle_have(new_message):
+            self.listener.on_have(peer, new_message.piece_index)
 
-        elif isinstance(new_message, message.Port):
-            peer.handle_port_request()
+    def _on_bitfield(self, new_message: message.Bitfield, peer: Peer) -> None:
+        peer.handle_bitfield(new_message)
+        self.listener.on_bitfield(peer)
 
-        else:
-            logging.error(f"Unknown message - {new_message}")
+    def _on_request(self, new_message: message.Request, peer: Peer) -> None:
+        peer.handle_request(new_message)
 
-    def get_peer_having_piece(self, piece_index: int):
-        ready_peers = []
+    def _on_piece(self, new_message: message.Piece, peer: Peer) -> None:
+        peer.handle_piece(new_message)
+        self.listener.on_block(peer, new_message)
 
-        for peer in self.peers:
-            if peer.is_ready and peer.is_eligible and peer.has_piece(piece_index):
-                ready_peers.append(peer)
+    def _on_cancel(self, new_message: message.Cancel, peer: Peer) -> None:
+        peer.handle_cancel(new_message)
 
-        return choice(ready_peers) if ready_peers else None
+    def _on_port(self, new_message: message.Port, peer: Peer) -> None:
+        peer.handle_port_request()
 
     @property
     def has_unchoked_peers(self) -> bool:
@@ -211,12 +252,19 @@ class PeerManager(Thread):
         return False
 
 
-# TODO: 1. get trackers
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.DEBUG)
-    file_name = "../tests/data/ubuntu-20.04.1-desktop-amd64.iso.torrent"
-    #  file_name = "../tests/data/manjaro-gnome-20.1.2-201019-linux58.iso.torrent"
-    #  file_name = "../tests/data/torrent-dl.torrent"
-    torrent = Torrent()
-    torrent.open_from_file(os.path.join(BASE_DIR, file_name))
-    PeerManager(torrent)
+MessageHandler = Callable[[PeerManager, Any, Peer], None]
+
+# the handler of every message type, looked up once per message
+MESSAGE_HANDLERS: Dict[Type[message.Message], MessageHandler] = {
+    message.KeepAlive: PeerManager._on_keep_alive,
+    message.Choke: PeerManager._on_choke,
+    message.UnChoke: PeerManager._on_unchoke,
+    message.Interested: PeerManager._on_interested,
+    message.NotInterested: PeerManager._on_not_interested,
+    message.Have: PeerManager._on_have,
+    message.Bitfield: PeerManager._on_bitfield,
+    message.Request: PeerManager._on_request,
+    message.Piece: PeerManager._on_piece,
+    message.Cancel: PeerManager._on_cancel,
+    message.Port: PeerManager._on_port,
+}
@@ -0,0 +1,192 @@
+import heapq
+import socket
+import struct
+from itertools import count
+from time import monotonic
+from typing import Any, Dict, Final, Iterator, List, Optional, Tuple
+
+MAX_CANDIDATES: Final[int] = 5000
+# candidates failing this many times in a row are forgotten
+MAX_FAILURES: Final[int] = 5
+# assumed connect latency of a peer we never connected to, in seconds
+DEFAULT_LATENCY: Final[float] = 1.0
+FAILURE_PENALTY: Final[float] = 2.0
+# failed candidates are retried after RETRY_DELAY * 2 ** (failures - 1) seconds
+RETRY_DELAY: Final[float] = 15.0
+MAX_RETRY_DELAY: Final[float] = 600.0
+# delay before connecting again to a peer that closed the connection
+RECONNECT_DELAY: Final[float] = 60.0
+
+compact_peer: Final[struct.Struct] = struct.Struct(">4sH")
+compact_peer6: Final[struct.Struct] = struct.Struct(">16sH")
+Address = Tuple[str, int]
+
+
+def decode_compact_peers(peers: bytes) -> Iterator[Address]:
+    """BEP 23 compact peer list, 4 bytes of IPv4 address and 2 bytes of port"""
+    size: int = len(peers) - len(peers) % compact_peer.size
+    for ip, port in compact_peer.iter_unpack(memoryview(peers)[:size]):
+        yield socket.inet_ntoa(ip), port
+
+
+def decode_compact_peers6(peers: bytes) -> Iterator[Address]:
+    """BEP 7 compact peer list, 16 bytes of IPv6 address and 2 bytes of port"""
+    size: int = len(peers) - len(peers) % compact_peer6.size
+    for ip, port in compact_peer6.iter_unpack(memoryview(peers)[:size]):
+        yield socket.inet_ntop(socket.AF_INET6, ip), port
+
+
+def decode_peers(peers: Any) -> Iterator[Tuple[str, int, Optional[bytes]]]:
+    """(ip, port, peer id) from either the compact or the dictionary model"""
+    if isinstance(peers, bytes):
+        for ip, port in decode_compact_peers(peers):
+            yield ip, port, None
+        return
+
+    for p in peers:
+        ip = p[b"ip"]
+        yield ip.decode() if isinstance(ip, bytes) else ip, p[b"port"], p.get(
+            b"peer id"
+        )
+
+
+class Candidate:
+    """a peer we know of, with what we learned from connecting to it"""
+
+    __slots__ = (
+        "ip",
+        "port",
+        "peer_id",
+        "failures",
+        "latency",
+        "in_use",
+        "retry_at",
+        "version",
+    )
+
+    def __init__(self, ip: str, port: int, peer_id: Optional[bytes] = None):
+        self.ip: str = ip
+        self.port: int = port
+        self.peer_id: Optional[bytes] = peer_id
+        self.failures: int = 0
+        self.latency: Optional[float] = None
+        self.in_use: bool = False
+        self.retry_at: float = 0.0
+        # bumped every time the candidate is queued, older heap entries are stale
+        self.version: int = 0
+
+    @property
+    def score(self) -> float:
+        """lower is better"""
+        latency: float = DEFAULT_LATENCY if self.latency is None else self.latency
+        return latency + self.failures * FAILURE_PENALTY
+
+
+class PeerPool:
+    """deduplicated candidates to connect to, best ranked first
+
+    Candidates are keyed by (ip, port), so the same peer announced by many
+    trackers is only stored once. A heap ordered by score gives the best
+    candidate in O(log n), entries of candidates that changed are skipped lazily.
+    """
+
+    def __init__(self, max_candidates: int = MAX_CANDIDATES):
+        self.max_candidates: int = max_candidates
+        self.candidates: Dict[Address, Candidate] = {}
+        self.heap: List[Tuple[float, int, Address, int]] = []
+        self.waiting: List[Tuple[float, int, Address, int]] = []
+        self.counter: Iterator[int] = count()
+
+    def __len__(self) -> int:
+        return len(self.candidates)
+
+    def _push(self, candidate: Candidate) -> None:
+        candidate.version += 1
+        address: Address = (candidate.ip, candidate.port)
+        if candidate.retry_at > monotonic():
+            heapq.heappush(
+                self.waiting,
+                (candidate.retry_at, next(self.counter), address, candidate.version),
+            )
+            return
+
+        heapq.heappush(
+            self.heap,
+            (candidate.score, next(self.counter), address, candidate.version),
+        )
+
+    def _get(self, address: Address, version: int) -> Optional[Candidate]:
+        """the candidate of a heap entry, None if the entry is stale"""
+        candidate: Optional[Candidate] = self.candidates.get(address)
+        if candidate is None or candidate.in_use or candidate.version != version:
+            return None
+        return candidate
+
+    def _wake_up(self) -> None:
+        """move the candidates whose retry time has come to the ready heap"""
+        now: float = monotonic()
+        while self.waiting and self.waiting[0][0] <= now:
+            _, _, address, version = heapq.heappop(self.waiting)
+            candidate: Optional[Candidate] = self._get(address, version)
+            if candidate is not None:
+                self._push(candidate)
+
+    def next_retry(self) -> Optional[float]:
+        """seconds until a waiting candidate can be retried"""
+        while self.waiting:
+            retry_at, _, address, version = self.waiting[0]
+            if self._get(address, version) is not None:
+                return max(0.0, retry_at - monotonic())
+            heapq.heappop(self.waiting)
+        return None
+
+    def add(self, ip: str, port: int, peer_id: Optional[bytes] = None) -> bool:
+        if (ip, port) in self.candidates or len(self) >= self.max_candidates:
+            return False
+
+        candidate: Candidate = Candidate(ip, port, peer_id)
+        self.candidates[(ip, port)] = candidate
+        self._push(candidate)
+        return True
+
+    def add_peers(self, peers: Any, peers6: bytes = b"") -> int:
+        """add the peers of a tracker response, returns how many were new"""
+        added: int = 0
+        for ip, port, peer_id in decode_peers(peers):
+            added += self.add(ip, port, peer_id)
+        for ip, port in decode_compact_peers6(peers6):
+            added += self.add(ip, port)
+        return added
+
+    def pop(self) -> Optional[Candidate]:
+        """the best candidate not connected yet"""
+        self._wake_up()
+        while self.heap:
+            _, _, address, version = heapq.heappop(self.heap)
+            candidate: Optional[Candidate] = self._get(address, version)
+            if candidate is None:
+                continue
+
+            candidate.in_use = True
+            return candidate
+        return None
+
+    def connected(self, candidate: Candidate, latency: float) -> None:
+        candidate.failures = 0
+        candidate.latency = latency
+
+    def connect_failed(self, candidate: Candidate) -> None:
+        candidate.in_use = False
+        candidate.failures += 1
+        if candidate.failures >= MAX_FAILURES:
+            del self.candidates[(candidate.ip, candidate.port)]
+            return
+
+        delay: float = RETRY_DELAY * 2 ** (candidate.failures - 1)
+        candidate.retry_at = monotonic() + min(delay, MAX_RETRY_DELAY)
+        self._push(candidate)
+
+    def disconnected(self, candidate: Candidate) -> None:
+        candidate.in_use = False
+        candidate.retry_at = monotonic() + RECONNECT_DELAY
+        self._push(candidate)
@@ -0,0 +1,147 @@
+from random import randrange
+from typing import Dict, Final, List, Optional, Set
+
+from bitstring import BitArray
+
+# pieces picked at random before switching to rarest first, so that we quickly
+# have something to trade
+RANDOM_FIRST_PIECES: Final[int] = 4
+# a peer with at most this many pieces has them scanned instead of the buckets
+SPARSE_PIECES: Final[int] = 64
+
+
+class PiecePicker:
+    """choose which piece to download next
+
+    The availability of every piece in the swarm is updated incrementally from
+    the bitfield and have messages. Pieces that are not started yet are kept in
+    buckets by availability, so the rarest piece a peer has is found by looking
+    at the lowest buckets first instead of scanning every piece of every peer.
+    Pieces already started have strict priority over new ones.
+    """
+
+    def __init__(self, total_pieces: int):
+        self.total_pieces: int = total_pieces
+        self.availability: List[int] = [0] * total_pieces
+        self.buckets: List[Set[int]] = [set(range(total_pieces))]
+        # started pieces, in the order they were started
+        self.partial: Dict[int, None] = {}
+        # started pieces that may still have free blocks to request
+        self.requestable: Dict[int, None] = {}
+        self.wanted: bytearray = bytearray(b"\x01" * total_pieces)
+        self.completed: int = 0
+
+    def _move(self, piece_index: int, availability: int) -> None:
+        if self.wanted[piece_index] and piece_index not in self.partial:
+            self.buckets[self.availability[piece_index]].discard(piece_index)
+            while len(self.buckets) <= availability:
+                self.buckets.append(set())
+            self.buckets[availability].add(piece_index)
+        self.availability[piece_index] = availability
+
+    def add_have(self, piece_index: int) -> None:
+        self._move(piece_index, self.availability[piece_index] + 1)
+
+    def add_bitfield(self, bitfield: BitArray) -> None:
+        for piece_index in bitfield.findall([1]):
+            if piece_index < self.total_pieces:
+                self.add_have(piece_index)
+
+    def remove_bitfield(self, bitfield: BitArray) -> None:
+        for piece_index in bitfield.findall([1]):
+            if piece_index < self.total_pieces:
+                self._move(piece_index, max(0, self.availability[piece_index] - 1))
+
+    def mark_partial(self, piece_index: int) -> None:
+        if not self.wanted[piece_index] or piece_index in self.partial:
+            return
+
+        self.buckets[self.availability[piece_index]].discard(piece_index)
+        self.partial[piece_index] = None
+        self.requestable[piece_index] = None
+
+    def mark_requested(self, piece_index: int) -> None:
+        """every block of the started piece is requested"""
+        self.requestable.pop(piece_index, None)
+
+    def mark_free(self, piece_index: int) -> None:
+        """blocks of the started piece are free to request again"""
+        if piece_index in self.partial:
+            self.requestable[piece_index] = None
+
+    def mark_complete(self, piece_index: int) -> None:
+        if not self.wanted[piece_index]:
+            return
+
+        # a started piece is out of the buckets, which may not reach its
+        # availability any more
+        if piece_index in self.partial:
+            del self.partial[piece_index]
+            self.requestable.pop(piece_index, None)
+        else:
+            self.buckets[self.availability[piece_index]].discard(piece_index)
+        self.wanted[piece_index] = 0
+        self.completed += 1
+
+    def partial_pieces(self) -> List[int]:
+        return list(self.partial)
+
+    def requestable_pieces(self) -> List[int]:
+        return list(self.requestable)
+
+    def pick(self, bitfield: BitArray) -> Optional[int]:
+        """start the best new piece the peer has"""
+        piece_index: Optional[int] = (
+            self._pick_random(bitfield)
+            if self.completed + len(self.partial) < RANDOM_FIRST_PIECES
+            else self._pick_rarest(bitfield)
+        )
+
+        if piece_index is not None:
+            self.mark_partial(piece_index)
+        return piece_index
+
+    def _pick_random(self, bitfield: BitArray) -> Optional[int]:
+        have: bytes = bitfield.tobytes()
+        start: int = randrange(self.total_pieces)
+        for i in range(self.total_pieces):
+            piece_index: int = (start + i) % self.total_pieces
+            if (
+                self.wanted[piece_index]
+                and piece_index not in self.partial
+                and have[piece_index >> 3] & (0x80 >> (piece_index & 7))
+            ):
+                return piece_index
+        return None
+
+    def _pick_rarest(self, bitfield: BitArray) -> Optional[int]:
+        # the bits are tested on the bytes, indexing the BitArray is much slower
+        have: bytes = bitfield.tobytes()
+        if bin(int.from_bytes(have, "big")).count("1") <= SPARSE_PIECES:
+            return self._pick_rarest_of(bitfield)
+
+        # pieces nobody has are in bucket 0, empty buckets are skipped as sets
+        # keep their table after a discard and iterating them scans it whole
+        for bucket in self.buckets[1:]:
+            if not bucket:
+                continue
+            for piece_index in bucket:
+                if have[piece_index >> 3] & (0x80 >> (piece_index & 7)):
+                    return piece_index
+        return None
+
+    def _pick_rarest_of(self, bitfield: BitArray) -> Optional[int]:
+        """the rarest piece among the few the peer has"""
+        rarest: Optional[int] = None
+        for piece_index in bitfield.findall([1]):
+            if piece_index >= self.total_pieces:
+                break
+            availability: int = self.availability[piece_index]
+            if (
+                self.wanted[piece_index]
+                and piece_index not in self.partial
+                and availability
+                and (rarest is None or availability < self.availability[rarest])
+            ):
+                rarest = piece_index
+        return rarest
@@ -1,92 +1,141 @@
 from hashlib import sha1
-from time import time
-from typing import List, Final, Tuple, Union
+from typing import List, Optional, Tuple, Union
 import logging
-from block import Block
 from block import BLOCK_LENGTH
 from block import Status
-
-BLOCK_REQUEST_TIMEOUT: Final[int] = 5
+from buffer_pool import BufferPool
+from storage import Storage
 
 
 class Piece:
-    def __init__(self, piece_index: int, piece_size: int, piece_hash: bytes):
+    """a piece being downloaded
+
+    The status of every block is one byte of a bytearray, pieces only exist
+    while they are downloaded, a completed piece is just a bit of the bitfield.
+    """
+
+    __slots__ = (
+        "index",
+        "size",
+        "hash",
+        "blocks",
+        "completed_blocks",
+        "buffer_pool",
+        "buffer",
+        "complete",
+        "verifying",
+    )
+
+    def __init__(
+        self,
+        piece_index: int,
+        piece_size: int,
+        piece_hash: Union[bytes, memoryview],
+        buffer_pool: BufferPool,
+    ):
         self.index: int = piece_index
         self.size: int = piece_size
-        self.hash: bytes = piece_hash
-        self.blocks: List[Block] = self._init_blocks()
-        self.raw_data: bytes = b""
+        self.hash: Union[bytes, memoryview] = piece_hash
+        # status of every block
+        self.blocks: bytearray = bytearray(-(-piece_size // BLOCK_LENGTH))
+        self.completed_blocks: int = 0
+        self.buffer_pool: BufferPool = buffer_pool
+        # blocks are written in place, the buffer is only held while downloading
+        self.buffer: Optional[bytearray] = None
         self.complete: bool = False
-
-    def _init_blocks(self) -> List[Block]:
-        blocks: List[Block] = []
-        normal_block, last_block = divmod(self.size, BLOCK_LENGTH)
-        for i in range(normal_block):
-            blocks.append(Block())
-        # handling last piece
-        if last_block:
-            blocks.append(Block(last_block))
-        return blocks
-
-    def update_block_status(self) -> None:
-        for i, block in enumerate(self.blocks):
-            if (
-                block.status == Status.PENDING
-                and (time() - block.last_ping) > BLOCK_REQUEST_TIMEOUT
-            ):
-                self.blocks[i].status = Block()
+        self.verifying: bool = False
 
     def get_required_block(self) -> Union[Tuple[int, int], None]:
         if self.complete:
             return None
 
-        for block_index, block in enumerate(self.blocks):
-            if block.status == Status.FREE:
-                block.status = Status.PENDING
-                block.last_ping = time()
-                return (block_index * BLOCK_LENGTH, block.length)
+        block_index: int = self.blocks.find(Status.FREE)
+        if block_index == -1:
+            return None
 
-        return None
+        if self.buffer is None:
+            self.buffer = self.buffer_pool.get(self.size)
+            if self.buffer is None:
+                return None
 
-    def check_if_complete(self) -> bool:
-        if self.are_all_blocks_complete:
-            self.raw_data = self.merge_all_blocks()
-            if self.validate_piece():
-                self.complete = True
-                return True
-        return False
+        self.blocks[block_index] = Status.PENDING
+        block_begin: int = block_index * BLOCK_LENGTH
+        return (block_begin, self.block_length(block_begin))
 
-    def merge_all_blocks(self) -> bytes:
-        data: bytes = b""
+    def block_length(self, block_begin: int) -> int:
+        return min(BLOCK_LENGTH, self.size - block_begin)
 
-        for block in self.blocks:
-            data += block.data
+    def get_pending_blocks(self) -> List[Tuple[int, int]]:
+        """blocks requested but not received yet, as (block begin, block length)"""
+        pending: List[Tuple[int, int]] = []
+        block_index: int = self.blocks.find(Status.PENDING)
+        while block_index != -1:
+            block_begin: int = block_index * BLOCK_LENGTH
+            pending.append((block_begin, self.block_length(block_begin)))
+            block_index = self.blocks.find(Status.PENDING, block_index + 1)
+        return pending
 
-        return data
+    @property
+    def has_free_blocks(self) -> bool:
+        return Status.FREE in self.blocks
+
+    @property
+    def data(self) -> memoryview:
+        return memoryview(self.buffer)[: self.size]
 
     @property
     def are_all_blocks_complete(self) -> bool:
-        for block in self.blocks:
-            if block.status == Status.COMPLETE:
-                return True
-        return False
+        return self.completed_blocks == len(self.blocks)
 
     def validate_piece(self) -> bool:
-        hash: bytes = sha1(self.raw_data).digest()
+        hash: bytes = sha1(self.data).digest()
 
         if hash == self.hash:
             return True
 
-        raise (Exception("Invalid piece"))
-        logging.warning("Invalid piece")
-        logging.debug(f"{hash} : {self.hash}")
+        logging.warning(f"Invalid piece - {self.index}")
+        logging.debug(f"{hash.hex()} : {self.hash.hex()}")
         return False
 
-    def set_block(self, block_begin: int, block: bytes) -> None:
+    def free_block(self, block_begin: int) -> None:
+        """the block was requested but will not arrive, request it again"""
         block_index: int = block_begin // BLOCK_LENGTH
-        if not self.complete and not self.blocks[block_index].status == Status.COMPLETE:
-            self.blocks[block_index].status = Status.COMPLETE
-            self.blocks[block_index].data = block
-
-    def write_on_disk(self) -> None:
-        pass
+        if self.blocks[block_index] == Status.PENDING:
+            self.blocks[block_index] = Status.FREE
+
+    def reset(self) -> None:
+        """download all the blocks again, the buffer is kept"""
+        self.blocks = bytearray(len(self.blocks))
+        self.completed_blocks = 0
+
+    def set_block(self, block_begin: int, block: Union[bytes, memoryview]) -> bool:
+        """write the block in the piece, False if it was not needed"""
+        block_index, offset = divmod(block_begin, BLOCK_LENGTH)
+        if self.complete or self.buffer is None:
+            return False
+
+        if offset or not 0 <= block_index < len(self.blocks):
+            logging.warning(f"Wrong block offset for piece - {self.index}")
+            return False
+
+        if self.blocks[block_index] == Status.COMPLETE:
+            return False
+
+        if len(block) != self.block_length(block_begin):
+            logging.warning(f"Wrong block length for piece - {self.index}")
+            return False
+
+        self.buffer[block_begin : block_begin + len(block)] = block
+        self.blocks[block_index] = Status.COMPLETE
+        self.completed_blocks += 1
+        return True
+
+    def release_buffer(self) -> None:
+        if self.buffer is not None:
+            self.buffer_pool.put(self.buffer)
+            self.buffer = None
+
+    def write_on_disk(self, storage: Storage) -> None:
+        storage.write_piece(self.index, self.data)
+        # the piece is on disk now, only its status is kept in memory
+        self.release_buffer()
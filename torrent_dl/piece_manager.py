@@ -1,98 +1,188 @@
-from typing import List, Iterator, Tuple
-import message
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Final, Iterable, Optional, Tuple, Union
+from block import BLOCK_LENGTH
+from buffer_pool import BufferPool
 from piece import Piece
-from torrent import Torrent
+from picker import PiecePicker
+from read_cache import ReadCache
+from resume import ResumeFile, verify_pieces
+from storage import Storage
+from torrent import PieceHashes, Torrent
+from verifier import PieceVerifier
 from bitstring import BitArray
-from math import ceil
+
+# memory available for the buffers of the pieces being downloaded
+PIECE_MEMORY_BUDGET: Final[int] = 2 ** 28
 
 
 class PieceManager:
-    def __init__(self, torrent: Torrent):
-        self.total_pieces = ceil(len(torrent.pieces) / 8)
+    def __init__(
+        self,
+        torrent: Torrent,
+        download_dir: str = ".",
+        resume: bool = False,
+        on_piece_verified: Optional[Callable[[Piece, bool], None]] = None,
+        buffer_pool: Optional[BufferPool] = None,
+        hash_executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        self.total_pieces: int = len(torrent.pieces)
         self.bitfield: BitArray = BitArray(self.total_pieces)
         self.piece_length = torrent.piece_length
         self.last_piece_length = (
             torrent.total_length - (self.total_pieces - 1) * self.piece_length
         )
-        self.pieces: List[Piece] = self._init_pieces(torrent.pieces)
-        self.files = self._load_files(torrent)
+        # the pool is shared by all the torrents of a session
+        self.buffer_pool: BufferPool = buffer_pool or BufferPool(
+            max(PIECE_MEMORY_BUDGET, self.piece_length)
+        )
+        self.hashes: PieceHashes = torrent.pieces
+        # pieces being downloaded, created when they are first requested
+        self.pieces: Dict[int, Piece] = {}
+        self.picker: PiecePicker = PiecePicker(self.total_pieces)
+        # blocks received that were not needed, mostly endgame duplicates
+        self.duplicate_bytes: int = 0
+        self.storage: Storage = Storage(torrent, download_dir)
+        self.read_cache: ReadCache = ReadCache(self.storage)
+        self.verifier: PieceVerifier = PieceVerifier(
+            self.piece_verified, executor=hash_executor
+        )
+        self.on_piece_verified: Optional[Callable[[Piece, bool], None]] = (
+            on_piece_verified
+        )
+        self.closed: bool = False
+        self.resume_file: Optional[ResumeFile] = None
+        if resume:
+            self.resume_file = ResumeFile(
+                os.path.join(download_dir, f".{torrent.info_hash.hex()}.resume"),
+                torrent.info_hash,
+                self.storage,
+            )
+            self._resume(torrent.pieces)
 
     @property
     def all_pieces_completed(self) -> bool:
-        for piece in self.pieces:
-            if not piece.complete:
-                return False
-        return True
+        return self.picker.completed == self.total_pieces
+
+    def has_missing_pieces(self, bitfield: BitArray) -> bool:
+        """the peer has a piece we still miss"""
+        if self.all_pieces_completed:
+            return False
+        ours: bytes = self.bitfield.tobytes()
+        # the bitfield of the peer is cut or padded to the length of ours, the
+        # spare bits at the end are shifted out
+        spare: int = -self.total_pieces % 8
+        missing: int = ~int.from_bytes(ours, "big") >> spare
+        theirs: bytes = bitfield.tobytes()[: len(ours)].ljust(len(ours), b"\0")
+        have: int = int.from_bytes(theirs, "big") >> spare
+        return bool(have & missing)
 
-    def get_required_pieces(self) -> Iterator[int]:
-        for piece in self.pieces:
-            if not piece.complete:
-                yield piece
+    @property
+    def has_free_buffer(self) -> bool:
+        """a new piece can be started"""
+        return self.buffer_pool.available(self.piece_length)
 
-    def _init_pieces(self, raw_pieces: List[bytes]) -> List[Piece]:
-        pieces: List[Piece] = []
+    def piece_size(self, piece_index: int) -> int:
+        if piece_index == self.total_pieces - 1:
+            return self.last_piece_length
+        return self.piece_length
 
-        for i in range(self.total_pieces - 1):
-            pieces.append(Piece(i, self.piece_length, raw_pieces[i]))
+    def block_length(self, piece_index: int, block_begin: int) -> int:
+        return min(BLOCK_LENGTH, self.piece_size(piece_index) - block_begin)
 
-        # last piece
-        last_piece_index: int = self.total_pieces - 1
-        pieces.append(
-            Piece(
-                last_piece_index, self.last_piece_length, raw_pieces[last_piece_index]
+    def get_piece(self, piece_index: int) -> Piece:
+        piece: Optional[Piece] = self.pieces.get(piece_index)
+        if piece is None:
+            piece = Piece(
+                piece_index,
+                self.piece_size(piece_index),
+                self.hashes[piece_index],
+                self.buffer_pool,
             )
-        )
+            self.pieces[piece_index] = piece
+        return piece
+
+    def read_block(
+        self, piece_index: int, block_begin: int, block_length: int
+    ) -> Optional[memoryview]:
+        """a block of a verified piece, None if we don't have it"""
+        if not 0 <= piece_index < self.total_pieces or not self.bitfield[piece_index]:
+            return None
+
+        piece_size: int = self.piece_size(piece_index)
+        if block_length <= 0 or block_begin + block_length > piece_size:
+            return None
 
-        return pieces
+        piece: Optional[memoryview] = self.read_cache.get(piece_index, piece_size)
+        if piece is None:
+            return None
+        return piece[block_begin : block_begin + block_length]
 
-    def process_new_block(self, piece: Tuple[int, int, bytes]):
-        piece_index: int
-        block_begin: int
-        block: bytes
-        piece_index, block_begin, block = piece
-        self.pieces[piece_index].set_block(block_begin, block)
-        if self.pieces[piece_index].check_if_complete():
-            # self.write_piece_on_disk(self.pieces[piece_index].raw_data)
+    def _resume(self, hashes: PieceHashes) -> None:
+        """mark the pieces that are already on disk as complete"""
+        bitfield: Optional[BitArray] = self.resume_file.load(self.total_pieces)
+        if bitfield is None:
+            bitfield = BitArray(verify_pieces(self.storage, hashes))
+
+        for piece_index in bitfield.findall([1]):
             self.bitfield[piece_index] = True
+            self.picker.mark_complete(piece_index)
+
+    @property
+    def in_endgame(self) -> bool:
+        """every piece is started and every missing block is requested"""
+        if self.picker.completed + len(self.picker.partial) < self.total_pieces:
+            return False
+
+        # the pieces whose last free block was requested are dropped on the way
+        for piece_index in self.picker.requestable_pieces():
+            if self.get_piece(piece_index).has_free_blocks:
+                return False
+            self.picker.mark_requested(piece_index)
+        return True
+
+    def process_new_block(
+        self, piece_index: int, block_begin: int, block: Union[bytes, memoryview]
+    ) -> None:
+        # blocks of a piece already completed or never requested are dropped
+        piece: Optional[Piece] = self.pieces.get(piece_index)
+        if piece is None or not piece.set_block(block_begin, block):
+            self.duplicate_bytes += len(block)
+            return
+
+        if piece.are_all_blocks_complete and not piece.verifying:
+            self.verifier.submit(piece)
+
+    def free_blocks(self, blocks: Iterable[Tuple[int, int]]) -> None:
+        for piece_index, block_begin in blocks:
+            piece: Optional[Piece] = self.pieces.get(piece_index)
+            if piece is not None:
+                piece.free_block(block_begin)
+                self.picker.mark_free(piece_index)
+
+    def piece_verified(self, piece: Piece, valid: bool) -> None:
+        piece.verifying = False
+        if self.closed:
+            # hashed by the executor of the session after the torrent stopped
+            return
+
+        if not valid:
+            piece.reset()
+            self.picker.mark_free(piece.index)
+        else:
+            piece.complete = True
+            piece.write_on_disk(self.storage)
+            del self.pieces[piece.index]
+            self.bitfield[piece.index] = True
+            self.picker.mark_complete(piece.index)
+
+        if self.on_piece_verified is not None:
+            self.on_piece_verified(piece, valid)
 
-    def _load_files(self, torrent: Torrent):
-        files = []
-        piece_offset = 0
-        piece_size_used = 0
-
-        for f in torrent.file_names:
-            current_size_file = f["length"]
-            file_offset = 0
-
-            while current_size_file > 0:
-                id_piece = int(piece_offset / self.torrent.piece_length)
-                piece_size = self.pieces[id_piece].piece_size - piece_size_used
-
-                if current_size_file - piece_size < 0:
-                    file = {
-                        "length": current_size_file,
-                        "idPiece": id_piece,
-                        "fileOffset": file_offset,
-                        "pieceOffset": piece_size_used,
-                        "path": f["path"],
-                    }
-                    piece_offset += current_size_file
-                    file_offset += current_size_file
-                    piece_size_used += current_size_file
-                    current_size_file = 0
-
-                else:
-                    current_size_file -= piece_size
-                    file = {
-                        "length": piece_size,
-                        "idPiece": id_piece,
-                        "fileOffset": file_offset,
-                        "pieceOffset": piece_size_used,
-                        "path": f["path"],
-                    }
-                    piece_offset += piece_size
-                    file_offset += piece_size
-                    piece_size_used = 0
-
-                files.append(file)
-        return files
\ No newline at end of file
+    def close(self) -> None:
+        self.closed = True
+        self.verifier.close()
+        self.read_cache.clear()
+        self.storage.close()
+        if self.resume_file is not None:
+            self.resume_file.save(self.bitfield)
@@ -0,0 +1,165 @@
+import asyncio
+from time import monotonic
+from typing import Callable, Dict, Final, Optional
+
+# a bucket holds at least a full block, so a block is never split by the limit
+MIN_BURST: Final[int] = 2 ** 14
+# how often throttled connections are looked at
+TICK: Final[float] = 0.05
+RATE_INTERVAL: Final[float] = 1.0
+
+
+class TokenBucket:
+    """bytes per second allowed on a connection, a torrent or the whole session
+
+    Every bucket also draws from its parent, so a byte received by a peer counts
+    against the peer, its torrent and the session at once. Tokens are refilled
+    lazily from the elapsed time when the bucket is used, a bucket has no timer.
+    A limit of 0 means unlimited, the bucket then only measures the rate.
+    """
+
+    __slots__ = (
+        "limit",
+        "burst",
+        "tokens",
+        "parent",
+        "updated",
+        "transferred",
+        "measured",
+        "rate_transferred",
+        "rate_time",
+    )
+
+    def __init__(self, limit: float = 0, parent: Optional["TokenBucket"] = None):
+        self.limit: float = 0
+        self.burst: float = 0
+        self.tokens: float = 0
+        self.parent: Optional[TokenBucket] = parent
+        self.updated: float = monotonic()
+        self.transferred: int = 0
+        self.measured: float = 0.0
+        self.rate_transferred: int = 0
+        self.rate_time: float = self.updated
+        self.set_limit(limit)
+
+    def set_limit(self, limit: float) -> None:
+        self.limit = limit
+        self.burst = max(limit, MIN_BURST)
+        self.tokens = min(self.tokens, self.burst) if self.tokens else self.burst
+
+    def _refill(self, now: float) -> None:
+        if self.limit:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.limit
+            )
+        self.updated = now
+
+    def consume(self, nbytes: int) -> None:
+        """nbytes went through, the tokens may go negative"""
+        now: float = monotonic()
+        bucket: Optional[TokenBucket] = self
+        while bucket is not None:
+            bucket._refill(now)
+            bucket.tokens -= nbytes
+            bucket.transferred += nbytes
+            bucket._measure(now)
+            bucket = bucket.parent
+
+    def wait_time(self) -> float:
+        """seconds until this bucket and all its parents are out of debt"""
+        now: float = monotonic()
+        wait: float = 0.0
+        bucket: Optional[TokenBucket] = self
+        while bucket is not None:
+            if bucket.limit:
+                bucket._refill(now)
+                if bucket.tokens < 0:
+                    wait = max(wait, -bucket.tokens / bucket.limit)
+            bucket = bucket.parent
+        return wait
+
+    def available(self) -> Optional[float]:
+        """tokens left in the most limited bucket, None when nothing is limited"""
+        now: float = monotonic()
+        tokens: Optional[float] = None
+        bucket: Optional[TokenBucket] = self
+        while bucket is not None:
+            if bucket.limit:
+                bucket._refill(now)
+                tokens = bucket.tokens if tokens is None else min(tokens, bucket.tokens)
+            bucket = bucket.parent
+        return tokens
+
+    def _measure(self, now: float) -> None:
+        elapsed: float = now - self.rate_time
+        if elapsed < RATE_INTERVAL:
+            return
+
+        rate: float = (self.transferred - self.rate_transferred) / elapsed
+        self.measured = (self.measured + rate) / 2
+        self.rate_transferred, self.rate_time = self.transferred, now
+
+    @property
+    def rate(self) -> float:
+        """measured bytes per second"""
+        self._measure(monotonic())
+        return self.measured
+
+
+class Throttle:
+    """resume the connections held back by their buckets
+
+    All the waiting connections are looked at from a single timer, which only
+    runs while some connection is waiting, instead of a timer per connection.
+    The timer is moved earlier when a new connection needs to be resumed before
+    the ones already waiting.
+    """
+
+    def __init__(self, tick: float = TICK):
+        self.tick: float = tick
+        self.waiting: Dict[Callable[[], None], TokenBucket] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.timer_deadline: float = 0.0
+
+    def wait(self, bucket: TokenBucket, resume: Callable[[], None]) -> None:
+        """call resume once the bucket is out of debt"""
+        self.waiting[resume] = bucket
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        deadline: float = loop.time() + max(self.tick, bucket.wait_time())
+        if self.timer is None or deadline < self.timer_deadline:
+            self._arm(deadline)
+
+    def _arm(self, deadline: float) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer_deadline = deadline
+        self.timer = asyncio.get_running_loop().call_at(deadline, self._resume)
+
+    def cancel(self, resume: Callable[[], None]) -> None:
+        self.waiting.pop(resume, None)
+
+    def _resume(self) -> None:
+        self.timer = None
+        wait: Optional[float] = None
+        # resumed connections go to the back, the others keep their turn
+        for resume, bucket in list(self.waiting.items()):
+            if self.waiting.get(resume) is not bucket:
+                # cancelled or waiting again since, by one of the callbacks
+                continue
+            bucket_wait: float = bucket.wait_time()
+            if bucket_wait == 0:
+                del self.waiting[resume]
+                resume()
+            else:
+                wait = bucket_wait if wait is None else min(wait, bucket_wait)
+
+        if wait is not None:
+            deadline: float = asyncio.get_running_loop().time() + max(self.tick, wait)
+            if self.timer is None or deadline < self.timer_deadline:
+                self._arm(deadline)
+
+    def close(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.waiting.clear()
@@ -0,0 +1,52 @@
+import logging
+from collections import OrderedDict
+from typing import Final, Optional
+
+from storage import Storage
+
+READ_CACHE_SIZE: Final[int] = 2 ** 25
+
+
+class ReadCache:
+    """pieces read from disk to answer requests, least recently used are dropped
+
+    The whole piece is read when one of its blocks is requested, peers ask for
+    the blocks of a piece in order so the next requests are served from memory.
+    Dropped buffers are not reused, the transport may still be sending them.
+    """
+
+    def __init__(self, storage: Storage, max_bytes: int = READ_CACHE_SIZE):
+        self.storage: Storage = storage
+        self.max_bytes: int = max_bytes
+        self.pieces: "OrderedDict[int, bytearray]" = OrderedDict()
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, piece_index: int, piece_size: int) -> Optional[memoryview]:
+        """the piece, or None when it can't be read"""
+        piece: Optional[bytearray] = self.pieces.get(piece_index)
+        if piece is not None:
+            self.pieces.move_to_end(piece_index)
+            self.hits += 1
+            return memoryview(piece)
+
+        self.misses += 1
+        piece = bytearray(piece_size)
+        try:
+            if not self.storage.read_piece(piece_index, piece):
+                return None
+        except OSError as e:
+            logging.error(f"Piece - {piece_index} can't be read: {e}")
+            return None
+
+        while self.pieces and self.size + piece_size > self.max_bytes:
+            _, old = self.pieces.popitem(last=False)
+            self.size -= len(old)
+        self.pieces[piece_index] = piece
+        self.size += piece_size
+        return memoryview(piece)
+
+    def clear(self) -> None:
+        self.pieces.clear()
+        self.size = 0
@@ -0,0 +1,140 @@
+import logging
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+from threading import Lock
+from typing import Dict, Final, List, Optional, Tuple
+
+import bencodepy
+from bitstring import BitArray
+from storage import Storage
+from torrent import PieceHashes
+
+VERIFY_WORKERS: Final[int] = os.cpu_count() or 4
+FileStat = Tuple[int, int]
+
+
+class MappedFiles:
+    """read only memory maps of the downloaded files, opened on first use"""
+
+    def __init__(self, paths: List[str]):
+        self.paths: List[str] = paths
+        self.maps: Dict[int, Optional[mmap.mmap]] = {}
+        self.lock: Lock = Lock()
+
+    def get(self, file_index: int) -> Optional[mmap.mmap]:
+        with self.lock:
+            if file_index not in self.maps:
+                self.maps[file_index] = self._map(file_index)
+            return self.maps[file_index]
+
+    def _map(self, file_index: int) -> Optional[mmap.mmap]:
+        try:
+            with open(self.paths[file_index], mode="rb") as _file:
+                return mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+    def release(self, file_index: int) -> None:
+        with self.lock:
+            mapped = self.maps.pop(file_index, None)
+        if mapped is not None:
+            mapped.close()
+
+    def close(self) -> None:
+        for file_index in list(self.maps):
+            self.release(file_index)
+
+
+def verify_pieces(
+    storage: Storage, hashes: PieceHashes, workers: int = VERIFY_WORKERS
+) -> List[bool]:
+    """hash the data already on disk against the piece hashes"""
+    files: MappedFiles = MappedFiles(storage.paths)
+    # the last piece touching each file, after which its map can be closed
+    last_piece: Dict[int, int] = {}
+    for piece_index, spans in enumerate(storage.spans):
+        for span in spans:
+            last_piece[span.file_index] = piece_index
+
+    def digest(piece_index: int) -> Optional[bytes]:
+        piece_hash = sha1()
+        for span in storage.spans[piece_index]:
+            mapped = files.get(span.file_index)
+            # files are written sparsely, a short file may still hold the piece
+            if mapped is None or len(mapped) < span.file_offset + span.length:
+                return None
+            with memoryview(mapped) as view:
+                piece_hash.update(
+                    view[span.file_offset : span.file_offset + span.length]
+                )
+        return piece_hash.digest()
+
+    digests: List[Optional[bytes]] = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for piece_index, piece_digest in enumerate(
+                executor.map(digest, range(len(storage.spans)))
+            ):
+                digests.append(piece_digest)
+                for span in storage.spans[piece_index]:
+                    if last_piece[span.file_index] == piece_index:
+                        files.release(span.file_index)
+    finally:
+        files.close()
+
+    verified: List[bool] = hashes.compare(digests)
+    logging.info(f"{sum(verified)}/{len(verified)} pieces found on disk")
+    return verified
+
+
+class ResumeFile:
+    """bitfield of the completed pieces along with the size and mtime of every
+    file, a restart can trust the bitfield as long as no file has changed"""
+
+    def __init__(self, path: str, info_hash: bytes, storage: Storage):
+        self.path: str = path
+        self.info_hash: bytes = info_hash
+        self.storage: Storage = storage
+
+    def _file_stats(self) -> List[FileStat]:
+        stats: List[FileStat] = []
+        for path in self.storage.paths:
+            try:
+                stat = os.stat(path)
+                stats.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                stats.append((0, 0))
+        return stats
+
+    def load(self, total_pieces: int) -> Optional[BitArray]:
+        try:
+            with open(self.path, mode="rb") as _file:
+                data = bencodepy.decode(_file.read())
+
+            if data[b"info hash"] != self.info_hash:
+                return None
+
+            stats: List[FileStat] = [tuple(stat) for stat in data[b"files"]]
+            if stats != self._file_stats():
+                logging.info("Files changed since the resume file was written")
+                return None
+
+            bitfield: BitArray = BitArray(bytes=data[b"pieces"], length=total_pieces)
+        except Exception as e:
+            logging.debug(f"Resume file not usable - {e}")
+            return None
+
+        return bitfield
+
+    def save(self, bitfield: BitArray) -> None:
+        data = {
+            b"info hash": self.info_hash,
+            b"pieces": bitfield.tobytes(),
+            b"files": [list(stat) for stat in self._file_stats()],
+        }
+        tmp_path: str = self.path + ".tmp"
+        with open(tmp_path, mode="wb") as _file:
+            _file.write(bencodepy.encode(data))
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Final, List, Optional
+
+import aiohttp
+from buffer_pool import BufferPool
+from connection_manager import ConnectionLimit
+from listener import Listener
+from main import DownloadManager
+from peer_manager import PORT, PeerManager
+from ratelimit import Throttle, TokenBucket
+from torrent import Torrent
+from tracker import create_session
+from verifier import HASH_WORKERS
+
+MAX_CONNECTIONS: Final[int] = 500
+# memory available for the buffers of the pieces of all the torrents
+SESSION_MEMORY_BUDGET: Final[int] = 2 ** 29
+
+
+class Session:
+    """download many torrents in one process
+
+    All the torrents run on the same event loop and share one listening socket,
+    a cap on the open connections, a memory budget for the piece buffers, the
+    hashing threads and the tracker connection pool, so adding a torrent costs
+    no thread and no socket of its own. The download and upload limits, in bytes
+    per second and 0 for none, apply to all the torrents together. With seed
+    the torrents keep serving their pieces once complete, until stop is called.
+    """
+
+    def __init__(
+        self,
+        download_dir: str = ".",
+        port: int = PORT,
+        max_connections: int = MAX_CONNECTIONS,
+        memory_budget: int = SESSION_MEMORY_BUDGET,
+        hash_workers: int = HASH_WORKERS,
+        download_limit: int = 0,
+        upload_limit: int = 0,
+        seed: bool = False,
+    ):
+        self.download_dir: str = download_dir
+        self.seed: bool = seed
+        self.peer_id: bytes = PeerManager.generate_peer_id()
+        self.connection_limit: ConnectionLimit = ConnectionLimit(max_connections)
+        self.listener: Listener = Listener(
+            port, self.route, lambda: self.connection_limit.available
+        )
+        self.buffer_pool: BufferPool = BufferPool(memory_budget)
+        self.hash_executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=hash_workers, thread_name_prefix="verifier"
+        )
+        self.download_bucket: TokenBucket = TokenBucket(download_limit)
+        self.upload_bucket: TokenBucket = TokenBucket(upload_limit)
+        self.throttle: Throttle = Throttle()
+        self.http_session: Optional[aiohttp.ClientSession] = None
+        self.torrents: Dict[bytes, DownloadManager] = {}
+        self.tasks: Dict[bytes, asyncio.Future] = {}
+        self.stopped: Optional[asyncio.Future] = None
+
+    @property
+    def port(self) -> int:
+        return self.listener.port
+
+    def add_torrent(
+        self, torrent: Torrent, download_dir: Optional[str] = None, resume: bool = True
+    ) -> DownloadManager:
+        if torrent.info_hash in self.torrents:
+            return self.torrents[torrent.info_hash]
+
+        download = DownloadManager(
+            torrent, download_dir or self.download_dir, resume, self, self.seed
+        )
+        self.torrents[torrent.info_hash] = download
+        if self.stopped is not None:
+            self._start(torrent.info_hash)
+        return download
+
+    def _start(self, info_hash: bytes) -> None:
+        task = asyncio.ensure_future(self.torrents[info_hash].run())
+        self.tasks[info_hash] = task
+        task.add_done_callback(self._download_done)
+
+    def _download_done(self, task: asyncio.Future) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Download failed - {task.exception()!r}")
+        if all(download.done() for download in self.tasks.values()):
+            self.stop()
+
+    def route(
+        self, info_hash: bytes, transport: asyncio.Transport, handshake: bytes
+    ) -> bool:
+        """hand an incoming connection to its torrent"""
+        download: Optional[DownloadManager] = self.torrents.get(info_hash)
+        if download is None:
+            return False
+        return download.peer_manager.accept(transport, handshake)
+
+    def start(self) -> None:
+        asyncio.run(self.run())
+
+    async def run(self) -> None:
+        """download every torrent, until they are all complete or stopped"""
+        self.stopped = asyncio.get_running_loop().create_future()
+        self.http_session = create_session()
+        await self.listener.start()
+        for info_hash in list(self.torrents):
+            self._start(info_hash)
+        if not self.torrents:
+            logging.info("No torrent to download")
+
+        try:
+            await self.stopped
+        finally:
+            downloads: List[asyncio.Future] = list(self.tasks.values())
+            for download in self.torrents.values():
+                download.stop()
+            await asyncio.gather(*downloads, return_exceptions=True)
+            self.throttle.close()
+            await self.listener.close()
+            await self.http_session.close()
+            # every torrent has cancelled what it still had queued
+            self.hash_executor.shutdown(wait=False)
+
+    def stop(self) -> None:
+        if self.stopped is not None and not self.stopped.done():
+            self.stopped.set_result(None)
@@ -0,0 +1,151 @@
+import logging
+import os
+from collections import OrderedDict
+from typing import Final, List, NamedTuple, Union
+
+from torrent import Torrent
+
+MAX_OPEN_FILES: Final[int] = 64
+
+
+class Span(NamedTuple):
+    """part of a piece that lives in a single file"""
+
+    file_index: int
+    file_offset: int
+    piece_offset: int
+    length: int
+
+
+class FilePool:
+    """bounded pool of open file descriptors, least recently used are closed"""
+
+    def __init__(self, paths: List[str], max_open_files: int = MAX_OPEN_FILES):
+        self.paths: List[str] = paths
+        self.max_open_files: int = max_open_files
+        self.fds: "OrderedDict[int, int]" = OrderedDict()
+
+    def get(self, file_index: int) -> int:
+        fd = self.fds.get(file_index)
+        if fd is not None:
+            self.fds.move_to_end(file_index)
+            return fd
+
+        if len(self.fds) >= self.max_open_files:
+            _, old_fd = self.fds.popitem(last=False)
+            os.close(old_fd)
+
+        path: str = self.paths[file_index]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.fds[file_index] = fd
+        return fd
+
+    def close(self) -> None:
+        while self.fds:
+            _, fd = self.fds.popitem()
+            os.close(fd)
+
+
+class Storage:
+    """map pieces to the files of the torrent and write them in place"""
+
+    def __init__(
+        self, torrent: Torrent, base_dir: str, max_open_files: int = MAX_OPEN_FILES
+    ):
+        self.piece_length: int = torrent.piece_length
+        self.total_length: int = torrent.total_length
+        self.paths: List[str] = self._file_paths(torrent, base_dir)
+        self.lengths: List[int] = [int(f["length"]) for f in torrent.files]
+        self.spans: List[List[Span]] = self._init_spans()
+        self.files: FilePool = FilePool(self.paths, max_open_files)
+        # empty files are covered by no piece, nothing else would create them
+        for file_index, file_length in enumerate(self.lengths):
+            if not file_length:
+                self.files.get(file_index)
+
+    @staticmethod
+    def _check_part(part: str, path: str) -> str:
+        """a path component from the torrent must stay under base_dir"""
+        if (
+            part in ("", ".", "..")
+            or "/" in part
+            or os.sep in part
+            or os.path.isabs(part)
+        ):
+            raise ValueError(f"Invalid file path in torrent: {path}")
+        return part
+
+    @staticmethod
+    def _file_paths(torrent: Torrent, base_dir: str) -> List[str]:
+        name: str = Storage._check_part(torrent.name, torrent.name)
+        if not torrent.is_multi_file:
+            return [os.path.join(base_dir, name)]
+
+        paths: List[str] = []
+        for f in torrent.files:
+            parts: List[str] = [
+                Storage._check_part(part, str(f["path"]))
+                for part in str(f["path"]).split("/")
+            ]
+            paths.append(os.path.join(base_dir, name, *parts))
+        return paths
+
+    def _init_spans(self) -> List[List[Span]]:
+        """precompute for every piece which files it covers"""
+        total_pieces: int = -(-self.total_length // self.piece_length)
+        spans: List[List[Span]] = [[] for _ in range(total_pieces)]
+        torrent_offset: int = 0
+
+        for file_index, file_length in enumerate(self.lengths):
+            file_offset: int = 0
+            while file_offset < file_length:
+                piece_index, piece_offset = divmod(
+                    torrent_offset + file_offset, self.piece_length
+                )
+                length: int = min(
+                    file_length - file_offset, self.piece_length - piece_offset
+                )
+                spans[piece_index].append(
+                    Span(file_index, file_offset, piece_offset, length)
+                )
+                file_offset += length
+            torrent_offset += file_length
+
+        return spans
+
+    def write_piece(self, piece_index: int, data: Union[bytes, bytearray]) -> None:
+        view: memoryview = memoryview(data)
+
+        for span in self.spans[piece_index]:
+            fd: int = self.files.get(span.file_index)
+            chunk: memoryview = view[
+                span.piece_offset : span.piece_offset + span.length
+            ]
+            written: int = 0
+            while written < span.length:
+                written += os.pwrite(fd, chunk[written:], span.file_offset + written)
+
+        logging.debug(f"Piece - {piece_index} written on disk")
+
+    def read_piece(self, piece_index: int, buffer: bytearray) -> bool:
+        """read a piece straight into buffer, False if the files are too short"""
+        view: memoryview = memoryview(buffer)
+
+        for span in self.spans[piece_index]:
+            fd: int = self.files.get(span.file_index)
+            read: int = 0
+            while read < span.length:
+                nbytes: int = os.preadv(
+                    fd,
+                    [view[span.piece_offset + read : span.piece_offset + span.length]],
+                    span.file_offset + read,
+                )
+                if not nbytes:
+                    return False
+                read += nbytes
+
+        return True
+
+    def close(self) -> None:
+        self.files.close()
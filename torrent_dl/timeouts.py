@@ -0,0 +1,60 @@
+import asyncio
+import heapq
+from itertools import count
+from typing import Any, Callable, Final, Iterator, List, Optional, Tuple
+
+# seconds a peer has to answer a block request
+REQUEST_TIMEOUT: Final[float] = 10.0
+
+Request = Tuple[int, int]
+
+
+class RequestTimeouts:
+    """deadlines of the block requests sent to peers
+
+    Requests are kept in a heap ordered by deadline with a single timer armed
+    for the earliest one, so expiring requests costs O(expired). The deadline of
+    a request is stored in the outstanding requests of its peer, entries of
+    requests that were answered or cancelled since are skipped lazily.
+    """
+
+    def __init__(self, on_timeout: Callable[[Any, int, int], None]):
+        self.on_timeout: Callable[[Any, int, int], None] = on_timeout
+        self.heap: List[Tuple[float, int, Any, Request]] = []
+        self.counter: Iterator[int] = count()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.timer_deadline: float = 0.0
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def add(self, peer: Any, piece_index: int, block_begin: int) -> None:
+        """watch a request the peer has just been sent"""
+        request: Request = (piece_index, block_begin)
+        deadline: float = peer.outstanding[request]
+        heapq.heappush(self.heap, (deadline, next(self.counter), peer, request))
+        if self.timer is None or deadline < self.timer_deadline:
+            self._arm(deadline)
+
+    def _arm(self, deadline: float) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer_deadline = deadline
+        self.timer = asyncio.get_running_loop().call_at(deadline, self._expire)
+
+    def _expire(self) -> None:
+        self.timer = None
+        now: float = asyncio.get_running_loop().time()
+        while self.heap and self.heap[0][0] <= now:
+            deadline, _, peer, request = heapq.heappop(self.heap)
+            if peer.outstanding.get(request) == deadline:
+                self.on_timeout(peer, *request)
+
+        if self.heap:
+            self._arm(self.heap[0][0])
+
+    def close(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.heap.clear()
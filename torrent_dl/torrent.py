@@ -1,11 +1,80 @@
+import mmap
 import os
 from hashlib import sha1
-from typing import Any, Dict, List, Set, Union
+from typing import Any, Dict, Final, List, Optional, Sequence, Set, Union
 
-from bencodepy import Bencode
+from bdecode import Buffer, Decoder
 
-MetainfoType = Dict[str, Any]
+MetainfoType = Dict[bytes, Any]
 FilesType = List[Dict[str, Union[int, str]]]
+HASH_LENGTH: Final[int] = 20
+
+
+class TorrentError(Exception):
+    pass
+
+
+def text(value: bytes) -> str:
+    """strings of the metainfo are only decoded when they are used"""
+    return value.decode("utf-8", errors="replace")
+
+
+def field(values: Any, key: bytes, kind: type) -> Any:
+    """a value of a metainfo dictionary, which must be there with this type"""
+    value: Any = values.get(key) if isinstance(values, dict) else None
+    if not isinstance(value, kind):
+        raise TorrentError(f"Invalid {text(key)} in torrent")
+    return value
+
+
+def strings(value: Any, key: bytes) -> List[bytes]:
+    """a list of strings of the metainfo"""
+    if not isinstance(value, list) or not all(isinstance(v, bytes) for v in value):
+        raise TorrentError(f"Invalid {text(key)} in torrent")
+    return value
+
+
+class PieceHashes:
+    """the SHA1 hash of every piece, a view on the pieces string of the metainfo
+
+    Hashes are sliced out of the original buffer when they are looked up
+    instead of being split into a list of bytes when the torrent is opened.
+    """
+
+    __slots__ = ("view",)
+
+    def __init__(self, pieces: bytes = b""):
+        if len(pieces) % HASH_LENGTH:
+            raise ValueError("Length of pieces is not a multiple of 20")
+        self.view: memoryview = memoryview(pieces)
+
+    def __len__(self) -> int:
+        return len(self.view) // HASH_LENGTH
+
+    def __getitem__(self, piece_index: int) -> memoryview:
+        if piece_index < 0:
+            piece_index += len(self)
+        if not 0 <= piece_index < len(self):
+            raise IndexError("piece index out of range")
+
+        start: int = piece_index * HASH_LENGTH
+        return self.view[start : start + HASH_LENGTH]
+
+    def compare(self, digests: Sequence[Optional[bytes]], start: int = 0) -> List[bool]:
+        """check the digests of the pieces from start on, None never matches"""
+        expected: memoryview = self.view[
+            start * HASH_LENGTH : (start + len(digests)) * HASH_LENGTH
+        ]
+        if None not in digests and expected == b"".join(digests):
+            return [True] * len(digests)
+
+        return [
+            digest is not None and self[start + i] == digest
+            for i, digest in enumerate(digests)
+        ]
+
+    def hex(self) -> str:
+        return self.view.hex()
 
 
 class Torrent:
@@ -15,62 +84,83 @@ class Torrent:
         self.total_length: int = 0
         self.files: FilesType = []
         self.trackers: Set[str] = set()
-        self.pieces: List[bytes] = []
+        self.pieces: PieceHashes = PieceHashes()
         self.piece_length: int = 0
         self.info_hash: bytes = b""
 
     def open_from_file(self, file_name: str) -> None:
         """open torrent from a file"""
-        bc = Bencode(encoding="utf-8", encoding_fallback="value")
         try:
-            with open(file_name, mode="rb") as _file:
-                self.metainfo = bc.decode(_file.read())
-        except Exception as e:
-            print(e)
-
-        metainfo = self.metainfo
-
-        raw_info_hash = bc.encode(metainfo["info"])
-        self.info_hash = sha1(raw_info_hash).digest()
-        self.name = metainfo["info"]["name"]
-        self.piece_length = metainfo["info"]["piece length"]
-        #  self.pieces = metainfo["info"]["pieces"]
+            with open(file_name, mode="rb") as _file, mmap.mmap(
+                _file.fileno(), 0, access=mmap.ACCESS_READ
+            ) as data:
+                self.open_from_bytes(data)
+        except TorrentError:
+            raise
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise TorrentError(f"Invalid torrent {file_name}: {e!r}") from e
+
+    def open_from_bytes(self, data: Buffer) -> None:
+        """open torrent from the content of a torrent file"""
+        decoder: Decoder = Decoder(data)
+        self.metainfo = decoder.decode()
+        if not isinstance(self.metainfo, dict) or b"info" not in decoder.spans:
+            raise TorrentError("No info dictionary in torrent")
+
+        # hash the info dictionary exactly as it is in the file
+        start, end = decoder.spans[b"info"]
+        with memoryview(data) as view:
+            self.info_hash = sha1(view[start:end]).digest()
+
+        # the values are checked once here, a torrent file is untrusted input
+        info: Dict[bytes, Any] = field(self.metainfo, b"info", dict)
+        self.name = text(field(info, b"name", bytes))
+        self.piece_length = field(info, b"piece length", int)
+        if self.piece_length <= 0:
+            raise TorrentError("Invalid piece length in torrent")
         self.parse_pieces()
         self.parse_files()
+        # every piece but the last one is full, a missing hash would never match
+        if len(self.pieces) != -(-self.total_length // self.piece_length):
+            raise TorrentError("Invalid number of pieces in torrent")
         self.parse_trackers()
 
+    @property
+    def is_multi_file(self) -> bool:
+        return b"files" in self.metainfo[b"info"]
+
     def parse_pieces(self) -> None:
-        pieces = self.metainfo["info"]["pieces"]
-        block_begin: int = 0
-        block_length: int = 20
-        self.pieces = [
-            pieces[block_begin : block_begin + block_length]
-            for block_begin in range(0, len(pieces), block_length)
-        ]
+        self.pieces = PieceHashes(field(self.metainfo[b"info"], b"pieces", bytes))
 
     def parse_files(self) -> None:
         """parse all file paths and length from the metainfo"""
         path: str = ""
         length: int = 0
-        if "files" in self.metainfo["info"]:
-            for _file in self.metainfo["info"]["files"]:
-                path = "/".join(_file["path"])
-                length = _file["length"]
+        if self.is_multi_file:
+            for _file in field(self.metainfo[b"info"], b"files", list):
+                parts: List[bytes] = strings(field(_file, b"path", list), b"path")
+                path = "/".join(text(part) for part in parts)
+                length = field(_file, b"length", int)
+                if length < 0:
+                    raise TorrentError("Invalid length in torrent")
                 self.total_length += length
                 self.files.append({"path": path, "length": length})
         else:
-            path = self.metainfo["info"]["name"]
-            length = self.metainfo["info"]["length"]
+            path = self.name
+            length = field(self.metainfo[b"info"], b"length", int)
+            if length < 0:
+                raise TorrentError("Invalid length in torrent")
             self.total_length = length
             self.files.append({"path": path, "length": length})
 
     def parse_trackers(self) -> None:
         """parse list of all the trackers from metainfo"""
-        if "announce-list" in self.metainfo:
-            for trackers_list in self.metainfo["announce-list"]:
-                self.trackers.update(trackers_list)
+        if b"announce-list" in self.metainfo:
+            for trackers_list in field(self.metainfo, b"announce-list", list):
+                trackers: List[bytes] = strings(trackers_list, b"announce-list")
+                self.trackers.update(text(tracker) for tracker in trackers)
         else:
-            self.trackers.add(self.metainfo["announce"])
+            self.trackers.add(text(field(self.metainfo, b"announce", bytes)))
 
     def __repr__(self) -> str:
         res: str = ""
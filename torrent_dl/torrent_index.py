@@ -0,0 +1,179 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Final, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import bencodepy
+from bdecode import decode
+from torrent import Torrent, TorrentError
+
+INDEX_WORKERS: Final[int] = os.cpu_count() or 4
+# below this many files to parse, starting the worker processes costs more
+PARALLEL_THRESHOLD: Final[int] = 16
+CACHE_FILE_NAME: Final[str] = ".torrent-index"
+CACHE_VERSION: Final[int] = 1
+FileStat = Tuple[int, int]
+
+
+class IndexEntry(NamedTuple):
+    """what the session needs to know about a torrent without opening it"""
+
+    info_hash: bytes
+    path: str
+    name: str
+    total_length: int
+    file_count: int
+    trackers: Tuple[str, ...]
+
+
+def index_file(path: str) -> Union[IndexEntry, str]:
+    """the entry of a torrent file, or why it could not be opened"""
+    torrent: Torrent = Torrent()
+    try:
+        torrent.open_from_file(path)
+    except TorrentError as e:
+        return str(e)
+
+    return IndexEntry(
+        torrent.info_hash,
+        path,
+        torrent.name,
+        torrent.total_length,
+        len(torrent.files),
+        tuple(sorted(torrent.trackers)),
+    )
+
+
+class TorrentIndex:
+    """every .torrent file of a directory keyed by info hash
+
+    Files are parsed in a process pool and the entries are cached on disk along
+    with the size and mtime of their file, so a restart only parses the files
+    that were added or changed since.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        cache_path: Optional[str] = None,
+        workers: int = INDEX_WORKERS,
+    ):
+        self.directory: str = directory
+        self.cache_path: str = cache_path or os.path.join(directory, CACHE_FILE_NAME)
+        self.workers: int = workers
+        self.entries: Dict[bytes, IndexEntry] = {}
+        # error of every file that could not be opened, by path
+        self.errors: Dict[str, str] = {}
+        # files parsed by the last load, the others came from the cache
+        self.parsed: int = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, info_hash: bytes) -> bool:
+        return info_hash in self.entries
+
+    def __getitem__(self, info_hash: bytes) -> IndexEntry:
+        return self.entries[info_hash]
+
+    def __iter__(self) -> Iterator[IndexEntry]:
+        return iter(self.entries.values())
+
+    def open(self, info_hash: bytes) -> Torrent:
+        torrent: Torrent = Torrent()
+        torrent.open_from_file(self.entries[info_hash].path)
+        return torrent
+
+    def _scan(self) -> Dict[str, FileStat]:
+        stats: Dict[str, FileStat] = {}
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".torrent") and entry.is_file():
+                    stat = entry.stat()
+                    stats[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    def _load_cache(self) -> Dict[str, Tuple[FileStat, IndexEntry]]:
+        try:
+            with open(self.cache_path, mode="rb") as _file:
+                data = decode(_file.read())
+            if data[b"version"] != CACHE_VERSION:
+                return {}
+
+            cached: Dict[str, Tuple[FileStat, IndexEntry]] = {}
+            for path, (size, mtime, info_hash, name, length, count, trackers) in data[
+                b"files"
+            ].items():
+                entry = IndexEntry(
+                    info_hash,
+                    path.decode(),
+                    name.decode(),
+                    length,
+                    count,
+                    tuple(tracker.decode() for tracker in trackers),
+                )
+                cached[entry.path] = ((size, mtime), entry)
+        except Exception as e:
+            logging.debug(f"Torrent index cache not usable - {e!r}")
+            return {}
+
+        return cached
+
+    def _save_cache(self, stats: Dict[str, FileStat]) -> None:
+        files = {}
+        for entry in self.entries.values():
+            size, mtime = stats[entry.path]
+            files[entry.path.encode()] = [
+                size,
+                mtime,
+                entry.info_hash,
+                entry.name.encode(),
+                entry.total_length,
+                entry.file_count,
+                [tracker.encode() for tracker in entry.trackers],
+            ]
+
+        tmp_path: str = self.cache_path + ".tmp"
+        with open(tmp_path, mode="wb") as _file:
+            _file.write(bencodepy.encode({b"version": CACHE_VERSION, b"files": files}))
+        os.replace(tmp_path, self.cache_path)
+
+    def _parse(self, paths: List[str]) -> List[Union[IndexEntry, str]]:
+        if len(paths) < PARALLEL_THRESHOLD or self.workers <= 1:
+            return [index_file(path) for path in paths]
+
+        chunksize: int = max(1, len(paths) // (self.workers * 4))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(index_file, paths, chunksize=chunksize))
+
+    def load(self) -> None:
+        """index the directory, parsing only the files not in the cache"""
+        stats: Dict[str, FileStat] = self._scan()
+        cached: Dict[str, Tuple[FileStat, IndexEntry]] = self._load_cache()
+
+        self.entries.clear()
+        self.errors.clear()
+        to_parse: List[str] = []
+        for path, stat in stats.items():
+            if path in cached and cached[path][0] == stat:
+                self._add(cached[path][1])
+            else:
+                to_parse.append(path)
+
+        self.parsed = len(to_parse)
+        for path, result in zip(to_parse, self._parse(to_parse)):
+            if isinstance(result, str):
+                logging.warning(result)
+                self.errors[path] = result
+            else:
+                self._add(result)
+
+        if to_parse or len(cached) != len(self.entries):
+            self._save_cache(stats)
+        logging.info(f"{len(self)} torrents indexed, {self.parsed} parsed")
+
+    def _add(self, entry: IndexEntry) -> None:
+        if entry.info_hash in self.entries:
+            logging.warning(f"{entry.path} is the same torrent as another file")
+            return
+        self.entries[entry.info_hash] = entry
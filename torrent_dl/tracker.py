@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Final, Iterable, List, Optional, Union
+from urllib.parse import urlencode
+
+import aiohttp
+import bencodepy
+from yarl import URL
+
+ANNOUNCE_TIMEOUT: Final[float] = 10.0
+# used when the tracker doesn't send an interval or can't be reached
+DEFAULT_INTERVAL: Final[int] = 1800
+RETRY_INTERVAL: Final[int] = 60
+MAX_CONNECTIONS: Final[int] = 20
+ParamsType = Dict[str, Union[bytes, int, str]]
+
+
+class TrackerError(Exception):
+    pass
+
+
+def parse_interval(value: Any, default: int) -> int:
+    """seconds given by the tracker, a value that is not a positive int is
+    replaced by the default"""
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return value
+    return default
+
+
+class TrackerResponse:
+    def __init__(self, content: bytes):
+        response: Dict[bytes, Any] = bencodepy.decode(content)
+
+        if b"failure reason" in response:
+            raise TrackerError(response[b"failure reason"].decode(errors="replace"))
+
+        # a list of dictionaries, or a compact string of IPv4 peers (BEP 23)
+        self.peers: Any = response.get(b"peers", [])
+        self.peers6: bytes = response.get(b"peers6", b"")
+        self.interval: int = parse_interval(response.get(b"interval"), DEFAULT_INTERVAL)
+        self.min_interval: int = parse_interval(response.get(b"min interval"), 0)
+
+
+class Tracker:
+    def __init__(self, url: str):
+        self.url: str = url
+        self.interval: int = DEFAULT_INTERVAL
+        self.min_interval: int = 0
+        self.announces: int = 0
+
+    @property
+    def next_announce(self) -> int:
+        """seconds to wait before announcing again, never less than the retry
+        interval so that a tracker answering 0 isn't hammered"""
+        return max(self.interval, self.min_interval, RETRY_INTERVAL)
+
+    async def announce(
+        self, session: aiohttp.ClientSession, params: ParamsType
+    ) -> TrackerResponse:
+        # info_hash and peer_id are raw bytes, the query has to be encoded here
+        separator: str = "&" if "?" in self.url else "?"
+        url: URL = URL(self.url + separator + urlencode(params), encoded=True)
+
+        async with session.get(url) as response:
+            content: bytes = await response.read()
+
+        tracker_response = TrackerResponse(content)
+        self.interval = tracker_response.interval
+        self.min_interval = tracker_response.min_interval
+        self.announces += 1
+        return tracker_response
+
+
+def create_session() -> aiohttp.ClientSession:
+    """pooled session to announce with"""
+    timeout = aiohttp.ClientTimeout(total=ANNOUNCE_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS)
+    return aiohttp.ClientSession(timeout=timeout, connector=connector)
+
+
+class Announcer:
+    """announce to all the trackers concurrently and keep re-announcing
+
+    Every tracker runs in its own task on a shared pooled session, so a slow or
+    dead tracker only delays its own peers. Peers are handed to on_peers as soon
+    as each tracker answers.
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        get_params: Callable[[], ParamsType],
+        on_peers: Callable[[TrackerResponse], None],
+        session: Optional[aiohttp.ClientSession] = None,
+    ):
+        self.trackers: List[Tracker] = [
+            Tracker(url) for url in urls if url.startswith(("http://", "https://"))
+        ]
+        self.get_params: Callable[[], ParamsType] = get_params
+        self.on_peers: Callable[[TrackerResponse], None] = on_peers
+        # a session given by the caller is shared and is not closed here
+        self.session: Optional[aiohttp.ClientSession] = session
+
+    async def run(self) -> None:
+        if not self.trackers:
+            logging.warning("No supported tracker to announce to")
+            return
+
+        if self.session is not None:
+            await asyncio.gather(*(self._run_tracker(t) for t in self.trackers))
+            return
+
+        self.session = create_session()
+        try:
+            await asyncio.gather(*(self._run_tracker(t) for t in self.trackers))
+        finally:
+            await self.session.close()
+            self.session = None
+
+    async def _run_tracker(self, tracker: Tracker) -> None:
+        while True:
+            delay: int = RETRY_INTERVAL
+            try:
+                response = await tracker.announce(self.session, self.get_params())
+                logging.debug(f"successfully connected to tracker: {tracker.url}")
+                self.on_peers(response)
+                delay = tracker.next_announce
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Error in tracker: {tracker.url} - {e!r}")
+
+            await asyncio.sleep(delay)
@@ -0,0 +1,62 @@
+import asyncio
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Final, Optional
+
+from piece import Piece
+
+HASH_WORKERS: Final[int] = 4
+
+
+class PieceVerifier:
+    """check the hash of completed pieces on a pool of worker threads
+
+    hashlib releases the GIL while hashing large buffers, so pieces are verified
+    in parallel with the network. The result of every piece is handed to
+    on_verified back on the event loop.
+    """
+
+    def __init__(
+        self,
+        on_verified: Callable[[Piece, bool], None],
+        workers: int = HASH_WORKERS,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        # an executor given by the session is shared and is not shut down here
+        self.owns_executor: bool = executor is None
+        self.executor: ThreadPoolExecutor = executor or ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="verifier"
+        )
+        self.on_verified: Callable[[Piece, bool], None] = on_verified
+        # hashes queued or running, cancelled from here when the torrent stops
+        self.pending: Dict[concurrent.futures.Future, asyncio.Future] = {}
+        self.closed: bool = False
+
+    def submit(self, piece: Piece) -> None:
+        piece.verifying = True
+        work: concurrent.futures.Future = self.executor.submit(piece.validate_piece)
+        future: asyncio.Future = asyncio.wrap_future(work)
+        self.pending[work] = future
+        future.add_done_callback(lambda future: self._done(piece, work, future))
+
+    def _done(
+        self, piece: Piece, work: concurrent.futures.Future, future: asyncio.Future
+    ) -> None:
+        self.pending.pop(work, None)
+        if self.closed or future.cancelled():
+            return
+        valid: bool = future.exception() is None and future.result()
+        self.on_verified(piece, valid)
+
+    def close(self) -> None:
+        """drop the pieces still queued, without blocking the event loop on the
+        ones being hashed, their results are ignored"""
+        self.closed = True
+        # a work item cancelled before a worker took it is never run, the ones
+        # running report to a cancelled future, even once the loop is closed
+        for work, future in self.pending.items():
+            work.cancel()
+            future.cancel()
+        self.pending.clear()
+        if self.owns_executor:
+            self.executor.shutdown(wait=False)
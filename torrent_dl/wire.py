@@ -0,0 +1,108 @@
+from struct import Struct
+from typing import Final, Iterator, Optional
+
+from block import BLOCK_LENGTH
+
+BUFFER_SIZE: Final[int] = 2 ** 18
+MIN_FREE_SPACE: Final[int] = 2 ** 15
+# a block message with its header, peers send nothing larger but the bitfield
+MAX_FRAME_SIZE: Final[int] = BLOCK_LENGTH + 13
+
+length_prefix: Final[Struct] = Struct(">I")
+
+
+class FrameBuffer:
+    """Preallocated receive buffer for length prefixed messages
+
+    The socket writes straight into the free tail of the buffer (recv_into) and
+    complete frames are handed out as memoryview slices, so the payload of a
+    message is not copied until its consumer decides to keep it. Unread bytes are
+    moved to the front only when the tail runs out of space, which in the steady
+    state means copying at most one partial frame.
+
+    A frame is only valid until the next call to get_buffer, consumers that need
+    to keep the data must copy it out before returning to the event loop.
+
+    The length prefix comes from the remote peer, a frame longer than max_frame
+    is a protocol error and raises ValueError instead of growing the buffer.
+    """
+
+    def __init__(self, size: int = BUFFER_SIZE, max_frame: int = MAX_FRAME_SIZE):
+        self.max_frame: int = max_frame
+        self.buffer: bytearray = bytearray(size)
+        self.view: memoryview = memoryview(self.buffer)
+        self.start: int = 0
+        self.end: int = 0
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def get_buffer(self) -> memoryview:
+        """free space to receive into"""
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif len(self.buffer) - self.end < MIN_FREE_SPACE:
+            self._compact()
+
+        return self.view[self.end :]
+
+    def advance(self, nbytes: int) -> None:
+        """mark nbytes received into the buffer returned by get_buffer"""
+        self.end += nbytes
+
+    def missing(self) -> int:
+        """bytes still to receive to complete the frame being received"""
+        if not len(self):
+            return 0
+        if len(self) < length_prefix.size:
+            return length_prefix.size - len(self)
+
+        return max(0, self._frame_length() - len(self))
+
+    def read(self, nbytes: int) -> Optional[memoryview]:
+        """consume exactly nbytes, or nothing if not enough is buffered"""
+        if len(self) < nbytes:
+            return None
+
+        data: memoryview = self.view[self.start : self.start + nbytes]
+        self.start += nbytes
+        return data
+
+    def frames(self) -> Iterator[memoryview]:
+        """yield every complete <length prefix><message> frame in the buffer"""
+        while len(self) >= length_prefix.size:
+            total_length: int = self._frame_length()
+
+            if len(self) < total_length:
+                self._reserve(total_length)
+                return
+
+            frame: memoryview = self.view[self.start : self.start + total_length]
+            self.start += total_length
+            yield frame
+
+    def _frame_length(self) -> int:
+        """length of the frame at the start of the buffer, with its prefix"""
+        (payload_length,) = length_prefix.unpack_from(self.buffer, self.start)
+        total_length: int = payload_length + length_prefix.size
+        if total_length > self.max_frame:
+            raise ValueError(f"Frame of {total_length} bytes is too long")
+        return total_length
+
+    def _compact(self) -> None:
+        pending: int = len(self)
+        self.buffer[:pending] = self.buffer[self.start : self.end]
+        self.start, self.end = 0, pending
+
+    def _reserve(self, nbytes: int) -> None:
+        """make sure a frame of nbytes fits in the buffer"""
+        if nbytes <= len(self.buffer):
+            return
+
+        # a new buffer is allocated instead of resizing, frames handed out earlier
+        # keep referring to the old one
+        pending: int = len(self)
+        buffer: bytearray = bytearray(max(nbytes, 2 * len(self.buffer)))
+        buffer[:pending] = self.view[self.start : self.end]
+        self.buffer, self.view = buffer, memoryview(buffer)
+        self.start, self.end = 0, pending